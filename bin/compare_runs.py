@@ -0,0 +1,24 @@
+import argparse
+from pathlib import Path
+
+from eval.telemetry import DEFAULT_THRESHOLD, compare_runs, find_runs, load_events
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Compare the telemetry of two engine runs to spot performance regressions')
+    parser.add_argument('runs', nargs='+',
+                        help='two telemetry files (old and new), or an output directory to compare its last two runs')
+    parser.add_argument('-t', '--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='flag the metrics slower per example by this ratio (default: %(default)s)')
+    args = parser.parse_args()
+
+    if len(args.runs) == 1 and Path(args.runs[0]).is_dir():
+        runs = find_runs(args.runs[0])[-2:]
+        if len(runs) < 2:
+            parser.error('{} has fewer than two runs'.format(args.runs[0]))
+    elif len(args.runs) == 2:
+        runs = args.runs
+    else:
+        parser.error('expect two telemetry files or one output directory')
+
+    print('old: {}\nnew: {}\n'.format(*runs))
+    print(compare_runs(load_events(runs[0]), load_events(runs[1]), args.threshold))
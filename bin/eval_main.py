@@ -1,7 +1,9 @@
 import argparse
 
 from eval.config_parser import load_config
+from eval.consts import SERVER_SOCKET
 from eval.engine import Engine
+from eval.utils import parse_size
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser('Run the automatic evaluation engine')
@@ -9,12 +11,164 @@ if __name__ == '__main__':
     parser.add_argument('-p', '--prefix', help='path to output directory')
     parser.add_argument('-f', '--force', action='store_true',
                         help='force to overwrite existing files (default is to skip)')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of worker processes to run under_tests in (default is serial)')
+    parser.add_argument('-m', '--max-memory', type=parse_size,
+                        help='memory budget for cached resources, e.g. 16G (default is no limit)')
+    parser.add_argument('--explain', action='store_true',
+                        help='print why each under_test is rerun or skipped')
+    split_group = parser.add_mutually_exclusive_group()
+    split_group.add_argument('-s', '--shard-size', type=int,
+                             help='run metrics over shards of this many examples, checkpointing each shard '
+                                  'so that an interrupted run resumes (default is not to shard)')
+    split_group.add_argument('-b', '--batch-size', type=int,
+                             help='stream the corpora to metrics in batches of this many examples, '
+                                  'keeping memory flat (default is to load whole corpora)')
+    parser.add_argument('-t', '--tolerance', type=float,
+                        help='approximate each system score on random examples, stopping when the half width '
+                             'of its 95%% confidence interval is below this (default is exact scores). '
+                             'Only the metrics whose system score is the mean of the utterance scores are approximated')
+    parser.add_argument('--profile', choices=('cpu', 'mem'),
+                        help='profile loading, computing and exporting each under_test with cProfile (cpu) or '
+                             'tracemalloc (mem), saving the profiles and a summary under PREFIX/.profile')
+    parser.add_argument('--plan', action='store_true',
+                        help='list every under_test with its status and estimated cost, then exit without running')
+    parser.add_argument('-o', '--overlap-external', action='store_true',
+                        help='run metrics on external tools (adem, meteor...) asynchronously, '
+                             'computing the other metrics meanwhile')
+    parser.add_argument('--tool-limit', action='append', default=[], metavar='TOOL=N',
+                        help='max number of concurrent runs of an external tool, e.g. meteor=4')
+    parser.add_argument('--serve', action='store_true',
+                        help='run a scoring server keeping the resources loaded, instead of evaluating')
+    parser.add_argument('--socket', default=SERVER_SOCKET,
+                        help='the Unix socket of the scoring server (default: %(default)s)')
+    parser.add_argument('--port', type=int, help='serve on or connect to this local TCP port instead of the socket')
+    parser.add_argument('--no-server', action='store_true',
+                        help='evaluate locally even if a scoring server is running')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='sample the outdated responses of the models that can sample, '
+                             'scoring them while they are written')
+    parser.add_argument('--sampler', action='append', default=[], metavar='RESPONSES=CMD',
+                        help='run CMD writing the RESPONSES file, scoring it while it is written')
+    parser.add_argument('--watch', action='store_true',
+                        help='keep running, re-evaluating the under_tests whose model or dataset files change')
+    parser.add_argument('--settle', type=float, metavar='SECONDS',
+                        help='with --watch, how long a file must stay unchanged before it is evaluated')
+    parser.add_argument('--sweep', action='append', default=[], metavar='MODEL_DIR',
+                        help='evaluate every checkpoint of the Serban model in MODEL_DIR and print a table of '
+                             'their scores, sampling the responses of the checkpoints that have none')
+    parser.add_argument('--no-sample', action='store_true',
+                        help='with --sweep, skip the checkpoints without responses instead of sampling them')
+    queue_group = parser.add_mutually_exclusive_group()
+    queue_group.add_argument('--publish', metavar='QUEUE_DIR',
+                             help='publish the outdated under_tests as work items in a shared dir')
+    queue_group.add_argument('--worker', metavar='QUEUE_DIR',
+                             help='claim and run work items from a shared dir until it is drained')
+    queue_group.add_argument('--merge', metavar='QUEUE_DIR',
+                             help='assemble the score files from the finished work items in a shared dir')
+    parser.add_argument('--lease', type=int, help='seconds before the lease of a work item expires')
     args = parser.parse_args()
 
+    queue = None
+    if args.worker or args.merge:
+        from eval.workqueue import WorkQueue
+
+        # workers and merge take the settings of the publisher.
+        queue = WorkQueue(args.worker or args.merge)
+        settings = queue.settings
+        args.config = settings['config']
+        args.prefix = settings['save_dir']
+        args.shard_size = settings['shard_size']
+
     if args.config:
         config = load_config(args.config)
     else:
         from eval.repo import default_config as config
 
-    engine = Engine(config, args.prefix, args.force)
-    engine.run()
+    tool_limits = {}
+    for limit in args.tool_limit:
+        tool, _, n = limit.partition('=')
+        tool_limits[tool] = int(n)
+
+    if args.serve:
+        import logging
+        from eval.config_parser import parse_dataset, parse_metrics, parse_models
+        from eval.server import ScoringService, serve
+
+        logging.basicConfig(level=logging.INFO)
+        # only the models and datasets of the config can be evaluated on the server.
+        service = ScoringService(parse_metrics(config['metrics']), parse_models(config['models']),
+                                 parse_dataset(config['datasets']), batch_size=args.batch_size,
+                                 max_memory=args.max_memory)
+        serve(service, args.socket, args.port)
+        parser.exit(0)
+
+    if args.sweep:
+        from eval.sweep import find_sweep_models
+
+        sweep_models = find_sweep_models(args.sweep, sample=not args.no_sample)
+        config = dict(config, models=sweep_models)
+
+    server = None
+    # the work queue runs the under_tests and their shards locally, and merges from the local checkpoints.
+    if not args.no_server and not args.plan and not (args.publish or args.worker or args.merge):
+        from eval.server import get_client
+
+        # dispatch to a running scoring server transparently.
+        server = get_client(args.socket, args.port)
+
+    engine = Engine(config, args.prefix, args.force, jobs=args.jobs, max_memory=args.max_memory,
+                    explain=args.explain, shard_size=args.shard_size,
+                    overlap_external=args.overlap_external, tool_limits=tool_limits,
+                    batch_size=args.batch_size, server=server, tolerance=args.tolerance, profile=args.profile)
+    if args.plan:
+        from eval.plan import format_plan
+
+        print(format_plan(engine.plan(), args.jobs))
+    elif args.publish:
+        from eval.workqueue import WorkQueue, publish
+
+        publish(engine, WorkQueue(args.publish), args.config)
+    elif args.worker:
+        from eval.workqueue import work
+
+        if args.lease:
+            queue.lease_seconds = args.lease
+        work(engine, queue)
+    elif args.merge:
+        from eval.workqueue import merge
+
+        merge(engine, queue)
+    elif args.sweep:
+        from eval.sweep import sweep
+
+        print(sweep(engine, sweep_models))
+    elif args.watch:
+        from eval.watch import watch, DEFAULT_SETTLE_SECONDS
+
+        watch(engine, args.settle if args.settle is not None else DEFAULT_SETTLE_SECONDS)
+    elif args.pipeline or args.sampler:
+        import subprocess
+        from pathlib import Path
+
+        samplers = {}
+        for sampler in args.sampler:
+            responses, _, cmd = sampler.partition('=')
+            # the old responses must not be taken for new ones.
+            if Path(responses).exists():
+                Path(responses).unlink()
+            samplers[responses] = subprocess.Popen(cmd, shell=True)
+        if args.pipeline:
+            models = {under_test.model.responses: under_test.model for under_test in engine.under_tests}
+            for responses, model in models.items():
+                if hasattr(model, 'sample') and responses not in samplers:
+                    process = model.sample(wait=False)
+                    if process is not None:
+                        samplers[responses] = process
+        engine.run_pipelined(samplers)
+    else:
+        engine.run()
+        if args.profile:
+            from eval.profiling import SUMMARY
+
+            print(engine.profiler.profile_dir.joinpath(SUMMARY).read_text())
@@ -0,0 +1,19 @@
+import argparse
+
+from eval.rouge_sweep import sweep
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Compute the ROUGE scores of other alphas and weights from the saved stats')
+    parser.add_argument('-p', '--prefix', required=True, help='the output directory of the engine')
+    parser.add_argument('under_tests', nargs='+', help='the prefixes of ROUGE under_tests, e.g. hred-ubuntu-rouge_l')
+    parser.add_argument('-a', '--alpha', type=float, nargs='+', required=True, help='the alphas to sweep')
+    parser.add_argument('-w', '--weight', type=float, nargs='+', default=[None],
+                        help='the weights of ROUGE-W to sweep (default: the weight of the stats)')
+    args = parser.parse_args()
+
+    print('\t'.join(['under_test', 'alpha', 'weight', 'precision', 'recall', 'f1_measure']))
+    for under_test in args.under_tests:
+        for result in sweep(args.prefix, under_test, args.alpha, args.weight):
+            system = result['system']
+            print('\t'.join([under_test, str(result['alpha']), str(result['weight'])] +
+                            ['{:.4f}'.format(value) for value in system[:3]]))
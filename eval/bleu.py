@@ -0,0 +1,265 @@
+"""
+A one-pass BLEU engine. The clipped n-gram matches and the lengths of each pair are extracted once,
+and BLEU of every order and every smoothing method of Chen and Cherry (2014), at sentence and corpus level,
+is derived from them.
+
+The scores are the same as nltk's sentence_bleu and corpus_bleu, including their quirks:
+the smoothing of a corpus sees the references and hypothesis of its last pair, and the precisions
+that are still zero after smoothing are left out of the geometric mean.
+"""
+import collections
+import math
+import sys
+from fractions import Fraction
+
+from nltk.translate.bleu_score import SmoothingFunction
+
+# the orders of BLEU-1..4, which most callers share.
+MAX_ORDER = 4
+# methods 5 and 7 look at the 5-gram precision whatever the order of BLEU.
+SMOOTHING_ORDER = 5
+SMOOTHING_METHODS = tuple(range(8))
+DEFAULT_SMOOTHING = SmoothingFunction()
+# number of corpora whose pair stats are kept for the other orders and methods.
+CACHE_SIZE = 4
+
+# numerators and denominators are tuples indexed by order - 1.
+PairStats = collections.namedtuple('PairStats', 'numerators denominators hyp_len ref_len')
+
+
+def count_ngrams(tokens, max_order):
+    """
+    Count the n-grams of all the orders 1..max_order in one Counter, as tuples whose length is their order.
+    """
+    tokens = tuple(tokens)
+    length = len(tokens)
+    return collections.Counter([tokens[i:i + n] for n in range(1, max_order + 1) for i in range(length - n + 1)])
+
+
+def get_pair_stats(references, hypothesis, max_order=MAX_ORDER):
+    """
+    Compute the clipped n-gram matches of hypothesis against references for the orders 1..max_order,
+    as nltk's modified_precision does, and the lengths for the brevity penalty, as closest_ref_length does.
+    """
+    counts = count_ngrams(hypothesis, max_order)
+    if len(references) == 1:
+        max_counts = count_ngrams(references[0], max_order)
+    else:
+        max_counts = collections.Counter()
+        for reference in references:
+            max_counts |= count_ngrams(reference, max_order)
+    numerators = [0] * max_order
+    for ngram, count in counts.items():
+        max_count = max_counts.get(ngram)
+        if max_count:
+            numerators[len(ngram) - 1] += min(count, max_count)
+    hyp_len = len(hypothesis)
+    denominators = tuple(max(1, hyp_len - n + 1) for n in range(1, max_order + 1))
+    ref_len = min((len(reference) for reference in references), key=lambda length: (abs(length - hyp_len), length))
+    return PairStats(tuple(numerators), denominators, hyp_len, ref_len)
+
+
+def get_method(smoothing):
+    """
+    :param smoothing: either a bool, for method1 or no smoothing, or the number of a method of Chen and Cherry.
+    """
+    if isinstance(smoothing, bool):
+        method = 1 if smoothing else 0
+    else:
+        method = smoothing
+    if method not in SMOOTHING_METHODS:
+        raise ValueError('unknown smoothing method: {}'.format(smoothing))
+    return method
+
+
+def get_max_order(n, method):
+    return max(MAX_ORDER, n, SMOOTHING_ORDER if method in (5, 7) else 0)
+
+
+def brevity_penalty(ref_len, hyp_len):
+    if hyp_len > ref_len:
+        return 1
+    if hyp_len == 0:
+        return 0
+    return math.exp(1 - ref_len / hyp_len)
+
+
+def smooth(numerators, denominators, method, last, hyp_len, cherry=DEFAULT_SMOOTHING):
+    """
+    Apply a smoothing method to the precisions, with the same arithmetic as nltk's SmoothingFunction,
+    so that the floats are the same to the last bit.
+
+    :param numerators: the clipped matches of the orders 1..n.
+    :param denominators: the n-gram counts of the orders 1..n.
+    :param method: the number of the method, 0 for no smoothing.
+    :param last: the PairStats of the last pair, which nltk passes as references and hypothesis.
+    :param hyp_len: the length of the hypotheses.
+    :param cherry: a SmoothingFunction with the parameters of the methods.
+    :return: the smoothed precisions, as Fractions or floats.
+    """
+    if method not in SMOOTHING_METHODS:
+        raise ValueError('unknown smoothing method: {}'.format(method))
+    orders = list(zip(numerators, denominators))
+    if method == 0:
+        return [num / den if num else sys.float_info.min for num, den in orders]
+    if method == 1:
+        return [(num + cherry.epsilon) / den if num == 0 else num / den for num, den in orders]
+    if method == 2:
+        return [(num + 1) / (den + 1) if i else num / den for i, (num, den) in enumerate(orders)]
+    if method == 3:
+        p_n = []
+        incvnt = 1
+        for num, den in orders:
+            if num == 0:
+                p_n.append(1 / (2 ** incvnt * den))
+                incvnt += 1
+            else:
+                p_n.append(num / den)
+        return p_n
+
+    # methods 4..7 are chained or do arithmetic on the precisions, which nltk does on exact Fractions.
+    p_n = [Fraction(num, den) for num, den in orders]
+    hyp_len = hyp_len if hyp_len else last.hyp_len
+    if method in (4, 7):
+        incvnt = 1
+        for i, (num, den) in enumerate(orders):
+            if num == 0 and hyp_len > 1:
+                numerator = 1 / (2 ** incvnt * cherry.k / math.log(hyp_len))
+                p_n[i] = numerator / den
+                incvnt += 1
+    if method in (5, 7):
+        p_n_plus1 = p_n + [Fraction(last.numerators[SMOOTHING_ORDER - 1], last.denominators[SMOOTHING_ORDER - 1])]
+        m = {-1: p_n[0] + 1}
+        for i, p_i in enumerate(p_n):
+            p_n[i] = (m[i - 1] + p_i + p_n_plus1[i + 1]) / 3
+            m[i] = p_n[i]
+    if method == 6:
+        assert p_n[2], 'This smoothing method requires non-zero precision for bigrams.'
+        for i in range(2, len(p_n)):
+            pi0 = 0 if p_n[i - 2] == 0 else p_n[i - 1] ** 2 / p_n[i - 2]
+            # the n-grams of the last hypothesis, not of the corpus.
+            length = max(0, last.hyp_len - i)
+            p_n[i] = (numerators[i] + cherry.alpha * pi0) / (length + cherry.alpha)
+    return p_n
+
+
+def get_weights(n):
+    return [1 / n for _ in range(n)]
+
+
+def bleu_from_stats(numerators, denominators, hyp_len, ref_len, last, weights, method=0,
+                    cherry=DEFAULT_SMOOTHING):
+    """
+    Compute BLEU from summed pair stats, as nltk's corpus_bleu does.
+
+    :param last: the PairStats of the last pair.
+    :param weights: the weights of the orders 1..len(weights).
+    :param method: the smoothing method.
+    :return:
+    """
+    n = len(weights)
+    bp = brevity_penalty(ref_len, hyp_len)
+    if numerators[0] == 0:
+        return 0
+    p_n = smooth(numerators[:n], denominators[:n], method, last, hyp_len, cherry)
+    s = (w_i * math.log(p_i) for w_i, p_i in zip(weights, p_n) if p_i > 0)
+    return bp * math.exp(math.fsum(s))
+
+
+def sentence_bleu(stats: PairStats, weights, method=0, cherry=DEFAULT_SMOOTHING):
+    return bleu_from_stats(stats.numerators, stats.denominators, stats.hyp_len, stats.ref_len, stats, weights,
+                           method, cherry)
+
+
+class CorpusBleuStats:
+    """
+    The sufficient statistics of nltk's corpus_bleu, accumulated one pair at a time
+    so that the corpus need not be held in memory.
+    """
+
+    def __init__(self, max_order=MAX_ORDER):
+        self.max_order = max_order
+        self.numerators = [0] * max_order
+        self.denominators = [0] * max_order
+        self.hyp_len = 0
+        self.ref_len = 0
+        self.last = None
+
+    def add(self, references, hypothesis):
+        stats = get_pair_stats(references, hypothesis, self.max_order)
+        self.add_stats(stats)
+        return stats
+
+    def add_stats(self, stats: PairStats):
+        for i in range(self.max_order):
+            self.numerators[i] += stats.numerators[i]
+            self.denominators[i] += stats.denominators[i]
+        self.hyp_len += stats.hyp_len
+        self.ref_len += stats.ref_len
+        self.last = stats
+
+    def corpus_bleu(self, weights, method=0, cherry=DEFAULT_SMOOTHING):
+        """
+        Compute the same value as corpus_bleu(list_of_references, hypotheses, weights, smoothing_function).
+        """
+        return bleu_from_stats(self.numerators, self.denominators, self.hyp_len, self.ref_len, self.last, weights,
+                               method, cherry)
+
+
+class BleuStatsCache:
+    """
+    The pair stats of the last few corpora, so that the BLEU of every order and smoothing method
+    on the same corpus extracts the n-grams only once.
+
+    Corpora are told apart by identity, as the loader hands out the same objects for the same files.
+    The corpora are kept alive by the cache, so that their ids are not reused, until the loader evicts
+    a resource and clears the cache.
+    """
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self.entries = collections.OrderedDict()
+
+    def get(self, references, hypotheses, max_order=MAX_ORDER):
+        """
+        :param references: one reference per pair, or an NgramIndex of them.
+        :param hypotheses:
+        :param max_order:
+        :return: a list of PairStats with at least max_order orders.
+        """
+        key = (id(references), id(hypotheses))
+        entry = self.entries.get(key)
+        if entry is not None and entry[2] >= max_order:
+            self.entries.move_to_end(key)
+            return entry[3]
+        stats = self.compute(references, hypotheses, max_order)
+        self.entries[key] = (references, hypotheses, max_order, stats)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return stats
+
+    def compute(self, references, hypotheses, max_order):
+        if hasattr(references, 'get_pair_stats'):
+            return references.get_pair_stats(hypotheses, max_order)
+        return [get_pair_stats([reference], hypothesis, max_order)
+                for reference, hypothesis in zip(references, hypotheses)]
+
+    def clear(self):
+        self.entries.clear()
+
+
+stats_cache = BleuStatsCache()
+
+
+def corpus_bleu_from_pairs(pair_stats, weights, method=0, cherry=DEFAULT_SMOOTHING):
+    """
+    Compute corpus BLEU from the stats of every pair.
+    """
+    if not pair_stats:
+        return 0
+    numerators = [sum(column) for column in zip(*(stats.numerators for stats in pair_stats))]
+    denominators = [sum(column) for column in zip(*(stats.denominators for stats in pair_stats))]
+    hyp_len = sum(stats.hyp_len for stats in pair_stats)
+    ref_len = sum(stats.ref_len for stats in pair_stats)
+    return bleu_from_stats(numerators, denominators, hyp_len, ref_len, pair_stats[-1], weights, method, cherry)
@@ -0,0 +1,81 @@
+import logging
+import pickle
+import shutil
+from pathlib import Path
+
+from eval.consts import SHARDS_DIR
+from eval.manifest import get_metric_params, get_code_version
+from eval.utils import open_atomic
+
+logger = logging.getLogger(__name__)
+
+META_FILE = 'meta.pkl'
+
+
+def get_shard_ranges(num_examples, shard_size):
+    return [
+        (start, min(start + shard_size, num_examples))
+        for start in range(0, num_examples, shard_size)
+    ]
+
+
+def get_shard_payload(payload, keys, start, stop):
+    shard = dict(payload)
+    for key in keys:
+        shard[key] = payload[key][start:stop]
+    return shard
+
+
+def pickle_atomic(obj, filename: Path):
+    with open_atomic(filename, 'wb') as f:
+        pickle.dump(obj, f)
+
+
+class ShardCheckpoint:
+    """
+    The utterance scores of the finished shards of an under_test, saved one file per shard.
+    The checkpoint is discarded when the inputs, the metric or the sharding changed since it was made.
+    """
+
+    def __init__(self, save_dir, under_test, filenames, num_examples, shard_size):
+        self.dir = Path(save_dir).joinpath(SHARDS_DIR, under_test.prefix)
+        self.meta = dict(
+            inputs={key: self.stat_file(file) for key, file in sorted(filenames.items())},
+            params=get_metric_params(under_test.metric),
+            version=get_code_version(under_test.metric),
+            num_examples=num_examples,
+            shard_size=shard_size,
+        )
+        self.validate()
+
+    @staticmethod
+    def stat_file(file: Path):
+        if not file.is_file():
+            return None
+        stat = file.stat()
+        return stat.st_size, stat.st_mtime_ns
+
+    def validate(self):
+        meta_file = self.dir.joinpath(META_FILE)
+        if meta_file.exists():
+            if pickle.loads(meta_file.read_bytes()) == self.meta:
+                return
+            logger.info('discarding stale checkpoint {}'.format(self.dir))
+            self.remove()
+        self.dir.mkdir(parents=True, exist_ok=True)
+        pickle_atomic(self.meta, meta_file)
+
+    def get_shard_file(self, index):
+        return self.dir.joinpath('{:06d}.pkl'.format(index))
+
+    def load(self, index):
+        shard_file = self.get_shard_file(index)
+        if not shard_file.exists():
+            return None
+        return pickle.loads(shard_file.read_bytes())
+
+    def save(self, index, utterance):
+        pickle_atomic(utterance, self.get_shard_file(index))
+
+    def remove(self):
+        shutil.rmtree(str(self.dir), ignore_errors=True)
@@ -1,6 +1,8 @@
 CONTEXTS = 'contexts'
 RESPONSES = 'responses'
 REFERENCES = 'references'
+# the n-gram index of the references.
+REFERENCE_NGRAMS = 'reference_ngrams'
 VOCABULARY = 'vocabulary'
 TRAIN_SET = 'train_set'
 
@@ -17,6 +19,25 @@ GOOGLE_NEWS_300_BIN = '/home/cgsdfc/embeddings/word2vec/GoogleNews_negative300/G
 # The name of the dump of config.
 CONFIG_JSON = 'config.json'
 
+# The record of the inputs, params and code version of each output.
+# It has no .json suffix so that it is not mistaken for a score file.
+BUILD_MANIFEST = '.build_manifest'
+
+# The runtimes of past runs per (metric, dataset).
+RUN_HISTORY = '.run_history'
+
+# The dir under save_dir holding the per-shard checkpoints of unfinished under_tests.
+SHARDS_DIR = '.shards'
+
+# The dir under save_dir holding the profiles of the last run with --profile.
+PROFILE_DIR = '.profile'
+
+# The dir under save_dir holding the telemetry of each run, one JSONL file per run.
+TELEMETRY_DIR = '.telemetry'
+
+# The dir under save_dir holding the sufficient stats of the utterance scores of the metrics that have them.
+STATS_DIR = '.stats'
+
 # The char that separates different params: model, dataset and metric.
 SEPARATOR = '-'
 
@@ -34,6 +55,9 @@ SERBAN_UBUNTU_MODEL_DIR = '/home/cgsdfc/UbuntuDialogueCorpus/ResponseContextPair
 
 SERBAN_TWITTER_MODEL_DIR = '/home/cgsdfc/TwitterDialogueCorpus/ModelResponses'
 
+# where the scoring server listens by default.
+SERVER_SOCKET = '/tmp/eval_server.sock'
+
 # for ADEM
 ADEM_ROOT = '/home/cgsdfc/deployment/Metrics/AutoTuring/ADEM-1-master'
 ADEM_OUTPUT_FILE = 'adem_output.txt'
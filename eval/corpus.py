@@ -0,0 +1,306 @@
+"""
+Corpora and embeddings as flat numpy arrays, which can be moved to shared memory so that worker processes
+attach to them instead of holding copies of their own.
+
+A tokenized corpus is a buffer of token ids plus the offsets of its sentences, and an embeddings table
+is a matrix with one row per word. Both keep their vocabulary as a buffer of newline-separated tokens.
+Pickling a shared resource only pickles the names of its shared memory blocks.
+"""
+import array
+import multiprocessing
+import collections.abc
+import os
+import shutil
+import sys
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+SHM_DIR = '/dev/shm'
+
+
+def attach_shared_memory(name, creator_pid):
+    """
+    Attach to a block of shared memory without tracking it, as only its creator unlinks it.
+
+    :param name: the name of the block.
+    :param creator_pid: the pid of the process which created the block.
+    :return: the SharedMemory.
+    """
+    if sys.version_info >= (3, 13):
+        return SharedMemory(name=name, track=False)
+    shm = SharedMemory(name=name)
+    # before 3.13, attaching registers the block with the resource tracker of this process,
+    # which warns of a leak and unlinks it when the process exits.
+    # the creator and its children share a tracker, where registering again does nothing,
+    # but unregistering would drop the registration of the creator.
+    parent = multiprocessing.parent_process()
+    if creator_pid != os.getpid() and (parent is None or parent.pid != creator_pid):
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+class SharedArray:
+    """
+    A numpy array in a block of shared memory.
+    Only the process creating the block owns it, and unlinks it when done.
+    """
+
+    def __init__(self, shm, shape, dtype, owner, creator_pid):
+        self.shm = shm
+        self.owner = owner
+        self.creator_pid = creator_pid
+        self.array = np.ndarray(shape, dtype, buffer=shm.buf)
+
+    @classmethod
+    def from_array(cls, data):
+        if os.path.isdir(SHM_DIR) and shutil.disk_usage(SHM_DIR).free < data.nbytes:
+            # tmpfs would rather kill us with SIGBUS when writing to it.
+            raise MemoryError('not enough space in {} for {} bytes'.format(SHM_DIR, data.nbytes))
+        # a block cannot be empty.
+        shm = SharedMemory(create=True, size=max(data.nbytes, 1))
+        shared = cls(shm, data.shape, data.dtype, owner=True, creator_pid=os.getpid())
+        shared.array[...] = data
+        shared.array.flags.writeable = False
+        return shared
+
+    @classmethod
+    def attach(cls, name, shape, dtype, creator_pid):
+        shared = cls(attach_shared_memory(name, creator_pid), shape, dtype, owner=False, creator_pid=creator_pid)
+        shared.array.flags.writeable = False
+        return shared
+
+    def __reduce__(self):
+        return self.attach, (self.shm.name, self.array.shape, self.array.dtype.str, self.creator_pid)
+
+    def unlink(self):
+        if self.owner:
+            self.shm.unlink()
+            self.owner = False
+
+
+class Vocabulary:
+    """
+    A bidirectional mapping between tokens and ids.
+    """
+
+    def __init__(self, tokens=()):
+        self.tokens = list(tokens)
+        self.index = {token: i for i, token in enumerate(self.tokens)}
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def __contains__(self, token):
+        return token in self.index
+
+    def add(self, token):
+        id = self.index.get(token)
+        if id is None:
+            id = self.index[token] = len(self.tokens)
+            self.tokens.append(token)
+        return id
+
+    def encode(self, tokens):
+        return [self.add(token) for token in tokens]
+
+    def decode(self, ids):
+        tokens = self.tokens
+        return [tokens[id] for id in ids]
+
+    def to_array(self):
+        return np.frombuffer('\n'.join(self.tokens).encode(), dtype=np.uint8)
+
+    @classmethod
+    def from_array(cls, data):
+        if not len(data):
+            return cls()
+        return cls(data.tobytes().decode().split('\n'))
+
+
+class SharedResource:
+    """
+    A resource made of numpy arrays, each of which may be a SharedArray.
+    """
+
+    def __init__(self, *sources):
+        self.sources = sources
+        self.arrays = [getattr(source, 'array', source) for source in sources]
+
+    @property
+    def is_shared(self):
+        return all(isinstance(source, SharedArray) for source in self.sources)
+
+    def share(self):
+        """
+        Copy the resource to shared memory.
+        """
+        if self.is_shared:
+            return self
+        return self.__class__(*map(SharedArray.from_array, self.arrays))
+
+    def unlink(self):
+        for source in self.sources:
+            if isinstance(source, SharedArray):
+                source.unlink()
+
+    def __reduce__(self):
+        return self.__class__, self.sources
+
+
+class EmbeddingTable(SharedResource, collections.abc.Mapping):
+    """
+    A read-only mapping from word to vector, stored as a matrix.
+    """
+
+    def __init__(self, vocab, vectors):
+        super().__init__(vocab, vectors)
+        self.vectors = self.arrays[1]
+        self._vocab = None
+
+    @property
+    def vocab(self):
+        if self._vocab is None:
+            self._vocab = Vocabulary.from_array(self.arrays[0])
+        return self._vocab
+
+    @classmethod
+    def from_mapping(cls, embeddings):
+        vocab = Vocabulary(embeddings.keys())
+        if vocab.tokens:
+            vectors = np.stack([embeddings[word] for word in vocab.tokens])
+        else:
+            vectors = np.empty((0, 0), dtype=np.float32)
+        return cls(vocab.to_array(), vectors)
+
+    def __getitem__(self, word):
+        return self.vectors[self.vocab.index[word]]
+
+    def __contains__(self, word):
+        return word in self.vocab.index
+
+    def __iter__(self):
+        return iter(self.vocab.tokens)
+
+    def __len__(self):
+        return len(self.vectors)
+
+
+class TokenIdCorpus(SharedResource, collections.abc.Sequence):
+    """
+    A read-only list of sentences as lists of token ids, stored as one buffer of ids.
+    The sentences are not decoded: metrics compare and hash the ids,
+    which all corpora of a dataset draw from the vocabulary of the dataset.
+    Slicing it or taking some of its sentences gives a corpus of the same vocabulary.
+
+    In the process which made it, the vocabulary is the live one, which the other corpora of the dataset
+    may still extend. Sharing the corpus shares a snapshot of its tokens, which holds all the ids of the corpus.
+    """
+
+    def __init__(self, vocab, ids, offsets):
+        if isinstance(vocab, Vocabulary):
+            # not an array until shared, as the vocabulary may grow.
+            super().__init__(None, ids, offsets)
+            self._vocab = vocab
+        else:
+            super().__init__(vocab, ids, offsets)
+            self._vocab = None
+        _, self.ids, self.offsets = self.arrays
+
+    @property
+    def vocab(self):
+        # decoded lazily and once per process.
+        if self._vocab is None:
+            self._vocab = Vocabulary.from_array(self.arrays[0])
+        return self._vocab
+
+    @classmethod
+    def from_token_lists(cls, token_lists, vocab):
+        return cls.from_id_lists((vocab.encode(tokens) for tokens in token_lists), vocab)
+
+    @classmethod
+    def from_id_lists(cls, id_lists, vocab):
+        ids = array.array('i')
+        offsets = array.array('q', [0])
+        for sentence in id_lists:
+            ids.extend(sentence)
+            offsets.append(len(ids))
+        return cls(vocab, np.array(ids, dtype=np.int32), np.array(offsets, dtype=np.int64))
+
+    @property
+    def is_shared(self):
+        return all(isinstance(source, SharedArray) for source in self.sources[1:])
+
+    def share(self):
+        if self.is_shared:
+            return self
+        shared = self.__class__(SharedArray.from_array(self.vocab.to_array()),
+                                *map(SharedArray.from_array, self.arrays[1:]))
+        shared._vocab = self.vocab
+        return shared
+
+    def __reduce__(self):
+        if self.sources[0] is None:
+            return self.__class__, (self.vocab,) + self.sources[1:]
+        return super().__reduce__()
+
+    def get_ids(self, index):
+        """
+        The token ids of the sentence at index.
+        """
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('sentence index out of range')
+        return self.ids[self.offsets[index]:self.offsets[index + 1]].tolist()
+
+    def iter_ids(self):
+        ids = self.ids
+        offsets = self.offsets.tolist()
+        for start, stop in zip(offsets, offsets[1:]):
+            yield ids[start:stop].tolist()
+
+    def take(self, indices):
+        """
+        The sentences at indices, in that order.
+        """
+        return self.from_id_lists(map(self.get_ids, indices), self.vocab)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return self.take(range(start, stop, step))
+            stop = max(start, stop)
+            # a view of the ids of the slice.
+            offsets = self.offsets[start:stop + 1]
+            return self.__class__(self.vocab, self.ids[offsets[0]:offsets[-1]], offsets - offsets[0])
+        return self.get_ids(index)
+
+    def __iter__(self):
+        return self.iter_ids()
+
+
+class IdCorpus(TokenIdCorpus):
+    """
+    A read-only list of token lists, stored as token ids of a vocabulary of its own, which it decodes.
+    Slicing it gives a list of token lists.
+    """
+
+    @classmethod
+    def from_token_lists(cls, token_lists, vocab=None):
+        return super().from_token_lists(token_lists, Vocabulary() if vocab is None else vocab)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return self.vocab.decode(self.get_ids(index))
+
+    def __iter__(self):
+        decode = self.vocab.decode
+        for ids in self.iter_ids():
+            yield decode(ids)
@@ -0,0 +1,255 @@
+"""
+A one-pass diversity engine. The n-grams of every order of a corpus of responses are counted at once,
+as the 64-bit hashes of eval.ngram_index, and give both the sentence level and the corpus level of
+distinct-n (Li et al., 2016) and entropy-n (Zhang et al., 2018).
+
+The corpus counts are accumulated batch by batch, so a streaming run needs no corpus in memory but those
+counts. For outputs too large even for them, the distinct n-grams are counted approximately by a HyperLogLog
+sketch (Flajolet et al., 2007; Ertl, 2017) of 2 ** precision registers, whose relative standard error is
+1.04 / sqrt(2 ** precision), e.g. 0.8% with precision 14 in 16KB per order.
+"""
+import collections
+import math
+
+import numpy as np
+
+from eval.ngram_index import count_ngrams
+
+MAX_ORDER = 4
+DEFAULT_PRECISION = 14
+# number of corpora whose stats are kept for the other orders and metrics.
+CACHE_SIZE = 4
+
+# per sentence: its length and the number of distinct n-grams and the entropy of the n-grams of each order,
+# the last two as arrays of shape (sentences, max_order).
+SentenceStats = collections.namedtuple('SentenceStats', 'lengths distinct entropy')
+
+
+def get_entropy(groups, counts, num_groups):
+    """
+    The entropy of the n-gram counts of each group, in nats, 0 for an empty group.
+    """
+    counts = counts.astype(np.float64)
+    totals = np.bincount(groups, weights=counts, minlength=num_groups)
+    weighted = np.bincount(groups, weights=counts * np.log(counts), minlength=num_groups)
+    entropy = np.zeros(num_groups)
+    nonzero = totals > 0
+    entropy[nonzero] = np.log(totals[nonzero]) - weighted[nonzero] / totals[nonzero]
+    return entropy
+
+
+class NgramCounter:
+    """
+    The exact counts of the n-gram hashes of one order. The counts of the batches are merged
+    only when they outgrow the merged counts, so that the merging costs O(n log n) in total.
+    """
+
+    def __init__(self):
+        self.hashes = np.zeros(0, dtype=np.uint64)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.pending = []
+        self.pending_size = 0
+
+    def add(self, hashes, counts):
+        self.pending.append((hashes, counts))
+        self.pending_size += len(hashes)
+        if self.pending_size > len(self.hashes):
+            self.merge()
+
+    def merge(self):
+        if not self.pending:
+            return
+        hashes = np.concatenate([self.hashes] + [hashes for hashes, _ in self.pending])
+        counts = np.concatenate([self.counts] + [counts.astype(np.int64) for _, counts in self.pending])
+        self.hashes, inverse = np.unique(hashes, return_inverse=True)
+        self.counts = np.bincount(inverse.ravel(), weights=counts, minlength=len(self.hashes)).astype(np.int64)
+        self.pending = []
+        self.pending_size = 0
+
+    def distinct(self):
+        self.merge()
+        return len(self.hashes)
+
+    def entropy(self):
+        self.merge()
+        return get_entropy(np.zeros(len(self.counts), dtype=np.int64), self.counts, 1)[0]
+
+
+def mix(hashes):
+    """
+    The finalizer of splitmix64, so that every bit of the n-gram hashes is uniform.
+    """
+    hashes = hashes ^ (hashes >> np.uint64(30))
+    hashes = hashes * np.uint64(0xBF58476D1CE4E5B9)
+    hashes = hashes ^ (hashes >> np.uint64(27))
+    hashes = hashes * np.uint64(0x94D049BB133111EB)
+    return hashes ^ (hashes >> np.uint64(31))
+
+
+def bit_length(values):
+    """
+    The bit length of each uint64, exactly, by halves that a float64 holds without rounding.
+    """
+    high = (values >> np.uint64(32)).astype(np.float64)
+    low = (values & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    return np.where(high > 0, 32 + np.frexp(high)[1], np.frexp(low)[1])
+
+
+# the sigma and tau series of the estimator of Ertl (2017).
+def get_sigma(x):
+    if x == 1:
+        return math.inf
+    y = 1
+    z = x
+    while True:
+        x *= x
+        previous = z
+        z += x * y
+        y += y
+        if z == previous:
+            return z
+
+
+def get_tau(x):
+    if x == 0 or x == 1:
+        return 0.0
+    y = 1.0
+    z = 1 - x
+    while True:
+        x = math.sqrt(x)
+        previous = z
+        y *= 0.5
+        z -= (1 - x) ** 2 * y
+        if z == previous:
+            return z / 3
+
+
+class HyperLogLog:
+    """
+    An approximate count of the distinct n-gram hashes of one order in 2 ** precision bytes.
+    """
+
+    def __init__(self, precision=DEFAULT_PRECISION):
+        if not 4 <= precision <= 18:
+            raise ValueError('precision must be in [4, 18]: {}'.format(precision))
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def add(self, hashes, counts=None):
+        hashes = mix(hashes)
+        rest_bits = 64 - self.precision
+        buckets = (hashes >> np.uint64(rest_bits)).astype(np.int64)
+        rest = hashes & np.uint64((1 << rest_bits) - 1)
+        # the position of the first 1 bit of the rest.
+        ranks = (rest_bits + 1 - bit_length(rest)).astype(np.uint8)
+        np.maximum.at(self.registers, buckets, ranks)
+
+    def distinct(self):
+        # the improved estimator of Ertl (2017), which is unbiased for small and large cardinalities alike.
+        m = len(self.registers)
+        q = 64 - self.precision
+        histogram = np.bincount(self.registers, minlength=q + 2).astype(np.float64)
+        total = m * get_tau(1 - histogram[q + 1] / m)
+        for k in range(q, 0, -1):
+            total = 0.5 * (total + histogram[k])
+        total += m * get_sigma(histogram[0] / m)
+        return m * m / (2 * math.log(2)) / total
+
+    def entropy(self):
+        raise ValueError('the entropy needs the exact counts of the n-grams')
+
+
+class DiversityStats:
+    """
+    The corpus-level counts of the n-grams of every order, accumulated one batch of responses at a time.
+    """
+
+    def __init__(self, max_order=MAX_ORDER, precision=None):
+        """
+        :param max_order:
+        :param precision: the precision of the HyperLogLog sketches, None to count exactly.
+        """
+        self.max_order = max_order
+        self.precision = precision
+        if precision is None:
+            self.counters = [NgramCounter() for _ in range(max_order)]
+        else:
+            self.counters = [HyperLogLog(precision) for _ in range(max_order)]
+        self.num_tokens = 0
+
+    def add(self, token_lists):
+        """
+        Count the n-grams of a batch.
+
+        :return: the SentenceStats of the batch.
+        """
+        groups, hashes, counts, lengths = count_ngrams(token_lists, self.max_order)
+        num_groups = len(lengths) * self.max_order
+        orders = groups % self.max_order
+        for order, counter in enumerate(self.counters):
+            selected = orders == order
+            counter.add(hashes[selected], counts[selected])
+        self.num_tokens += int(lengths.sum())
+        shape = (len(lengths), self.max_order)
+        distinct = np.bincount(groups, minlength=num_groups).reshape(shape)
+        entropy = get_entropy(groups, counts, num_groups).reshape(shape)
+        return SentenceStats(lengths, distinct, entropy)
+
+    def distinct_n(self, n):
+        """
+        The distinct n-grams of the corpus over its tokens, as Li et al. define it.
+        """
+        if not self.num_tokens:
+            return 0.0
+        return self.counters[n - 1].distinct() / self.num_tokens
+
+    def entropy_n(self, n):
+        return self.counters[n - 1].entropy()
+
+
+def get_distinct_n(sentences: SentenceStats, n):
+    """
+    The distinct n-grams of each sentence over its length, as distinct_n_sentence_level() of distinct_n.
+    """
+    distinct = sentences.distinct[:, n - 1]
+    lengths = sentences.lengths
+    return [int(d) / int(length) if length else 0.0 for d, length in zip(distinct, lengths)]
+
+
+def get_entropy_n(sentences: SentenceStats, n):
+    return sentences.entropy[:, n - 1].tolist()
+
+
+class DiversityStatsCache:
+    """
+    The stats of the last few corpora, so that every order of distinct-n and entropy-n of a corpus
+    counts its n-grams only once. Corpora are told apart by identity and kept alive, as by bleu.BleuStatsCache,
+    until the loader evicts a resource.
+    """
+
+    def __init__(self, size=CACHE_SIZE):
+        self.size = size
+        self.entries = collections.OrderedDict()
+
+    def get(self, responses, max_order=MAX_ORDER, precision=None):
+        """
+        :return: the DiversityStats of responses and their SentenceStats.
+        """
+        key = (id(responses), precision)
+        entry = self.entries.get(key)
+        if entry is not None and entry[1].max_order >= max_order:
+            self.entries.move_to_end(key)
+            return entry[1], entry[2]
+        stats = DiversityStats(max_order, precision)
+        sentences = stats.add(responses)
+        self.entries[key] = (responses, stats, sentences)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return stats, sentences
+
+    def clear(self):
+        self.entries.clear()
+
+
+stats_cache = DiversityStatsCache()
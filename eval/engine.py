@@ -1,12 +1,25 @@
+import asyncio
+import collections
+import concurrent.futures
 import itertools
 import logging
 import pprint
+import threading
+import time
 from pathlib import Path
 
+from eval.checkpoint import ShardCheckpoint, get_shard_ranges, get_shard_payload
 from eval.config_parser import parse_models_and_datasets, parse_metrics
+from eval.consts import RESPONSES
 from eval.exporter import Exporter
+from eval.history import RunHistory
 from eval.loader import ResourceLoader
-from eval.utils import UnderTest
+from eval.manifest import BuildManifest
+from eval.profiling import Profiler, profile_phase
+from eval.progressive import can_progress, compute_progressive
+from eval.scheduler import CostModel, Scheduler
+from eval.telemetry import Telemetry
+from eval.utils import UnderTest, MemorySampler
 
 logger = logging.getLogger(__name__)
 
@@ -20,48 +33,479 @@ def parse_config(config):
     ]
 
 
+def plan_order(under_tests, loader: ResourceLoader):
+    """
+    Order under_tests so that those sharing a resource run back to back.
+    Each under_test is keyed by its resources from the largest to the smallest, so that the
+    largest resource (e.g. the embeddings) stays resident for all its consumers, and within them
+    the under_tests on the same responses and references are adjacent.
+
+    :param under_tests:
+    :param loader:
+    :return:
+    """
+
+    def sort_key(under_test):
+        resource_keys = sorted(loader.get_resource_keys(under_test), key=loader.estimate_size, reverse=True)
+        return tuple((-loader.estimate_size(key), str(key[0])) for key in resource_keys)
+
+    return sorted(under_tests, key=sort_key)
+
+
+class Evaluator:
+    """
+    Evaluate a single UnderTest: load its resources, compute the scores and export them.
+    The same Evaluator runs in the main process (serial mode) and in each worker (parallel mode).
+    """
+
+    def __init__(self, exporter: Exporter, loader: ResourceLoader, shard_size=None, batch_size=None, tolerance=None,
+                 profiler=None):
+        self.exporter = exporter
+        self.loader = loader
+        self.shard_size = shard_size
+        self.batch_size = batch_size
+        # if set, approximate the scores on random examples until the CI half width is below it.
+        self.tolerance = tolerance
+        self.profiler = profiler
+
+    def is_streaming(self, under_test):
+        metric = under_test.metric
+        return bool(self.batch_size and metric.streaming and self.loader.can_stream(under_test, metric.shard_keys))
+
+    def __call__(self, under_test):
+        try:
+            return self.evaluate(under_test)
+        finally:
+            self.loader.release(under_test)
+
+    def evaluate(self, under_test):
+        """
+        Evaluate under_test.
+
+        :param under_test:
+        :return: a dict of the stats of this run, or None if the resources were unavailable.
+        """
+        logger.info('Running under_test: %r', under_test)
+        streaming = self.is_streaming(under_test)
+        start = time.perf_counter()
+        cache_hits, cache_misses = self.loader.cache_hits, self.loader.cache_misses
+        # the memory of this under_test alone, not counting the resources that earlier ones left resident.
+        with MemorySampler() as memory:
+            with profile_phase(self.profiler, under_test, 'load'):
+                # the corpora of a streaming metric are read batch by batch later.
+                payload = self.loader.load_resources(under_test,
+                                                     skip=under_test.metric.shard_keys if streaming else ())
+            if payload is None:
+                return None
+            loaded = time.perf_counter()
+
+            logger.info('Calculating scores...')
+            checkpoint = None
+            approximation = None
+            with profile_phase(self.profiler, under_test, 'compute'):
+                if streaming:
+                    result = self.compute_streaming(under_test, payload)
+                elif under_test.metric.sampled:
+                    result, approximation = under_test.metric.approximate(**payload)
+                elif self.tolerance and can_progress(under_test):
+                    result, approximation = compute_progressive(under_test, payload, self.tolerance)
+                elif self.shard_size and under_test.metric.shard_keys:
+                    checkpoint = self.get_checkpoint(under_test, payload)
+                    result = self.compute_sharded(under_test, payload, checkpoint)
+                else:
+                    result = under_test.metric(**payload)
+        del payload
+        computed = time.perf_counter()
+
+        with profile_phase(self.profiler, under_test, 'export'):
+            output_bytes = self.exporter.export_json(result, under_test, approximation)
+        if checkpoint is not None:
+            checkpoint.remove()
+        exported = time.perf_counter()
+        return dict(
+            load_seconds=loaded - start,
+            compute_seconds=computed - loaded,
+            export_seconds=exported - computed,
+            num_examples=len(result[0]),
+            peak_memory=memory.peak,
+            approximate=approximation is not None,
+            cache_hits=self.loader.cache_hits - cache_hits,
+            cache_misses=self.loader.cache_misses - cache_misses,
+            output_bytes=output_bytes,
+        )
+
+    async def evaluate_async(self, under_test):
+        """
+        Evaluate an under_test whose metric runs an external tool, without blocking the event loop
+        while the tool runs.
+
+        :param under_test:
+        :return: a dict of the stats of this run, or None if the resources were unavailable.
+        """
+        logger.info('Running under_test: %r', under_test)
+        start = time.perf_counter()
+        payload = self.loader.load_resources(under_test)
+        self.loader.release(under_test)
+        if payload is None:
+            return None
+        loaded = time.perf_counter()
+        result = await under_test.metric.acall(**payload)
+        computed = time.perf_counter()
+        output_bytes = self.exporter.export_json(result, under_test)
+        return dict(
+            load_seconds=loaded - start,
+            compute_seconds=computed - loaded,
+            export_seconds=time.perf_counter() - computed,
+            num_examples=len(result[0]),
+            # the tool runs in a process of its own, and other under_tests run in this one meanwhile.
+            peak_memory=None,
+            output_bytes=output_bytes,
+        )
+
+    def get_checkpoint(self, under_test, payload):
+        num_examples = len(payload[under_test.metric.shard_keys[0]])
+        return ShardCheckpoint(self.exporter.save_dir, under_test, self.loader.get_filenames(under_test),
+                               num_examples, self.shard_size)
+
+    def compute_shard(self, under_test, payload, checkpoint: ShardCheckpoint, index):
+        """
+        Get the utterance scores of the index-th shard, from the checkpoint if it was finished.
+        """
+        scores = checkpoint.load(index)
+        ranges = get_shard_ranges(checkpoint.meta['num_examples'], self.shard_size)
+        if scores is not None:
+            logger.info('resuming from shard {}/{} of {!r}'.format(index + 1, len(ranges), under_test))
+            return scores
+
+        logger.info('computing shard {}/{} of {!r}'.format(index + 1, len(ranges), under_test))
+        metric = under_test.metric
+        start, stop = ranges[index]
+        scores = metric.score_utterance(**get_shard_payload(payload, metric.shard_keys, start, stop))
+        checkpoint.save(index, scores)
+        return scores
+
+    def compute_sharded(self, under_test, payload, checkpoint: ShardCheckpoint):
+        num_shards = len(get_shard_ranges(checkpoint.meta['num_examples'], self.shard_size))
+        utterance = []
+        for index in range(num_shards):
+            utterance.extend(self.compute_shard(under_test, payload, checkpoint, index))
+        return utterance, under_test.metric.score_system(utterance, **payload)
+
+    def compute_streaming(self, under_test, resources):
+        """
+        Feed the metric aligned batches read lazily from the corpus files, so that memory does not grow
+        with the size of the corpus.
+
+        :param under_test:
+        :param resources: the resources other than the corpora.
+        :return:
+        """
+        metric = under_test.metric
+        state = metric.init(**resources)
+        utterance = []
+        for batch in self.loader.iter_batches(under_test, metric.shard_keys, self.batch_size):
+            utterance.extend(metric.update(state, **batch, **resources))
+        logger.info('streamed {} examples of {!r}'.format(len(utterance), under_test))
+        return utterance, metric.finalize(state, utterance)
+
+    def evaluate_shard(self, under_test, index):
+        """
+        Compute and checkpoint a single shard of under_test, without exporting anything.
+
+        :param under_test:
+        :param index:
+        :return: a dict of the stats of this run, or None if the resources were unavailable.
+        """
+        logger.info('Running shard %d of under_test: %r', index, under_test)
+        start = time.perf_counter()
+        with MemorySampler() as memory:
+            payload = self.loader.load_resources(under_test)
+            if payload is None:
+                return None
+            loaded = time.perf_counter()
+            checkpoint = self.get_checkpoint(under_test, payload)
+            scores = self.compute_shard(under_test, payload, checkpoint, index)
+        return dict(
+            load_seconds=loaded - start,
+            compute_seconds=time.perf_counter() - loaded,
+            export_seconds=0.0,
+            num_examples=len(scores),
+            peak_memory=memory.peak,
+        )
+
+    def count_shards(self, under_test):
+        """
+        Count the shards of under_test by loading its first shard_key.
+        """
+        key = under_test.metric.shard_keys[0]
+        requires = self.loader.get_normalized_requires(under_test.metric.requires)
+        corpus = self.loader.load_resource_for_key(key, under_test, requires)
+        if corpus is None:
+            return None
+        return len(get_shard_ranges(len(corpus), self.shard_size))
+
+
+# the Evaluator of a worker process, created by _init_worker().
+_worker_evaluator = None
+
+
+def _init_worker(save_dir, max_memory, shard_size, batch_size, tolerance, profile):
+    global _worker_evaluator
+    profiler = Profiler(save_dir, profile) if profile else None
+    _worker_evaluator = Evaluator(Exporter(save_dir), ResourceLoader(max_memory), shard_size, batch_size, tolerance,
+                                  profiler)
+
+
+def _run_in_worker(under_test, shared_resources=None):
+    if shared_resources:
+        _worker_evaluator.loader.adopt(shared_resources, under_test)
+    return _worker_evaluator(under_test)
+
+
 class Engine:
-    def __init__(self, config, save_dir, force=False):
+    def __init__(self, config, save_dir, force=False, jobs=1, max_memory=None, explain=False,
+                 shard_size=None, overlap_external=False, tool_limits=None, batch_size=None, server=None,
+                 tolerance=None, profile=None):
         self.exporter = Exporter(save_dir)
-        self.loader = ResourceLoader()
+        self.manifest = BuildManifest(save_dir)
+        self.history = RunHistory(save_dir)
+        self.telemetry = Telemetry(save_dir)
+        # with several workers, the corpora and embeddings are loaded once in shared memory.
+        self.loader = ResourceLoader(max_memory, shared=jobs > 1)
+        self.cost_model = CostModel(self.history, self.loader)
+        # cpu or mem to profile each phase of each under_test.
+        self.profiler = Profiler(save_dir, profile) if profile else None
+        self.evaluator = Evaluator(self.exporter, self.loader, shard_size, batch_size, tolerance, self.profiler)
+        if server is not None:
+            from eval.server import RemoteEvaluator
+            # the server has its own worker, so the under_tests are dispatched one by one.
+            self.evaluator = RemoteEvaluator(server, self.evaluator)
+        self.server = server
         self.config = config
         self.force = force
+        self.jobs = jobs
+        self.max_memory = max_memory
+        self.explain = explain
+        self.shard_size = shard_size
+        self.overlap_external = overlap_external
+        self.batch_size = batch_size
+        self.tolerance = tolerance
+        self.profile = profile
+        # name of external tool => max number of concurrent runs, overriding the metric's max_concurrency.
+        self.tool_limits = tool_limits or {}
+        # record() may be called from the event loop and the thread running in-process metrics.
+        self.record_lock = threading.Lock()
         self.under_tests = parse_config(config)
 
-    def is_outdated(self, output: Path, under_test):
-        if not output.exists():
-            return True
-        filenames = self.loader.get_filenames(under_test).values()
-        for file in filenames:
-            if not file.exists():
-                return True
-            if file.stat().st_mtime > output.stat().st_mtime:
-                logger.info('file {} is newer than {}'.format(file, output))
-                return True
-        return False
+    def explain_outdated(self, under_test):
+        """
+        Tell why under_test needs running.
 
-    def run(self):
-        logger.info('save_dir: %s', self.exporter.save_dir)
-        logger.info('config: %s', pprint.pformat(self.config))
+        :param under_test:
+        :return: the reason as a str, or None if its output is up to date.
+        """
+        if self.force:
+            return 'forced'
+        output = self.exporter.get_output_path(under_test)
+        return self.manifest.explain(output, under_test, self.loader.get_filenames(under_test), self.tolerance)
 
-        self.exporter.export_config(self.config)
+    def get_outdated(self):
+        outdated = []
         for under_test in self.under_tests:
-            output_path = self.exporter.get_output_path(under_test)
-            if not self.is_outdated(output_path, under_test) and not self.force:
-                logger.info('skipping up-to-date file %s', output_path)
+            reason = self.explain_outdated(under_test)
+            if self.explain:
+                print('{} {}: {}'.format('rerun' if reason else 'skip', under_test.prefix, reason or 'up to date'))
+            if reason is None:
+                logger.info('skipping up-to-date file %s', self.exporter.get_output_path(under_test))
+                self.telemetry.skip(under_test, 'up to date')
                 continue
+            logger.info('%r is outdated: %s', under_test, reason)
+            outdated.append(under_test)
+        self.manifest.save()
+        return outdated
 
-            logger.info('Running under_test: %r', under_test)
-            payload = self.loader.load_resources(under_test)
-            if payload is None:
-                continue
+    def record(self, under_test, stats):
+        with self.record_lock:
+            tolerance = self.tolerance if stats.get('approximate') else None
+            self.manifest.record(under_test, self.loader.get_filenames(under_test), tolerance)
+            self.history.record(under_test, stats)
+        self.telemetry.finished(under_test, stats)
 
-            logger.info('Calculating scores...')
+    def plan(self):
+        from eval.plan import make_plan
+        return make_plan(self)
+
+    def run_serial(self, under_tests, keep_resources=False):
+        if not keep_resources:
+            # free each resource after its last use.
+            self.loader.plan(under_tests)
+        for under_test in under_tests:
             try:
-                result = under_test.metric(**payload)
+                stats = self.evaluator(under_test)
             except KeyboardInterrupt:
                 logging.warning('interrupted, skipping...')
+                self.telemetry.failed(under_test, 'interrupted')
             else:
-                self.exporter.export_json(result, under_test)
+                if stats:
+                    self.record(under_test, stats)
+                else:
+                    self.telemetry.failed(under_test, 'resources unavailable')
+
+    @property
+    def worker_max_memory(self):
+        # the budget is shared evenly by the workers.
+        if self.max_memory is None:
+            return None
+        return self.max_memory // self.jobs
+
+    def run_parallel(self, under_tests):
+        """
+        Run under_tests in worker processes, the longest first within the memory budget,
+        as estimated from the history of past runs.
+        """
+        logger.info('running {} under_tests with {} workers'.format(len(under_tests), self.jobs))
+        scheduler = Scheduler(self.cost_model, under_tests, self.jobs, self.max_memory)
+        # the shared resources are freed after their last under_test.
+        self.loader.plan(under_tests)
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.jobs,
+                initializer=_init_worker,
+                initargs=(self.exporter.save_dir, self.worker_max_memory, self.shard_size,
+                          self.batch_size, self.tolerance, self.profile)) as executor:
+            futures = {}
+            while True:
+                under_test = scheduler.next()
+                while under_test is not None:
+                    shared_resources = self.loader.share(under_test)
+                    futures[executor.submit(_run_in_worker, under_test, shared_resources)] = under_test
+                    under_test = scheduler.next()
+                if not futures:
+                    break
+                done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    under_test = futures.pop(future)
+                    scheduler.done(under_test)
+                    self.loader.release(under_test)
+                    try:
+                        stats = future.result()
+                    except Exception as e:
+                        logger.exception('under_test %r failed', under_test)
+                        self.telemetry.failed(under_test, repr(e))
+                    else:
+                        logger.info('finished under_test: %r', under_test)
+                        if stats:
+                            self.record(under_test, stats)
+                        else:
+                            self.telemetry.failed(under_test, 'resources unavailable')
+                scheduler.log_progress()
+
+    def run_in_process(self, under_tests):
+        if self.jobs == 1:
+            self.run_serial(under_tests)
+        elif self.server is None:
+            self.run_parallel(under_tests)
+        else:
+            # the workers run the under_tests the server does not know, then the server runs its own.
+            remote = [under_test for under_test in under_tests if self.evaluator.is_remote(under_test)]
+            local = [under_test for under_test in under_tests if not self.evaluator.is_remote(under_test)]
+            logger.info('{} under_tests on the server, {} in {} workers'.format(len(remote), len(local), self.jobs))
+            if local:
+                self.run_parallel(local)
+            if remote:
+                self.run_serial(remote)
+
+    def run_overlapped(self, under_tests):
+        """
+        Launch the metrics running external tools asynchronously, and run the in-process metrics
+        in a thread meanwhile. Each result is exported as soon as it finishes.
+        """
+        external = [under_test for under_test in under_tests if getattr(under_test.metric, 'external_tool', None)]
+        in_process = [under_test for under_test in under_tests if under_test not in external]
+        logger.info('{} under_tests on external tools, {} in-process'.format(len(external), len(in_process)))
+        asyncio.run(self.run_overlapped_async(external, in_process))
+
+    async def run_overlapped_async(self, external, in_process):
+        loop = asyncio.get_running_loop()
+        # external tools take files as input, so they get their own loader to stay off the other thread's.
+        evaluator = Evaluator(self.exporter, ResourceLoader())
+        semaphores = {}
+
+        async def run_external(under_test):
+            tool = under_test.metric.external_tool
+            if tool not in semaphores:
+                limit = self.tool_limits.get(tool, under_test.metric.max_concurrency)
+                semaphores[tool] = asyncio.Semaphore(limit)
+            async with semaphores[tool]:
+                try:
+                    stats = await evaluator.evaluate_async(under_test)
+                except Exception as e:
+                    logger.exception('under_test %r failed', under_test)
+                    self.telemetry.failed(under_test, repr(e))
+                    return
+            logger.info('finished under_test: %r', under_test)
+            if stats:
+                self.record(under_test, stats)
+
+        await asyncio.gather(
+            loop.run_in_executor(None, self.run_in_process, in_process),
+            *(run_external(under_test) for under_test in external)
+        )
+
+    def run_pipelined(self, samplers):
+        """
+        Score the responses of the models being sampled as they are written, then run the rest.
+
+        :param samplers: a dict from the responses file to the subprocess.Popen writing it.
+        :return:
+        """
+        from eval.pipeline import can_pipeline, evaluate_pipelined
+
+        self.exporter.export_config(self.config)
+        samplers = {str(Path(responses).absolute()): sampler for responses, sampler in samplers.items()}
+        pipelined = collections.defaultdict(list)
+        for under_test in self.under_tests:
+            responses = str(Path(self.loader.get_filename_for_key(RESPONSES, under_test)).absolute())
+            if responses in samplers and can_pipeline(self.loader, under_test):
+                pipelined[responses].append(under_test)
+
+        def run_one(responses):
+            # each sampler has its own thread, and so its own loader.
+            evaluator = Evaluator(self.exporter, ResourceLoader())
+            results = evaluate_pipelined(evaluator, pipelined[responses], samplers[responses], self.batch_size)
+            for under_test, stats in results.items():
+                logger.info('finished under_test: %r', under_test)
+                self.record(under_test, stats)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(len(samplers), 1)) as executor:
+            futures = {executor.submit(run_one, responses): responses for responses in pipelined}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    future.result()
+                except Exception:
+                    logger.exception('pipelined run on %s failed', futures[future])
+        for responses, sampler in samplers.items():
+            if sampler.wait() != 0:
+                logger.error('sampler of {} exited with {}'.format(responses, sampler.returncode))
+        # the metrics that cannot stream, and anything that failed.
+        self.run()
+
+    def run(self):
+        logger.info('save_dir: %s', self.exporter.save_dir)
+        logger.info('config: %s', pprint.pformat(self.config))
+
+        self.exporter.export_config(self.config)
+        self.telemetry.start_run(jobs=self.jobs, force=self.force, shard_size=self.shard_size,
+                                 batch_size=self.batch_size, tolerance=self.tolerance,
+                                 overlap_external=self.overlap_external, server=self.server is not None)
+        under_tests = plan_order(self.get_outdated(), self.loader)
+        if self.profiler is not None:
+            self.profiler.reset()
+        if self.overlap_external:
+            self.run_overlapped(under_tests)
+        else:
+            self.run_in_process(under_tests)
+        if self.profiler is not None:
+            self.profiler.summarize()
+        self.telemetry.end_run()
         logger.info('run {} under_tests'.format(len(self.under_tests)))
         logger.info('all done')
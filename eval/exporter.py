@@ -5,7 +5,9 @@ import numpy as np
 import pprint
 import json
 
-from eval.consts import CONFIG_JSON
+from eval.consts import CONFIG_JSON, STATS_DIR
+from eval.manifest import get_metric_params
+from eval.utils import open_atomic
 
 logger = logging.getLogger(__name__)
 
@@ -34,7 +36,8 @@ class Exporter:
             system = np.mean(utterance)
         else:
             system = extract_fields(system, metric.system_field)
-        logging.info('utterance: %s', pprint.pformat(utterance))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('utterance: %s', pprint.pformat(utterance))
         logger.info('system: %s', system)
         return dict(
             utterance=utterance,
@@ -44,7 +47,8 @@ class Exporter:
             dataset=under_test.dataset_name,
         )
 
-    def default(self, obj):
+    @staticmethod
+    def default(obj):
         if isinstance(obj, np.integer):
             return int(obj)
         elif isinstance(obj, np.floating):
@@ -60,19 +64,97 @@ class Exporter:
         else:
             raise TypeError
 
-    def export_json(self, result, under_test):
-        result = self.process_result(result, under_test)
+    def export_json(self, result, under_test, approximation=None):
+        """
+        :return: the number of bytes written.
+        """
+        processed = self.process_result(result, under_test)
+        if approximation is not None:
+            # an approximate result records the subset of examples it was computed on.
+            processed['approximation'] = approximation
+        if under_test.metric.stats_field:
+            self.export_stats(result, under_test, approximation)
+        return self.export_processed(processed, under_test)
+
+    def export_stats(self, result, under_test, approximation=None):
+        """
+        Save the sufficient stats of the utterance scores.
+        """
+        if approximation is not None:
+            # the stats of a subset would be mistaken for those of the corpus.
+            stats_path = self.get_stats_path(under_test)
+            if stats_path.exists():
+                stats_path.unlink()
+            return
+        self.save_stats(*self.get_stats(result, under_test), under_test)
+
+    def get_stats(self, result, under_test):
+        """
+        :return: (rows, meta), the stats of each utterance as a row, and the fields of the stats
+            and the params of the metric.
+        """
+        stats = [getattr(score, under_test.metric.stats_field) for score in result[0]]
+        meta = dict(
+            metric=under_test.metric_name,
+            fields=list(stats[0]._fields) if stats else [],
+            params=get_metric_params(under_test.metric),
+        )
+        return np.array(stats, dtype=np.float64).reshape(len(stats), len(meta['fields'])), meta
+
+    def save_stats(self, rows, meta, under_test):
+        """
+        Save the stats as an npz of the rows and the meta.
+        """
+        stats_path = self.get_stats_path(under_test)
+        stats_path.parent.mkdir(exist_ok=True)
+        with open_atomic(stats_path, 'wb') as f:
+            np.savez(f, stats=np.asarray(rows, dtype=np.float64).reshape(len(rows), len(meta['fields'])),
+                     meta=json.dumps(meta, default=self.default))
+        logger.info('Saving stats to %s', stats_path)
+
+    def export_processed(self, result, under_test):
         output_path = self.get_output_path(under_test)
 
         logger.info('Saving scores to %s', output_path)
         with output_path.open('w') as f:
             json.dump(result, f, default=self.default)
+            return f.tell()
 
     def get_output_path(self, under_test):
         prefix = under_test.prefix
         output_path = self.save_dir.joinpath(prefix).with_suffix('.json')
         return output_path
 
+    def get_stats_path(self, under_test):
+        return self.save_dir.joinpath(STATS_DIR, under_test.prefix).with_suffix('.npz')
+
     def export_config(self, config):
         config_json = self.save_dir.joinpath(CONFIG_JSON)
         config_json.write_text(json.dumps(config, default=self.default))
+
+
+class MemoryExporter(Exporter):
+    """
+    An Exporter keeping the processed results in memory instead of writing them to files.
+    """
+
+    def __init__(self):
+        super().__init__(save_dir='.')
+        # prefix => processed result
+        self.results = {}
+        # prefix => (rows, meta) of the stats
+        self.stats = {}
+
+    def export_processed(self, result, under_test):
+        self.results[under_test.prefix] = result
+        return 0
+
+    def export_stats(self, result, under_test, approximation=None):
+        if approximation is None:
+            self.stats[under_test.prefix] = self.get_stats(result, under_test)
+
+    def pop_result(self, under_test):
+        """
+        :return: (processed result, stats) where stats is (rows, meta) or None.
+        """
+        return self.results.pop(under_test.prefix), self.stats.pop(under_test.prefix, None)
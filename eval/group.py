@@ -27,8 +27,10 @@ class MetricGroup:
 
     group_matchers = {
         'Embedding': contains('embedding_based'),
+        'Self-BLEU': contains('self_bleu'),
         'BLEU': contains('bleu'),
         'Distinct-N': re_match(r'distinct_\d'),
+        'Entropy-N': re_match(r'entropy_\d'),
         'ROUGE-N': re_match(r'rouge_\d'),
         'ROUGE-L/W': re_match(r'rouge_[lw]'),
         'ADEM': exact('adem'),
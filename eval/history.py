@@ -0,0 +1,58 @@
+import json
+import logging
+from pathlib import Path
+
+from eval.consts import RUN_HISTORY
+from eval.utils import open_atomic
+
+logger = logging.getLogger(__name__)
+
+
+def get_history_key(under_test):
+    return '/'.join((under_test.metric_name, under_test.dataset_name))
+
+
+class RunHistory:
+    """
+    The runtimes of past runs, accumulated per (metric, dataset) in <save_dir>/.run_history.
+    """
+
+    def __init__(self, save_dir):
+        self.filename = Path(save_dir).joinpath(RUN_HISTORY)
+        if self.filename.exists():
+            self.entries = json.loads(self.filename.read_text())
+        else:
+            self.entries = {}
+
+    def record(self, under_test, stats):
+        """
+        Add the stats of a finished under_test.
+
+        :param under_test:
+        :param stats: a dict with load_seconds, compute_seconds, num_examples and optionally peak_memory.
+        :return:
+        """
+        entry = self.entries.setdefault(get_history_key(under_test), dict(runs=0, seconds=0.0, examples=0))
+        entry['runs'] += 1
+        entry['seconds'] += stats['load_seconds'] + stats['compute_seconds']
+        entry['examples'] += stats['num_examples']
+        if stats.get('peak_memory'):
+            entry['peak_memory'] = max(entry.get('peak_memory', 0), stats['peak_memory'])
+        self.save()
+
+    def get_seconds_per_example(self, under_test):
+        entry = self.entries.get(get_history_key(under_test))
+        if not entry or not entry['examples']:
+            return None
+        return entry['seconds'] / entry['examples']
+
+    def get_peak_memory(self, under_test):
+        entry = self.entries.get(get_history_key(under_test))
+        if not entry:
+            return None
+        return entry.get('peak_memory')
+
+    def save(self):
+        # engines and queue workers sharing save_dir record their runs concurrently.
+        with open_atomic(self.filename) as f:
+            f.write(json.dumps(self.entries, indent=1, sort_keys=True))
@@ -0,0 +1,198 @@
+"""
+Kernels for the longest common subsequence of two sentences, as lists of tokens or token ids.
+
+lcs_length() is bit-parallel (Allison and Dix, 1986; Crochemore et al., 2001): a row of the LCS table is
+a bit vector held in a Python int, and each token of the other sentence updates the whole row with
+a few big int operations. wlcs_matches() traces back a weighted LCS of Lin (2004), found by a dynamic program
+over the sentences with their unmatched runs of tokens collapsed.
+
+The cells of an anti-diagonal of the WLCS table depend only on the two anti-diagonals before it, so long
+sentences sweep the table one anti-diagonal at a time with numpy. Each sweep costs a few numpy calls,
+which only pays off when the anti-diagonals are long: sentences shorter than WLCS_DIAGONAL_LENGTH,
+such as most dialogue responses, still take the quadratic Python loop, which is faster for them.
+"""
+import numpy as np
+
+# the length from which both sentences are swept by anti-diagonals, where numpy overtakes the Python loop.
+WLCS_DIAGONAL_LENGTH = 200
+
+# the moves of the WLCS table when it is traced back.
+LEFT, UP, DIAGONAL = 0, 1, 2
+
+
+def get_match_masks(tokens):
+    """
+    :return: a dict from token to the bit mask of its positions in tokens.
+    """
+    masks = {}
+    for i, token in enumerate(tokens):
+        masks[token] = masks.get(token, 0) | (1 << i)
+    return masks
+
+
+def lcs_length(a, b):
+    """
+    The length of the longest common subsequence of a and b.
+    """
+    if len(a) < len(b):
+        # the bits span the longer one and the loop the shorter one.
+        a, b = b, a
+    if not b:
+        return 0
+    masks = get_match_masks(a)
+    full = (1 << len(a)) - 1
+    # the zero bits of v mark the columns where the LCS grows.
+    v = full
+    for token in b:
+        match = masks.get(token)
+        if match:
+            u = v & match
+            v = ((v + u) | (v - u)) & full
+    return len(a) - bin(v).count('1')
+
+
+def get_weight_fn(weight):
+    return lambda k: k ** weight
+
+
+def compress(tokens, shared, gap):
+    """
+    Replace each run of tokens not in shared with a single gap.
+
+    :return: (the compressed tokens, the position in tokens of each of them).
+    """
+    compressed = []
+    positions = []
+    for i, token in enumerate(tokens):
+        if token in shared:
+            compressed.append(token)
+            positions.append(i)
+        elif not compressed or compressed[-1] is not gap:
+            compressed.append(gap)
+            positions.append(i)
+    return compressed, positions
+
+
+def get_token_ids(a, b):
+    """
+    :return: the ids of the tokens of a, and those of the tokens of b reversed, where a token of b
+        not in a gets an id of its own, so that the gaps of a and b never match each other.
+    """
+    ids = {}
+    a_ids = np.array([ids.setdefault(token, len(ids)) for token in a], dtype=np.int64)
+    b_ids = np.array([ids.get(token, -1 - j) for j, token in enumerate(b)], dtype=np.int64)
+    return a_ids, b_ids[::-1].copy()
+
+
+def wlcs_rows(a, b, fs):
+    """
+    The moves of the dynamic program of the WLCS of a and b, one row of a at a time.
+
+    :param fs: f(k) for every run length k.
+    :return: the table of moves, indexed by [i][j].
+    """
+    n = len(b)
+    moves = [bytearray(n + 1)]
+    c = [0] * (n + 1)
+    w = [0] * (n + 1)
+    for token in a:
+        new_c = [0] * (n + 1)
+        new_w = [0] * (n + 1)
+        row = bytearray(n + 1)
+        for j in range(1, n + 1):
+            if b[j - 1] == token:
+                k = w[j - 1]
+                new_c[j] = c[j - 1] + fs[k + 1] - fs[k]
+                new_w[j] = k + 1
+                row[j] = DIAGONAL
+            elif c[j] > new_c[j - 1]:
+                new_c[j] = c[j]
+                row[j] = UP
+            else:
+                new_c[j] = new_c[j - 1]
+        c, w = new_c, new_w
+        moves.append(row)
+    return moves
+
+
+def wlcs_diagonals(a, b, fs):
+    """
+    The same dynamic program as wlcs_rows(), one anti-diagonal i + j = d at a time.
+    Each anti-diagonal is an array indexed by i, and only the last three are kept.
+    """
+    m, n = len(a), len(b)
+    a_ids, b_reversed = get_token_ids(a, b)
+    fs = np.asarray(fs, dtype=np.float64)
+    moves = np.full((m + 1, n + 1), LEFT, dtype=np.int8)
+    c = [np.zeros(m + 1) for _ in range(3)]
+    w = [np.zeros(m + 1, dtype=np.int64) for _ in range(3)]
+    for d in range(2, m + n + 1):
+        c2, c1, c0 = c[(d - 2) % 3], c[(d - 1) % 3], c[d % 3]
+        w2, w0 = w[(d - 2) % 3], w[d % 3]
+        lo, hi = max(1, d - n), min(m, d - 1)
+        # the cells (i, d - i) for i from lo to hi, where a[i - 1] meets b[d - i - 1].
+        match = a_ids[lo - 1:hi] == b_reversed[n - d + lo:n - d + hi + 1]
+        new_c = c0[lo:hi + 1]
+        new_w = w0[lo:hi + 1]
+        # c[i - 1][j] and c[i][j - 1] are both on the last anti-diagonal.
+        up, left = c1[lo - 1:hi], c1[lo:hi + 1]
+        rows = np.arange(lo, hi + 1)
+        moves[rows, d - rows] = np.where(match, DIAGONAL, np.where(up > left, UP, LEFT))
+        np.maximum(up, left, out=new_c)
+        new_w[:] = 0
+        matched = np.flatnonzero(match)
+        if len(matched):
+            k = w2[lo - 1:hi][matched]
+            new_c[matched] = c2[lo - 1:hi][matched] + fs[k + 1] - fs[k]
+            new_w[matched] = k + 1
+    return moves
+
+
+def wlcs_matches(a, b, weight):
+    """
+    A weighted LCS of a and b with the weighting function f(k) = k ** weight, which rewards consecutive
+    matches, as defined in ROUGE (Lin, 2004). Its table is traced back from the end, moving up, i.e. along a,
+    only when that keeps a larger WLCS, which is how the rouge package picks one of the WLCS.
+
+    :return: the positions in b of the matched tokens, in order.
+    """
+    shared = set(a).intersection(b)
+    if not shared:
+        return []
+    # a run of tokens that match nothing only carries the running max over and breaks the runs of matches,
+    # which a single token of that run does as well. The gaps of a and b never match each other.
+    a, _ = compress(a, shared, gap=object())
+    b, positions = compress(b, shared, gap=object())
+    f = get_weight_fn(weight)
+    # extending a run of k consecutive matches gains f(k + 1) - f(k).
+    fs = [f(k) for k in range(min(len(a), len(b)) + 1)]
+    if min(len(a), len(b)) >= WLCS_DIAGONAL_LENGTH:
+        moves = wlcs_diagonals(a, b, fs)
+    else:
+        moves = wlcs_rows(a, b, fs)
+    matches = []
+    i, j = len(a), len(b)
+    while i and j:
+        move = moves[i][j]
+        if move == DIAGONAL:
+            i -= 1
+            j -= 1
+            matches.append(positions[j])
+        elif move == UP:
+            i -= 1
+        else:
+            j -= 1
+    return matches[::-1]
+
+
+def get_runs(positions):
+    """
+    :return: the lengths of the runs of consecutive positions, given sorted positions.
+    """
+    runs = []
+    for i, position in enumerate(positions):
+        if i and position == positions[i - 1] + 1:
+            runs[-1] += 1
+        else:
+            runs.append(1)
+    return runs
@@ -1,12 +1,22 @@
+import collections
+import itertools
 import traceback
+import weakref
 import embedding_based as eb
 import logging
 
 from pathlib import Path
+from eval import bleu, diversity, self_bleu
 from eval.consts import *
+from eval.corpus import IdCorpus, EmbeddingTable, SharedResource, TokenIdCorpus, Vocabulary
+from eval.ngram_index import get_ngram_index
 
 logger = logging.getLogger(__name__)
 
+# the caches of the stats of corpora shared by the metrics, which keep the corpora alive,
+# so they are cleared when the loader evicts a resource.
+derived_caches = (bleu.stats_cache, diversity.stats_cache, self_bleu.index_cache)
+
 
 def load_filename(filename):
     filename = Path(filename).absolute()
@@ -16,9 +26,84 @@ def load_filename(filename):
     return filename
 
 
+def iter_token_lists(filename):
+    """
+    Lazily tokenize a corpus file the same way as eb.load_corpus_from_file.
+    """
+    with open(filename) as f:
+        for line in f:
+            yield line.split()
+
+
+def load_token_ids(filename, vocab):
+    return TokenIdCorpus.from_token_lists(iter_token_lists(filename), vocab)
+
+
+def parse_token_ids(line, vocab):
+    return vocab.encode(line.split())
+
+
+def iter_token_ids(filename, vocab):
+    with open(filename) as f:
+        for line in f:
+            yield parse_token_ids(line, vocab)
+
+
+def load_ngram_index(filename):
+    return get_ngram_index(filename, iter_token_lists)
+
+
+def iter_ngram_index(filename):
+    # the index is memory-mapped, so its references can be handed out one by one for free.
+    return iter(load_ngram_index(filename))
+
+
+# format => lazy load_fn yielding the items one by one, for the formats that can be streamed.
+streaming_load_fns = {
+    eb.load_corpus_from_file: iter_token_lists,
+    load_token_ids: iter_token_ids,
+    load_ngram_index: iter_ngram_index,
+}
+
+# format => function parsing a line of a corpus file, for the formats of the corpora that can be tailed.
+line_parsers = {
+    eb.load_corpus_from_file: str.split,
+    load_token_ids: parse_token_ids,
+}
+
+# format => function making a batch of the items of a corpus, for the formats whose batches are not lists.
+batch_fns = {
+    load_token_ids: TokenIdCorpus.from_id_lists,
+}
+
+# the formats whose tokens are ids in the vocabulary of their dataset, so that the ids of the responses
+# and the references can be compared. Their functions above take that vocabulary after the filename or items.
+vocab_formats = {load_token_ids}
+
+def load_shared_corpus(filename):
+    return IdCorpus.from_token_lists(iter_token_lists(filename)).share()
+
+
+def load_shared_token_ids(filename, vocab):
+    return load_token_ids(filename, vocab).share()
+
+
+def load_shared_embeddings(filename):
+    return EmbeddingTable.from_mapping(eb.load_word2vec_binary(filename)).share()
+
+
+# format => load_fn putting the resource in shared memory, for the formats worker processes can attach to.
+shared_load_fns = {
+    eb.load_corpus_from_file: load_shared_corpus,
+    load_token_ids: load_shared_token_ids,
+    eb.load_word2vec_binary: load_shared_embeddings,
+}
+
 default_load_fns = {
     # format name, load_fn.
     'token_list': eb.load_corpus_from_file,
+    'token_ids': load_token_ids,
+    'ngram_index': load_ngram_index,
     'embeddings': eb.load_word2vec_binary,
     'filename': load_filename,
     'path': lambda s: Path(s),
@@ -30,10 +115,49 @@ default_requires = {
     RESPONSES: ('model.responses', 'token_list'),
     CONTEXTS: ('dataset.contexts', 'token_list'),
     REFERENCES: ('dataset.references', 'token_list'),
+    REFERENCE_NGRAMS: ('dataset.references', 'ngram_index'),
     EMBEDDINGS: ('metric.embeddings_file', 'embeddings'),
 }
 
 
+# in-memory size of a resource relative to its file size, used to enforce the memory budget.
+# a token list holds one str object per token, which is roughly 12 times the bytes on disk.
+default_memory_factors = {
+    eb.load_corpus_from_file: 12,
+    eb.load_word2vec_binary: 1.2,
+    # a token is a 4-byte id, a little less than a token and a space on disk.
+    load_token_ids: 1,
+    # memory-mapped, and shared with every process through the page cache.
+    load_ngram_index: 0,
+}
+
+# the same in shared memory, where a token is a 4-byte id, a little less than a token and a space on disk.
+shared_memory_factors = {
+    eb.load_corpus_from_file: 1,
+    eb.load_word2vec_binary: 1.2,
+    load_token_ids: 1,
+    load_ngram_index: 0,
+}
+
+
+def get_format_name(load_fn):
+    """
+    :return: the name of a format in default_load_fns, or the name of a custom load_fn.
+    """
+    for name, fn in default_load_fns.items():
+        if fn is load_fn:
+            return name
+    return getattr(load_fn, '__name__', repr(load_fn))
+
+
+def get_file_stat(filename):
+    try:
+        stat = Path(filename).stat()
+    except (OSError, TypeError):
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
 def normalize_format(format):
     if callable(format):
         return format
@@ -42,11 +166,26 @@ def normalize_format(format):
 
 class ResourceLoader:
 
-    def __init__(self):
-        # (filename, format) => resource
-        self.resources_cache = {}
+    def __init__(self, max_memory=None, shared=False):
+        # (filename, format) => resource, in least recently used order.
+        self.resources_cache = collections.OrderedDict()
         # id(requires) => normalized_requires
         self.requires_cache = {}
+        # (filename, format) => number of planned under_tests that still need it.
+        self.remaining_uses = collections.Counter()
+        # the memory budget in bytes for cached resources, or None for no limit.
+        self.max_memory = max_memory
+        # (filename, format) => the stat of the file when the resource was loaded.
+        self.resources_stats = {}
+        # whether to load the formats of shared_load_fns into shared memory.
+        self.shared = shared
+        # (filename, format) => number of under_tests running in workers attached to the resource.
+        self.pinned = collections.Counter()
+        # lookups of resources found in the cache, and of those that had to be loaded.
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # dataset name => the vocabulary of its vocab_formats corpora, freed with the last of them.
+        self.vocabularies = weakref.WeakValueDictionary()
 
     # requires can be a dict or a list.
     # if list, the item must be key in default_load_info.
@@ -82,10 +221,12 @@ class ResourceLoader:
         requires = do_normalize()
         return self.requires_cache.setdefault(requires_key, requires)
 
-    def load_resources(self, under_test):
+    def load_resources(self, under_test, skip=()):
         requires = self.get_normalized_requires(under_test.metric.requires)
         resources = {}
         for key in requires:
+            if key in skip:
+                continue
             data = self.load_resource_for_key(key, under_test, requires)
             if data is None:
                 logger.warning('resource {} unavailable'.format(key))
@@ -99,16 +240,210 @@ class ResourceLoader:
         logger.info('{} resolved to {}'.format(source, filename))
         resource_key = (filename, load_fn)
         if resource_key in self.resources_cache:
-            return self.resources_cache[resource_key]
+            if self.resources_stats.get(resource_key) == get_file_stat(filename):
+                self.resources_cache.move_to_end(resource_key)
+                self.cache_hits += 1
+                return self.resources_cache[resource_key]
+            # a long-lived loader sees files change under it.
+            logger.info('{} changed since it was loaded'.format(filename))
+            self.evict(resource_key)
 
+        self.cache_misses += 1
+        self.make_room_for(resource_key, keep=self.get_resource_keys(under_test))
+        stat = get_file_stat(filename)
+        args = self.get_format_args(load_fn, under_test)
+        if self.shared:
+            load_fn = shared_load_fns.get(load_fn, load_fn)
         try:
-            resource = load_fn(filename)
+            resource = load_fn(filename, *args)
         except Exception:
             traceback.print_exc()
             logging.warning('Exception when loading requires')
             resource = None
+        self.resources_stats[resource_key] = stat
         return self.resources_cache.setdefault(resource_key, resource)
 
+    def share(self, under_test):
+        """
+        Load the resources of under_test that can live in shared memory, for a worker process to attach to.
+        They are not evicted until under_test is released.
+
+        :param under_test:
+        :return: a dict from resource key to resource, which pickles to the names of the shared memory.
+        """
+        requires = self.get_normalized_requires(under_test.metric.requires)
+        resources = {}
+        for key, (source, load_fn) in requires.items():
+            if load_fn not in shared_load_fns:
+                continue
+            resource = self.load_resource_for_key(key, under_test, requires)
+            if not isinstance(resource, SharedResource):
+                # the worker will load it on its own.
+                continue
+            resource_key = (under_test.get_resource_file(source), load_fn)
+            self.pinned[resource_key] += 1
+            resources[resource_key] = resource
+        return resources
+
+    def adopt(self, resources, under_test):
+        """
+        Cache the resources shared by another loader until the next release of an under_test using them.
+
+        :param resources: the result of share().
+        :param under_test: the under_test they were shared for.
+        :return:
+        """
+        for resource_key, resource in resources.items():
+            self.resources_cache[resource_key] = resource
+            self.resources_stats[resource_key] = get_file_stat(resource_key[0])
+            self.remaining_uses[resource_key] += 1
+            if resource_key[1] in vocab_formats and len(resource.vocab) > len(self.get_vocab(under_test)):
+                # the corpora this loader encodes itself must agree with the ids of the shared ones.
+                self.vocabularies[under_test.dataset_name] = resource.vocab
+
+    def get_vocab(self, under_test):
+        vocab = self.vocabularies.get(under_test.dataset_name)
+        if vocab is None:
+            vocab = self.vocabularies[under_test.dataset_name] = Vocabulary()
+        return vocab
+
+    def get_format_args(self, load_fn, under_test):
+        """
+        :return: the arguments that the functions of format load_fn take after the filename or items.
+        """
+        if load_fn in vocab_formats:
+            return self.get_vocab(under_test),
+        return ()
+
+    def can_stream(self, under_test, keys):
+        requires = self.get_normalized_requires(under_test.metric.requires)
+        return all(requires[key][1] in streaming_load_fns for key in keys)
+
+    def iter_items(self, key, under_test):
+        """
+        Lazily read the items of the resource of key, which has a format in streaming_load_fns.
+        """
+        requires = self.get_normalized_requires(under_test.metric.requires)
+        source, load_fn = requires[key]
+        return streaming_load_fns[load_fn](under_test.get_resource_file(source),
+                                           *self.get_format_args(load_fn, under_test))
+
+    def make_batch(self, key, under_test, items):
+        """
+        Make a batch of items of the corpus of key, as its format would load them.
+        """
+        requires = self.get_normalized_requires(under_test.metric.requires)
+        _, load_fn = requires[key]
+        if load_fn in batch_fns:
+            return batch_fns[load_fn](items, *self.get_format_args(load_fn, under_test))
+        return list(items)
+
+    def parse_lines(self, key, under_test, lines):
+        """
+        Parse lines of the corpus of key as its format would, into a batch.
+        """
+        requires = self.get_normalized_requires(under_test.metric.requires)
+        _, load_fn = requires[key]
+        args = self.get_format_args(load_fn, under_test)
+        return self.make_batch(key, under_test, [line_parsers[load_fn](line, *args) for line in lines])
+
+    def iter_batches(self, under_test, keys, batch_size):
+        """
+        Lazily read the resources of keys in aligned batches.
+
+        :param under_test:
+        :param keys: keys of aligned corpora, each of a format in streaming_load_fns.
+        :param batch_size:
+        :return: an iterator of dicts from key to a list of at most batch_size items.
+        """
+        iterators = [self.iter_items(key, under_test) for key in keys]
+        missing = object()
+        rows = itertools.zip_longest(*iterators, fillvalue=missing)
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                return
+            if any(item is missing for row in batch for item in row):
+                raise ValueError('{} of {!r} are not aligned'.format(', '.join(keys), under_test))
+            yield {key: self.make_batch(key, under_test, items) for key, items in zip(keys, zip(*batch))}
+
+    def get_resource_keys(self, under_test):
+        requires = self.get_normalized_requires(under_test.metric.requires)
+        return [
+            (under_test.get_resource_file(source), load_fn)
+            for source, load_fn in requires.values()
+        ]
+
+    def estimate_size(self, resource_key):
+        filename, load_fn = resource_key
+        try:
+            size = Path(filename).stat().st_size
+        except (OSError, TypeError):
+            return 0
+        memory_factors = shared_memory_factors if self.shared else default_memory_factors
+        return int(size * memory_factors.get(load_fn, 1))
+
+    def plan(self, under_tests):
+        """
+        Record the under_tests that are going to run, so that each resource can be freed after its last use.
+
+        :param under_tests:
+        :return:
+        """
+        for under_test in under_tests:
+            self.remaining_uses.update(self.get_resource_keys(under_test))
+
+    def release(self, under_test):
+        """
+        Tell the loader that under_test is done with its resources.
+        Resources having no remaining uses are evicted from the cache.
+
+        :param under_test:
+        :return:
+        """
+        for resource_key in self.get_resource_keys(under_test):
+            if resource_key in self.pinned:
+                self.pinned[resource_key] -= 1
+                if self.pinned[resource_key] <= 0:
+                    del self.pinned[resource_key]
+            # resources not planned for are kept, subject to the memory budget.
+            if resource_key not in self.remaining_uses:
+                continue
+            self.remaining_uses[resource_key] -= 1
+            if self.remaining_uses[resource_key] <= 0:
+                del self.remaining_uses[resource_key]
+                self.evict(resource_key)
+
+    def evict(self, resource_key):
+        self.resources_stats.pop(resource_key, None)
+        resource = self.resources_cache.pop(resource_key, None)
+        for cache in derived_caches:
+            cache.clear()
+        if resource is not None:
+            if isinstance(resource, SharedResource):
+                # the workers still attached keep their mappings.
+                resource.unlink()
+            logger.info('evicted resource {}'.format(resource_key[0]))
+
+    def cached_size(self):
+        return sum(self.estimate_size(resource_key) for resource_key in self.resources_cache)
+
+    def make_room_for(self, resource_key, keep=()):
+        if self.max_memory is None:
+            return
+        needed = self.estimate_size(resource_key)
+        # evict the resources with the fewest remaining uses first, then the least recently used.
+        candidates = sorted(
+            (key for key in self.resources_cache if key not in keep and key not in self.pinned),
+            key=lambda key: self.remaining_uses[key],
+        )
+        for key in candidates:
+            if self.cached_size() + needed <= self.max_memory:
+                break
+            self.evict(key)
+        if self.cached_size() + needed > self.max_memory:
+            logger.warning('memory budget exceeded when loading {}'.format(resource_key[0]))
+
     def get_filenames(self, under_test):
         requires = self.get_normalized_requires(under_test.metric.requires)
         return {
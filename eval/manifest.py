@@ -0,0 +1,159 @@
+import functools
+import hashlib
+import json
+import logging
+from pathlib import Path
+
+from eval import __version__
+from eval.consts import BUILD_MANIFEST
+from eval.utils import open_atomic
+
+logger = logging.getLogger(__name__)
+
+# read files in chunks of this size when hashing them.
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def hash_file(filename: Path):
+    digest = hashlib.sha1()
+    with filename.open('rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def describe_param(value):
+    """
+    Turn a metric attribute into something json-serializable and stable across runs.
+    Functions are described by their qualified names and partials by their function and keywords.
+
+    :param value:
+    :return:
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, Path):
+        return str(value)
+    if isinstance(value, (list, tuple)):
+        return [describe_param(item) for item in value]
+    if isinstance(value, dict):
+        return {str(key): describe_param(item) for key, item in value.items()}
+    if isinstance(value, functools.partial):
+        return {
+            'func': describe_param(value.func),
+            'args': describe_param(value.args),
+            'keywords': describe_param(value.keywords),
+        }
+    if callable(value) and hasattr(value, '__qualname__'):
+        return '{}.{}'.format(getattr(value, '__module__', None), value.__qualname__)
+    return type(value).__qualname__
+
+
+def get_metric_params(metric):
+    return {key: describe_param(value) for key, value in sorted(vars(metric).items())}
+
+
+def get_code_version(metric):
+    return '{}/{}'.format(__version__, metric.version)
+
+
+class BuildManifest:
+    """
+    A persistent record of what every output json was computed from:
+    the content hash of each input file, the params of the metric and the version of its code.
+    An output needs recomputing only if one of these changed.
+
+    Content hashes are cached by the size and mtime of a file, so that a file is hashed again
+    only when it was touched.
+    """
+
+    def __init__(self, save_dir):
+        self.filename = Path(save_dir).joinpath(BUILD_MANIFEST)
+        if self.filename.exists():
+            data = json.loads(self.filename.read_text())
+        else:
+            data = {}
+        # filename => {size, mtime, sha1}
+        self.files = data.get('files', {})
+        # output prefix => signature
+        self.outputs = data.get('outputs', {})
+
+    def get_file_hash(self, filename: Path):
+        if not filename.is_file():
+            return None
+        stat = filename.stat()
+        key = str(filename.absolute())
+        cached = self.files.get(key)
+        if cached and cached['size'] == stat.st_size and cached['mtime'] == stat.st_mtime_ns:
+            return cached['sha1']
+        logger.info('hashing {}'.format(filename))
+        sha1 = hash_file(filename)
+        self.files[key] = dict(size=stat.st_size, mtime=stat.st_mtime_ns, sha1=sha1)
+        return sha1
+
+    def signature(self, under_test, filenames, tolerance=None):
+        """
+        Compute the signature of an under_test.
+
+        :param under_test:
+        :param filenames: a dict from key to the input file for that key.
+        :param tolerance: the tolerance of an approximate run, None for an exact one.
+        :return:
+        """
+        signature = dict(
+            inputs={key: self.get_file_hash(file) for key, file in sorted(filenames.items())},
+            params=get_metric_params(under_test.metric),
+            version=get_code_version(under_test.metric),
+        )
+        if tolerance is not None:
+            signature['tolerance'] = tolerance
+        return signature
+
+    def explain(self, output: Path, under_test, filenames, tolerance=None):
+        """
+        Tell why the output of under_test needs recomputing.
+
+        :param output:
+        :param under_test:
+        :param filenames:
+        :param tolerance: the tolerance of an approximate run, None for an exact one.
+            An output at least as accurate as asked for is up to date.
+        :return: the reason as a str, or None if the output is up to date.
+        """
+        if not output.exists():
+            return 'output {} does not exist'.format(output)
+        for key, file in filenames.items():
+            if not file.exists():
+                return 'input {} ({}) does not exist'.format(key, file)
+
+        recorded = self.outputs.get(under_test.prefix)
+        current = self.signature(under_test, filenames)
+        if recorded is None:
+            # outputs made before the manifest existed are adopted if they pass the old mtime check.
+            for file in filenames.values():
+                if file.stat().st_mtime > output.stat().st_mtime:
+                    return 'no manifest entry and {} is newer than the output'.format(file)
+            self.outputs[under_test.prefix] = current
+            return None
+
+        if recorded['version'] != current['version']:
+            return 'code version changed from {} to {}'.format(recorded['version'], current['version'])
+        if recorded['params'] != current['params']:
+            return 'metric params changed'
+        recorded_tolerance = recorded.get('tolerance')
+        if recorded_tolerance is not None and (tolerance is None or tolerance < recorded_tolerance):
+            return 'output is approximate with tolerance {}'.format(recorded_tolerance)
+        for key, sha1 in current['inputs'].items():
+            if recorded['inputs'].get(key) != sha1:
+                return 'content of input {} ({}) changed'.format(key, filenames[key])
+        return None
+
+    def record(self, under_test, filenames, tolerance=None):
+        self.outputs[under_test.prefix] = self.signature(under_test, filenames, tolerance)
+        self.save()
+
+    def save(self):
+        data = dict(files=self.files, outputs=self.outputs)
+        # engines and queue workers sharing save_dir save the manifest concurrently.
+        with open_atomic(self.filename) as f:
+            f.write(json.dumps(data, indent=1, sort_keys=True))
@@ -1,3 +1,7 @@
+import asyncio
+import collections
+import functools
+import locale
 import logging
 import re
 import subprocess
@@ -5,18 +9,21 @@ import sys
 from pathlib import Path
 
 import pickle
-from nltk.translate.bleu_score import sentence_bleu, corpus_bleu, SmoothingFunction
+
+import numpy as np
 
 import embedding_based as eb
 import lsdscc
-import rouge
-from distinct_n import distinct_n_sentence_level
+from eval import bleu, diversity, ngram_index, rouge_engine, self_bleu
 from eval.consts import *
 from eval.utils import load_template
 
 logger = logging.getLogger(__name__)
 metrics_classes = {}
 
+# the system score of a metric whose corpus level is the mean of its sentence level.
+MeanScore = collections.namedtuple('MeanScore', 'mean')
+
 
 def register_metric(cls):
     metrics_classes[cls.name] = cls
@@ -32,14 +39,76 @@ class MetricWrapper:
     utterance_field = None
     # extract this field for system score.
     system_field = None
+    # extract this field of each utterance score as its sufficient stats, which are saved next to the scores.
+    stats_field = None
     # name corresponding to a class
     name = None
     # name corresponding to an instance (optional)
     variant = None
+    # bump this when a change of the code changes the scores, so that the outputs are recomputed.
+    version = 1
+    # rough seconds per example, used to estimate the run time when there is no history.
+    cost_per_example = 1e-4
+
+    # whether the metric scores a random sample of the examples by itself, with approximate().
+    sampled = False
+
+    # whether the system score is the mean of the utterance scores, which the mean of a random subset
+    # estimates within a confidence interval. A corpus-level score on a subset has no such bound.
+    mean_system = True
+
+    # keys of the payload that are aligned corpora and can be split into shards.
+    # a metric with shard_keys computes its scores with score_utterance() and score_system().
+    shard_keys = ()
+
+    def __call__(self, **kwargs):
+        utterance = self.score_utterance(**kwargs)
+        return utterance, self.score_system(utterance, **kwargs)
+
+    def score_utterance(self, **kwargs):
+        """
+        Compute the utterance scores of the payload, which may be a shard of the whole corpus.
+        """
+        raise NotImplementedError
+
+    def score_system(self, utterance, **kwargs):
+        """
+        Compute the system score given the utterance scores and the payload of the whole corpus.
+        None means the mean of the utterance scores.
+        """
+        return None
+
+    # whether the metric supports the streaming protocol: init(), update() and finalize().
+    # the engine then feeds it aligned batches of the shard_keys instead of whole corpora.
+    streaming = False
+
+    def approximate(self, **kwargs):
+        """
+        Score a random sample of the examples of the payload, for a sampled metric.
 
-    def __call__(self, *args, **kwargs):
+        :return: (result, approximation) as eval.progressive.compute_progressive().
+        """
         raise NotImplementedError
 
+    def init(self, **kwargs):
+        """
+        Make the state of a streaming run, given the resources that are not shard_keys.
+        """
+        return None
+
+    def update(self, state, **kwargs):
+        """
+        Compute the utterance scores of a batch and accumulate it into state.
+        kwargs has a batch of each shard_key and the other resources.
+        """
+        return self.score_utterance(**kwargs)
+
+    def finalize(self, state, utterance):
+        """
+        Compute the system score of a streaming run given its state and all the utterance scores.
+        """
+        return None
+
     @property
     def fullname(self):
         parts = []
@@ -60,27 +129,112 @@ class MetricWrapper:
         return True
 
 
+class SubprocessMetric(MetricWrapper):
+    """
+    A metric computed by an external tool in a subprocess.
+    Subclasses build the command with get_command() and parse what it printed with parse_output().
+    The engine may run them with acall() so that other metrics are computed while the tool runs.
+    """
+    # name of the external tool, under_tests on the same tool share a concurrency limit.
+    external_tool = None
+    # how many instances of the external tool may run at the same time.
+    max_concurrency = 1
+    # whether the scores are read from the stdout of the tool.
+    capture_output = True
+
+    def get_command(self, **kwargs):
+        raise NotImplementedError
+
+    def get_cwd(self):
+        return None
+
+    def parse_output(self, text):
+        raise NotImplementedError
+
+    def __call__(self, **kwargs):
+        cmd = self.get_command(**kwargs)
+        logger.info('cmd: {}'.format(cmd))
+        if self.capture_output:
+            text = subprocess.check_output(cmd, shell=True, cwd=self.get_cwd(), universal_newlines=True)
+        else:
+            subprocess.check_call(cmd, shell=True, cwd=self.get_cwd(), universal_newlines=True)
+            text = None
+        return self.parse_output(text)
+
+    async def acall(self, **kwargs):
+        cmd = self.get_command(**kwargs)
+        logger.info('cmd: {}'.format(cmd))
+        process = await asyncio.create_subprocess_shell(
+            cmd,
+            cwd=self.get_cwd(),
+            stdout=asyncio.subprocess.PIPE if self.capture_output else None,
+        )
+        stdout, _ = await process.communicate()
+        if process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, cmd, output=stdout)
+        text = None
+        if stdout is not None:
+            # decode like universal_newlines=True does.
+            text = stdout.decode(locale.getpreferredencoding(False)).replace('\r\n', '\n').replace('\r', '\n')
+        return self.parse_output(text)
+
+
+def get_pair_stats(responses, max_order, reference_ngrams=None, references=None):
+    """
+    Get the BLEU stats of every pair from the cache, which BLEU and ROUGE-N of every order share.
+    """
+    if reference_ngrams is not None:
+        if not len(responses):
+            return []
+        references = ngram_index.as_index(reference_ngrams)
+    return bleu.stats_cache.get(references, responses, max_order)
+
+
 @register_metric
 class BleuScore(MetricWrapper):
     name = 'bleu'
-    cherry = SmoothingFunction()
-    requires = (RESPONSES, REFERENCES)
+    # the n-grams of the references come from their index.
+    requires = {RESPONSES: 'token_ids', REFERENCE_NGRAMS: 'ngram_index'}
+    shard_keys = (RESPONSES, REFERENCE_NGRAMS)
+    streaming = True
+    mean_system = False
 
     def __init__(self, n, smoothing):
         self.n = n
         self.smoothing = smoothing
-        self._weights = [1 / n for _ in range(n)]
-        self._smoothing_fn = self.cherry.method1 if smoothing else self.cherry.method0
-
-    def __call__(self, responses, references):
+        self._weights = bleu.get_weights(n)
+        self._method = bleu.get_method(smoothing)
+        self._max_order = bleu.get_max_order(n, self._method)
+        if self._max_order > ngram_index.MAX_ORDER:
+            # the index is too short for this order or method.
+            self.requires = {RESPONSES: 'token_ids', REFERENCES: 'token_ids'}
+            self.shard_keys = (RESPONSES, REFERENCES)
+
+    def get_pair_stats(self, responses, **references):
+        # the pair stats are shared with the other orders and with score_system().
+        return get_pair_stats(responses, self._max_order, **references)
+
+    def score_utterance(self, responses, **references):
+        pair_stats = self.get_pair_stats(responses, **references)
+        return [bleu.sentence_bleu(stats, self._weights, self._method) for stats in pair_stats]
+
+    def score_system(self, utterance, responses, **references):
         logger.info('responses: {}'.format(len(responses)))
-        logger.info('references: {}'.format(len(references)))
+        # the system score is not smoothed.
+        return bleu.corpus_bleu_from_pairs(self.get_pair_stats(responses, **references), self._weights)
 
-        list_of_references = [[ref] for ref in references]
-        utterance = [sentence_bleu(ref, hypo, self._weights, smoothing_function=self._smoothing_fn)
-                     for ref, hypo in zip(list_of_references, responses)]
-        system = corpus_bleu(list_of_references, responses, self._weights)
-        return utterance, system
+    def init(self):
+        return bleu.CorpusBleuStats(self._max_order)
+
+    def update(self, state: bleu.CorpusBleuStats, responses, **references):
+        utterance = []
+        for stats in self.get_pair_stats(responses, **references):
+            state.add_stats(stats)
+            utterance.append(bleu.sentence_bleu(stats, self._weights, self._method))
+        return utterance
+
+    def finalize(self, state: bleu.CorpusBleuStats, utterance):
+        return state.corpus_bleu(self._weights)
 
     @classmethod
     def parse_config(cls, config):
@@ -95,36 +249,97 @@ class BleuScore(MetricWrapper):
         return '_'.join((self.name, str(self.n)))
 
 
+@register_metric
+class SelfBleuScore(MetricWrapper):
+    name = 'self_bleu'
+    # every response is scored against all the others, so the responses are never split into shards.
+    requires = {RESPONSES: 'token_ids'}
+    shard_keys = ()
+
+    def __init__(self, n, smoothing, tolerance=None):
+        """
+        :param n:
+        :param smoothing: as that of BleuScore.
+        :param tolerance: if set, score random responses until the confidence interval
+            of their mean has a half width below it.
+        """
+        self.n = n
+        self.smoothing = smoothing
+        self.tolerance = tolerance
+        self.sampled = tolerance is not None
+        self._weights = bleu.get_weights(n)
+        self._method = bleu.get_method(smoothing)
+        self._max_order = bleu.get_max_order(n, self._method)
+
+    def score_pair(self, stats):
+        return bleu.sentence_bleu(stats, self._weights, self._method)
+
+    def score_utterance(self, responses):
+        # the index is shared with the other orders.
+        index = self_bleu.index_cache.get_index(responses, self._max_order)
+        return [self.score_pair(stats) for stats in index.get_pair_stats(np.arange(len(index)))]
+
+    def approximate(self, responses):
+        index = self_bleu.index_cache.get_index(responses, self._max_order)
+        utterance, approximation = self_bleu.sample_scores(index, self.score_pair, self.tolerance)
+        return (utterance, self.score_system(utterance)), approximation
+
+    @classmethod
+    def parse_config(cls, config):
+        smoothing = config.get('smoothing', True)
+        tolerance = config.get('tolerance')
+        for n in config['n']:
+            yield cls(n, smoothing, tolerance)
+
+    @property
+    def fullname(self):
+        return '_'.join((self.name, str(self.n)))
+
+
 @register_metric
 class EmbeddingBasedScore(MetricWrapper):
     name = 'embedding_based'
+    cost_per_example = 1e-3
     requires = (RESPONSES, REFERENCES, EMBEDDINGS)
+    shard_keys = (RESPONSES, REFERENCES)
+    streaming = True
     system_field = 'mean'
+    # the system score is the mean of the sentence scores, which the shards merge exactly.
+    # it replaces the corpus score of embedding_based, whose confidence interval and std were never exported.
+    version = 2
     variants = {
-        'vector_average': (eb.average_sentence_level, eb.average_corpus_level),
-        'vector_extrema': (eb.extrema_sentence_level, eb.extrema_corpus_level),
-        'greedy_matching': (eb.greedy_match_sentence_level, eb.greedy_match_corpus_level)
+        'vector_average': eb.average_sentence_level,
+        'vector_extrema': eb.extrema_sentence_level,
+        'greedy_matching': eb.greedy_match_sentence_level,
     }
 
-    def __init__(self, variant, embeddings_file, sentence_level, corpus_level):
+    def __init__(self, variant, embeddings_file, sentence_level):
         self.variant = variant
         self.embeddings_file = embeddings_file
         self.sentence_level = sentence_level
-        self.corpus_level = corpus_level
 
     def __call__(self, responses, references, embeddings=None):
         if embeddings is None:
-            embeddings = self.load_embeddings(self.embeddings_file)
-        utterance = [
+            embeddings = eb.load_word2vec_binary(self.embeddings_file)
+        return super().__call__(responses=responses, references=references, embeddings=embeddings)
+
+    def score_utterance(self, responses, references, embeddings):
+        return [
             self.sentence_level(hypo, ref, embeddings) for hypo, ref in zip(responses, references)
         ]
-        system = self.corpus_level(responses, references, embeddings)
-        return utterance, system
+
+    def score_system(self, utterance, responses, references, embeddings):
+        return MeanScore(np.mean(utterance))
+
+    def update(self, state, responses, references, embeddings):
+        return self.score_utterance(responses, references, embeddings)
+
+    def finalize(self, state, utterance):
+        return self.score_system(utterance, None, None, None)
 
     @classmethod
     def new(cls, variant, embeddings_file):
-        args = cls.variants[variant]
-        return cls(variant, embeddings_file, *args)
+        return cls(variant, embeddings_file, cls.variants[variant])
 
     @classmethod
     def parse_config(cls, config):
@@ -136,33 +351,50 @@ class EmbeddingBasedScore(MetricWrapper):
 @register_metric
 class RougeScore(MetricWrapper):
     name = 'rouge'
-    requires = (REFERENCES, RESPONSES)
+    cost_per_example = 5e-4
+    requires = {REFERENCES: 'token_ids', RESPONSES: 'token_ids'}
+    shard_keys = (REFERENCES, RESPONSES)
+    streaming = True
+    mean_system = False
     utterance_field = 'f1_measure'
     system_field = utterance_field
+    # the stats are saved so that the scores of other alphas can be computed by eval.rouge_sweep.
+    stats_field = 'stats'
+    # the system score is computed from the stats of the sentence scores. That of ROUGE-L and ROUGE-W is
+    # a pooled score, not the summary-level score of the rouge package, see eval.rouge_engine.
+    # bumped for the sentence scores of ROUGE-W to be those of the rouge package again.
+    version = 5
     variants = {
-        'rouge_n': (rouge.rouge_n_sentence_level, rouge.rouge_n_summary_level),
-        'rouge_l': (rouge.rouge_l_sentence_level, rouge.rouge_l_summary_level),
-        'rouge_w': (rouge.rouge_w_sentence_level, rouge.rouge_w_summary_level),
+        'rouge_n': (rouge_engine.rouge_n_sentence_level, rouge_engine.rouge_n_corpus_level),
+        'rouge_l': (rouge_engine.rouge_l_sentence_level, rouge_engine.rouge_l_pooled_level),
+        'rouge_w': (rouge_engine.rouge_w_sentence_level, rouge_engine.rouge_w_pooled_level),
     }
 
     def __init__(self, variant, sentence_level, corpus_level, params):
         self.variant = variant
         self.params = params
-        self.sentence_level = lambda s, r: sentence_level(s, r, **params)
-        self.corpus_level = lambda s, r: corpus_level(s, r, **params)
+        # partial() instead of lambda so that the instance can be sent to worker processes.
+        self.sentence_level = functools.partial(sentence_level, **params)
+        self.corpus_level = functools.partial(corpus_level, **params) if corpus_level else None
 
-    def __call__(self, responses, references):
-        utterance = [
+    def score_utterance(self, responses, references):
+        return [
             self.sentence_level(sum, ref) for sum, ref in zip(responses, references)
         ]
-        # this is too slow.
-        # system = self.corpus_level(responses, references)
-        system = None
-        return utterance, system
+
+    def score_system(self, utterance, **kwargs):
+        if self.corpus_level is None:
+            return None
+        return self.corpus_level(utterance)
+
+    def finalize(self, state, utterance):
+        return self.score_system(utterance)
 
     @classmethod
     def new(cls, variant, **kwargs):
         fn_args = cls.variants[variant]
+        if variant == 'rouge_n':
+            cls = RougeNScore
         return cls(variant, *fn_args, params=kwargs)
 
     @classmethod
@@ -184,17 +416,70 @@ class RougeScore(MetricWrapper):
         return self.variant
 
 
-@register_metric
-class DistinctScore(MetricWrapper):
-    name = 'distinct_n'
-    requires = (RESPONSES,)
+class RougeNScore(RougeScore):
+    """
+    ROUGE-N of one order. Its n-gram overlaps are the clipped matches of BLEU, so the n-grams of a corpus are
+    counted once for every order of ROUGE-N and BLEU, and those of the references come from their index.
+    """
+    requires = {RESPONSES: 'token_ids', REFERENCE_NGRAMS: 'ngram_index'}
+    shard_keys = (RESPONSES, REFERENCE_NGRAMS)
+
+    def __init__(self, variant, sentence_level, corpus_level, params):
+        super().__init__(variant, sentence_level, corpus_level, params)
+        self.n = params['n']
+        # the order is in the stats of the sentence scores.
+        self.corpus_level = functools.partial(corpus_level, alpha=params.get('alpha'))
+        # the same orders as BLEU, so that their pair stats are shared.
+        self._max_order = max(bleu.MAX_ORDER, self.n)
+        if self._max_order > ngram_index.MAX_ORDER:
+            self.requires = {RESPONSES: 'token_ids', REFERENCES: 'token_ids'}
+            self.shard_keys = (RESPONSES, REFERENCES)
+
+    def score_utterance(self, responses, **references):
+        alpha = self.params.get('alpha')
+        return [
+            rouge_engine.rouge_n_score(rouge_engine.get_overlap_stats(stats, self.n), alpha)
+            for stats in get_pair_stats(responses, self._max_order, **references)
+        ]
 
-    def __init__(self, n):
+
+class DiversityScore(MetricWrapper):
+    """
+    A diversity metric of the responses alone, whose sentence and corpus levels are computed
+    from the n-gram counts of eval.diversity, shared by every order and diversity metric.
+    """
+    requires = {RESPONSES: 'token_ids'}
+    shard_keys = (RESPONSES,)
+    streaming = True
+    mean_system = False
+
+    def __init__(self, n, precision=None):
         self.n = n
+        self.precision = precision
+        self._max_order = max(diversity.MAX_ORDER, n)
+
+    def score_sentences(self, sentences: diversity.SentenceStats):
+        raise NotImplementedError
+
+    def score_corpus(self, stats: diversity.DiversityStats):
+        raise NotImplementedError
+
+    def score_utterance(self, responses):
+        _, sentences = diversity.stats_cache.get(responses, self._max_order, self.precision)
+        return self.score_sentences(sentences)
+
+    def score_system(self, utterance, responses):
+        stats, _ = diversity.stats_cache.get(responses, self._max_order, self.precision)
+        return self.score_corpus(stats)
+
+    def init(self):
+        return diversity.DiversityStats(self._max_order, self.precision)
+
+    def update(self, state: diversity.DiversityStats, responses):
+        return self.score_sentences(state.add(responses))
 
-    def __call__(self, responses):
-        utterance = [distinct_n_sentence_level(s, self.n) for s in responses]
-        return utterance, None
+    def finalize(self, state: diversity.DiversityStats, utterance):
+        return self.score_corpus(state)
 
     @classmethod
     def parse_config(cls, config):
@@ -203,53 +488,95 @@ class DistinctScore(MetricWrapper):
 
     @property
     def fullname(self):
-        return 'distinct_{}'.format(self.n)
+        # distinct_n => distinct_1.
+        return '{}_{}'.format(self.name.rsplit('_', 1)[0], self.n)
+
+
+@register_metric
+class DistinctScore(DiversityScore):
+    name = 'distinct_n'
+    # the system score is the corpus distinct-n instead of the mean of the sentences.
+    version = 2
+
+    def score_sentences(self, sentences):
+        return diversity.get_distinct_n(sentences, self.n)
+
+    def score_corpus(self, stats):
+        return stats.distinct_n(self.n)
+
+    @classmethod
+    def parse_config(cls, config):
+        # a precision counts the distinct n-grams of the corpus approximately, in bounded memory.
+        precision = config.get('precision')
+        for n in config['n']:
+            yield cls(n, precision)
+
+
+@register_metric
+class EntropyScore(DiversityScore):
+    name = 'entropy_n'
+
+    def score_sentences(self, sentences):
+        return diversity.get_entropy_n(sentences, self.n)
+
+    def score_corpus(self, stats):
+        return stats.entropy_n(self.n)
 
 
 @register_metric
 class UtteranceLenScore(MetricWrapper):
     name = 'utterance_len'
     requires = (RESPONSES,)
+    shard_keys = requires
+    streaming = True
 
-    def __call__(self, responses):
-        utterance = [len(r) for r in responses]
-        return utterance, None
+    def score_utterance(self, responses):
+        return [len(r) for r in responses]
 
 
 @register_metric
-class ADEMScore(MetricWrapper):
+class ADEMScore(SubprocessMetric):
     name = 'adem'
+    cost_per_example = 1e-2
     requires = {
         CONTEXTS: 'filename',
         REFERENCES: 'filename',
         RESPONSES: 'filename',
     }
+    external_tool = 'adem'
+    # the scores are written to the same OUTPUT_FILE by every run.
+    max_concurrency = 1
+    capture_output = False
 
     from eval.consts import ADEM_IMAGE, ADEM_ROOT, ADEM_OUTPUT_FILE
     OUTPUT_FILE = Path(ADEM_ROOT).joinpath(ADEM_OUTPUT_FILE)
     TEMPLATE = load_template(name)
 
-    def __call__(self, contexts, references, responses):
-        cmd = self.TEMPLATE.format(
+    def get_command(self, contexts, references, responses):
+        return self.TEMPLATE.format(
             contexts=contexts,
             references=references,
             responses=responses,
             adem_image=self.ADEM_IMAGE,
             adem_root=self.ADEM_ROOT,
         )
-        logger.info('running cmd {}'.format(cmd))
-        subprocess.check_call(cmd, shell=True, universal_newlines=True)
+
+    def parse_output(self, text):
         file_content = self.OUTPUT_FILE.read_text()
         return list(map(float, file_content.splitlines())), None
 
 
 @register_metric
-class METEORScore(MetricWrapper):
+class METEORScore(SubprocessMetric):
     name = 'meteor'
+    cost_per_example = 1e-3
     requires = {
         REFERENCES: 'filename',
         RESPONSES: 'filename',
     }
+    external_tool = 'meteor'
+    # each run takes a 2G java heap.
+    max_concurrency = 2
 
     # Segment 18920 score:    0.33113214948831016
     SEGMENT_SCORE_RE = re.compile(r'^Segment \d+ score:\s+(.*)$', flags=re.MULTILINE)
@@ -260,15 +587,17 @@ class METEORScore(MetricWrapper):
     METEOR_JAR_FILE = Path(METEOR_JAR_FILE)
     TEMPLATE = load_template(name)
 
-    def __call__(self, references, responses):
-        cmd = self.TEMPLATE.format(
+    def get_command(self, references, responses):
+        return self.TEMPLATE.format(
             jar_file=self.METEOR_JAR_FILE,
             references=references,
             responses=responses,
         )
-        logger.info('cmd: {}'.format(cmd))
-        text = subprocess.check_output(cmd,
-                                       shell=True, cwd=self.METEOR_JAR_FILE.parent, universal_newlines=True)
+
+    def get_cwd(self):
+        return self.METEOR_JAR_FILE.parent
+
+    def parse_output(self, text):
         utterance = self.SEGMENT_SCORE_RE.findall(text)
         utterance = list(map(float, utterance))
         system = self.SYSTEM_SCORE_RE.search(text)
@@ -279,6 +608,7 @@ class METEORScore(MetricWrapper):
 @register_metric
 class LSDSCCScore(MetricWrapper):
     name = 'lsdscc'
+    cost_per_example = 1e-2
     utterance_field = ('max_bleu', 'pds', 'mds')
 
     requires = {
@@ -326,8 +656,12 @@ class LSDSCCScore(MetricWrapper):
 
 
 @register_metric
-class SerbanModelPPLScore(MetricWrapper):
+class SerbanModelPPLScore(SubprocessMetric):
     name = 'serban_ppl'
+    cost_per_example = 1e-2
+    external_tool = 'serban_ppl'
+    # the docker container is named after the metric and runs on a GPU.
+    max_concurrency = 1
 
     SERBAN_MODELS = ('hred', 'vhred', 'lstm')
 
@@ -345,16 +679,16 @@ class SerbanModelPPLScore(MetricWrapper):
     def __init__(self, remove_stopwords=False):
         self.remove_stopwords = remove_stopwords
 
-    def __call__(self, model_weights: Path, test_dialogues: Path):
-        cmd = self.TEMPLATE.format(
+    def get_command(self, model_weights: Path, test_dialogues: Path):
+        return self.TEMPLATE.format(
             model_prefix=model_weights.name.replace('_model.npz', ''),
             save_dir=model_weights.parent,
             test_path=test_dialogues,
             remove_stopwords='-e' if self.remove_stopwords else '',
             name=self.name,
         )
-        logger.info('cmd: {}'.format(cmd))
-        text = subprocess.check_output(cmd, shell=True, universal_newlines=True)
+
+    def parse_output(self, text):
         utterance = list(map(float, self.UTTER_PPL_RE.findall(text)))
         system = float(self.SYS_PPL_RE.search(text).group(1))
         return utterance, system
@@ -43,14 +43,54 @@ class SerbanModelFinder:
         model_files = sorted(model_files, key=lambda file: file.stat().st_mtime, reverse=True)
         latest_model: Path = model_files[0]
         logger.info('Found latest npz file: {}'.format(latest_model))
+        self.check_model_files(latest_model)
+        return latest_model
 
-        model_id = latest_model.name.replace(model_suffix, '')
-        model_prefix = latest_model.with_name(model_id)
+    def check_model_files(self, model_file):
+        model_id = self.get_checkpoint_id(model_file)
         for suffix in self.SUFFIXES:
-            file = model_prefix.with_name(model_id + suffix)
+            file = model_file.with_name(model_id + suffix)
             if not file.exists():
                 raise ValueError('file {} does not exist'.format(file))
-        return latest_model
+
+    def get_checkpoint_id(self, model_file):
+        return model_file.name.replace(self.SUFFIXES[0], '')
+
+    def find_checkpoints(self, model_dir):
+        """
+        Find all the complete checkpoints of a model, including the _auto_ ones, from the oldest to the newest.
+        """
+        checkpoints = []
+        for model_file in sorted(model_dir.glob('*' + self.SUFFIXES[0]), key=lambda file: file.stat().st_mtime):
+            try:
+                self.check_model_files(model_file)
+            except ValueError as e:
+                logger.warning('skipping checkpoint {}: {}'.format(model_file, e))
+                continue
+            checkpoints.append(model_file)
+        return checkpoints
+
+    def find_checkpoint_models(self, model_dir):
+        """
+        Make a SerbanModel of every checkpoint of the model in model_dir, whose responses are written
+        next to the checkpoint.
+        """
+        model_dir = Path(model_dir)
+        name = model_dir.name.lower()
+        trained_on = model_dir.parent.name.lower()
+        for weights in self.find_checkpoints(model_dir):
+            # the SEPARATOR of under_test prefixes is not allowed in names, and a dot would pass for a suffix.
+            checkpoint = re.sub(r'[-.]', '_', self.get_checkpoint_id(weights))
+            model = SerbanModel(
+                name='{}@{}'.format(name, checkpoint),
+                trained_on=trained_on,
+                responses=weights.with_name('{}_{}'.format(self.get_checkpoint_id(weights), OUTPUT_FILENAME)),
+                weights=weights,
+                prototype=SerbanModel.get_prototype(name, trained_on),
+            )
+            model.base_name = name
+            model.checkpoint = checkpoint
+            yield model
 
     def find_models(self):
         for dataset_dir in subdirs(self.model_root):
@@ -72,6 +112,13 @@ def find_serban_models(model_root=SERBAN_MODEL_ROOT):
     return list(SerbanModelFinder(model_root).find_models())
 
 
+def find_serban_checkpoints(model_dir):
+    """
+    Find a SerbanModel for every checkpoint of the model in model_dir, i.e. model_root/dataset/model.
+    """
+    return list(SerbanModelFinder(Path(model_dir).parent.parent).find_checkpoint_models(model_dir))
+
+
 def find_random_models(model_root=RANDOM_MODEL_ROOT):
     model_root = Path(model_root)
     model_name = model_root.name.lower()
@@ -123,18 +170,24 @@ class SerbanModel(Model):
     def _get_docker_name(self, job):
         return f'{self.name}_{self.trained_on}_{job}'
 
-    def sample(self):
+    def sample(self, wait=True):
+        """
+        Sample the responses to the contexts of the dataset the model was trained on, unless they are up to date.
+
+        :param wait: if False, return the sampling process as soon as it starts, or None if up to date.
+        :return:
+        """
         from eval.repo import get_dataset
 
         context = get_dataset(self.trained_on).contexts
         sources = [self.weights, context]
         target = self.responses
         if should_make(target, sources):
-            self._do_sample(context)
-        else:
-            logger.info('sample output is up to date')
+            return self._do_sample(context, wait)
+        logger.info('sample output is up to date')
+        return None
 
-    def _do_sample(self, context):
+    def _do_sample(self, context, wait=True):
         template = load_template('serban_sample')
         cmd = template.format(
             name=self._get_docker_name('sample'),
@@ -143,7 +196,12 @@ class SerbanModel(Model):
             gpu=get_random_gpu(),
             context=context,
         )
-        return subprocess.check_call(cmd, shell=True)
+        if wait:
+            return subprocess.check_call(cmd, shell=True)
+        # a reader tailing the output must not take the old responses for new ones.
+        if Path(self.responses).exists():
+            Path(self.responses).unlink()
+        return subprocess.Popen(cmd, shell=True)
 
 
 def model_path(response_path):
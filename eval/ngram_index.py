@@ -0,0 +1,336 @@
+"""
+A persistent index of the n-grams of the references of a dataset, so that the lexical metrics of every model
+trained on it only count the n-grams of the hypotheses.
+
+For every reference and every order up to max_order, the index keeps the distinct n-grams, as 64-bit hashes,
+with their counts. The groups of (reference, order) are laid out one after another, each sorted by hash:
+
+    hashes.npy    uint64, the hashes of the n-grams.
+    counts.npy    uint32, the count of each n-gram in its reference.
+    offsets.npy   int64, the start of group reference * max_order + order - 1, plus the end.
+    lengths.npy   int32, the length of each reference.
+    meta.json     the version of the index, its max_order and the size, mtime and sha1 of the references.
+
+The arrays are memory-mapped, so the index costs no memory of its own and is shared by all the processes
+of a run through the page cache. It lives beside the references file and is rebuilt when their content changes.
+"""
+import hashlib
+import json
+import logging
+import numbers
+import os
+import shutil
+import weakref
+from pathlib import Path
+
+import numpy as np
+
+from eval.bleu import PairStats
+from eval.corpus import TokenIdCorpus
+from eval.manifest import hash_file
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+MAX_ORDER = 4
+ARRAYS = ('hashes', 'counts', 'offsets', 'lengths')
+META = 'meta.json'
+# an odd 64-bit multiplier mixing the hash of an n-gram with its next token.
+MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+def get_index_dir(filename):
+    filename = Path(filename)
+    return filename.with_name('.{}.ngrams'.format(filename.name))
+
+
+class TokenHasher:
+    """
+    Stable 64-bit hashes of tokens, unlike hash() which is salted per process.
+    """
+
+    def __init__(self):
+        self.cache = {}
+        # vocabulary => the hashes of its tokens, by id, freed with the vocabulary.
+        self.id_hashes = weakref.WeakKeyDictionary()
+
+    def __call__(self, token):
+        value = self.cache.get(token)
+        if value is None:
+            digest = hashlib.blake2b(str(token).encode(), digest_size=8).digest()
+            value = self.cache[token] = int.from_bytes(digest, 'little')
+        return value
+
+    def hash_ids(self, ids, vocab):
+        """
+        Hash the tokens of vocab with the given ids, the same as the tokens themselves.
+        """
+        id_hashes = self.id_hashes.get(vocab, np.zeros(0, dtype=np.uint64))
+        known = len(id_hashes)
+        if known < len(vocab):
+            new_hashes = np.array([self(token) for token in vocab.tokens[known:]], dtype=np.uint64)
+            id_hashes = self.id_hashes[vocab] = np.concatenate([id_hashes, new_hashes])
+        return id_hashes[ids]
+
+    def hash_corpus(self, token_lists):
+        """
+        :param token_lists: sentences of tokens, or a TokenIdCorpus.
+        :return: (hashes of all the tokens in a row, offsets of the sentences).
+        """
+        if isinstance(token_lists, TokenIdCorpus):
+            return self.hash_ids(token_lists.ids, token_lists.vocab), token_lists.offsets
+        tokens = []
+        offsets = [0]
+        for sentence in token_lists:
+            tokens.extend(sentence)
+            offsets.append(len(tokens))
+        if tokens and isinstance(tokens[0], numbers.Integral):
+            # the ids mean nothing without the vocabulary of their dataset.
+            raise TypeError('token ids must come in a TokenIdCorpus, which has their vocabulary')
+        hashes = np.array([self(token) for token in tokens], dtype=np.uint64)
+        return hashes, np.array(offsets, dtype=np.int64)
+
+
+hash_token = TokenHasher()
+
+
+def count_ngrams(token_lists, max_order=MAX_ORDER):
+    """
+    Count the n-grams of every sentence and order at once.
+
+    :param token_lists: the sentences.
+    :param max_order:
+    :return: (groups, hashes, counts, lengths) where the distinct n-grams are sorted by group and hash,
+        a group being sentence * max_order + order - 1.
+    """
+    tokens, offsets = hash_token.hash_corpus(token_lists)
+    lengths = np.diff(offsets)
+    sentences = np.repeat(np.arange(len(lengths), dtype=np.int64), lengths)
+    ends = offsets[1:][sentences]
+    all_groups = []
+    all_hashes = []
+    hashes = tokens
+    for order in range(1, max_order + 1):
+        if order > 1:
+            # uint64 arithmetic wraps around, which is what a hash wants.
+            hashes = hashes[:-1] * MULTIPLIER + tokens[order - 1:]
+        # an n-gram must not run into the next sentence.
+        starts = np.arange(len(hashes), dtype=np.int64)
+        valid = starts + order <= ends[:len(hashes)]
+        all_groups.append(sentences[:len(hashes)][valid] * max_order + order - 1)
+        all_hashes.append(hashes[valid])
+    groups = np.concatenate(all_groups)
+    hashes = np.concatenate(all_hashes)
+    # by hash, then stably by group, which is cheaper than a lexsort.
+    order = np.argsort(hashes)
+    order = order[np.argsort(groups[order], kind='stable')]
+    groups, hashes = groups[order], hashes[order]
+    if not len(groups):
+        return groups, hashes, np.zeros(0, dtype=np.uint32), lengths.astype(np.int32)
+    first = np.ones(len(groups), dtype=bool)
+    first[1:] = (groups[1:] != groups[:-1]) | (hashes[1:] != hashes[:-1])
+    starts = np.flatnonzero(first)
+    counts = np.diff(np.append(starts, len(groups))).astype(np.uint32)
+    return groups[starts], hashes[starts], counts, lengths.astype(np.int32)
+
+
+class NgramIndex:
+    """
+    The n-gram counts of a list of references. Indexing or slicing it selects references
+    without copying the arrays, so it can be sharded along with the other corpora.
+    """
+
+    def __init__(self, hashes, counts, offsets, lengths, max_order, rows=None):
+        self.hashes = hashes
+        self.counts = counts
+        self.offsets = offsets
+        self.lengths = lengths
+        self.max_order = max_order
+        # the selected references, or None for all of them.
+        self.rows = rows
+
+    @classmethod
+    def build(cls, token_lists, max_order=MAX_ORDER):
+        groups, hashes, counts, lengths = count_ngrams(token_lists, max_order)
+        offsets = np.searchsorted(groups, np.arange(len(lengths) * max_order + 1)).astype(np.int64)
+        return cls(hashes, counts, offsets, lengths, max_order)
+
+    def save(self, index_dir: Path):
+        index_dir.mkdir(parents=True, exist_ok=True)
+        for name in ARRAYS:
+            np.save(str(index_dir.joinpath(name + '.npy')), getattr(self, name))
+
+    @classmethod
+    def load(cls, index_dir: Path, max_order):
+        arrays = [np.load(str(index_dir.joinpath(name + '.npy')), mmap_mode='r') for name in ARRAYS]
+        return cls(*arrays, max_order)
+
+    def __len__(self):
+        return len(self.lengths) if self.rows is None else len(self.rows)
+
+    def get_rows(self):
+        if self.rows is None:
+            return np.arange(len(self.lengths), dtype=np.int64)
+        return self.rows
+
+    def select(self, rows):
+        return self.__class__(self.hashes, self.counts, self.offsets, self.lengths, self.max_order,
+                              np.asarray(rows, dtype=np.int64))
+
+    def __getitem__(self, index):
+        rows = self.get_rows()
+        if isinstance(index, slice):
+            return self.select(rows[index])
+        if not -len(self) <= index < len(self):
+            raise IndexError('reference index out of range')
+        return self.select(rows[index:index + 1] if index != -1 else rows[-1:])
+
+    def __iter__(self):
+        for row in self.get_rows():
+            yield self.select([row])
+
+    @classmethod
+    def concat(cls, indices):
+        """
+        Join the selections of the same index, such as the items of a shard or a batch, into one.
+        """
+        indices = list(indices)
+        if not indices:
+            raise ValueError('nothing to concat')
+        first = indices[0]
+        return first.select(np.concatenate([index.get_rows() for index in indices]))
+
+    def get_entries(self):
+        """
+        :return: (offsets, hashes, counts) of the selected references, with the groups numbered by their position
+            in the selection.
+        """
+        if self.rows is None:
+            return np.asarray(self.offsets), np.asarray(self.hashes), np.asarray(self.counts)
+        selected = (self.rows[:, None] * self.max_order + np.arange(self.max_order)).ravel()
+        starts = self.offsets[selected]
+        sizes = self.offsets[selected + 1] - starts
+        offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+        # the positions of the entries of each selected group, one run after another.
+        positions = np.arange(offsets[-1], dtype=np.int64) - np.repeat(offsets[:-1], sizes) + np.repeat(starts, sizes)
+        return offsets, self.hashes[positions], self.counts[positions]
+
+    def get_pair_stats(self, hypotheses, max_order=MAX_ORDER):
+        """
+        Compute the BLEU stats of each hypothesis against its reference, the same as bleu.get_pair_stats()
+        but with the reference side taken from the index.
+
+        :param hypotheses: one token list per selected reference.
+        :param max_order: at most the max_order of the index.
+        :return: a list of PairStats.
+        """
+        if max_order > self.max_order:
+            raise ValueError('the index has n-grams up to order {}, not {}'.format(self.max_order, max_order))
+        if len(hypotheses) != len(self):
+            raise ValueError('{} hypotheses for {} references'.format(len(hypotheses), len(self)))
+        groups, hashes, counts, hyp_lengths = count_ngrams(hypotheses, self.max_order)
+        ref_offsets, ref_hashes, ref_counts = self.get_entries()
+
+        # binary search each n-gram of the hypotheses among the n-grams of its group in the references,
+        # all the n-grams at once.
+        lo = ref_offsets[groups]
+        end = hi = ref_offsets[groups + 1]
+        last = max(len(ref_hashes) - 1, 0)
+        active = lo < hi
+        while active.any():
+            mid = np.minimum((lo + hi) // 2, last)
+            right = active & (ref_hashes[mid] < hashes)
+            lo = np.where(right, mid + 1, lo)
+            hi = np.where(active & ~right, mid, hi)
+            active = lo < hi
+        found = lo < end
+        found[found] = ref_hashes[lo[found]] == hashes[found]
+        clipped = np.minimum(counts[found], ref_counts[lo[found]])
+        numerators = np.bincount(groups[found], weights=clipped, minlength=len(self) * self.max_order)
+        numerators = numerators.astype(np.int64).reshape(len(self), self.max_order)[:, :max_order].tolist()
+
+        ref_lengths = self.lengths[self.get_rows()].tolist()
+        denominators = {}
+        pair_stats = []
+        for nums, hyp_len, ref_len in zip(numerators, hyp_lengths.tolist(), ref_lengths):
+            if hyp_len not in denominators:
+                denominators[hyp_len] = tuple(max(1, hyp_len - n + 1) for n in range(1, max_order + 1))
+            pair_stats.append(PairStats(tuple(nums), denominators[hyp_len], hyp_len, ref_len))
+        return pair_stats
+
+
+def as_index(reference_ngrams):
+    """
+    Turn what the engine passes for the reference_ngrams of a shard or a batch, which may be a list of
+    single-reference selections, into one NgramIndex.
+    """
+    if isinstance(reference_ngrams, NgramIndex):
+        return reference_ngrams
+    return NgramIndex.concat(reference_ngrams)
+
+
+def get_source_stat(filename: Path):
+    stat = filename.stat()
+    return dict(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+
+
+def is_fresh(meta, filename: Path, max_order):
+    """
+    Tell if an index with meta was built from the current content of filename.
+    The content is only hashed if the file was touched.
+    """
+    if meta.get('version') != INDEX_VERSION or meta.get('max_order') != max_order:
+        return False
+    source = meta.get('source', {})
+    stat = get_source_stat(filename)
+    if all(source.get(key) == value for key, value in stat.items()):
+        return True
+    return source.get('sha1') == hash_file(filename)
+
+
+def read_meta(index_dir: Path):
+    try:
+        return json.loads(index_dir.joinpath(META).read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def write_meta(index_dir: Path, filename: Path, max_order, sha1):
+    meta = dict(version=INDEX_VERSION, max_order=max_order, source=dict(get_source_stat(filename), sha1=sha1))
+    index_dir.joinpath(META).write_text(json.dumps(meta, indent=2))
+
+
+def get_ngram_index(filename, token_lists_fn, max_order=MAX_ORDER):
+    """
+    Load the index of a references file, building it first if it is missing or stale.
+
+    :param filename: the references file.
+    :param token_lists_fn: a function tokenizing filename into token lists.
+    :param max_order:
+    :return: an NgramIndex.
+    """
+    filename = Path(filename)
+    index_dir = get_index_dir(filename)
+    meta = read_meta(index_dir)
+    if meta is not None and is_fresh(meta, filename, max_order):
+        if not all(meta['source'].get(key) == value for key, value in get_source_stat(filename).items()):
+            # touched but not changed.
+            write_meta(index_dir, filename, max_order, meta['source']['sha1'])
+        return NgramIndex.load(index_dir, max_order)
+
+    logger.info('building the n-gram index of {}'.format(filename))
+    sha1 = hash_file(filename)
+    index = NgramIndex.build(token_lists_fn(filename), max_order)
+    # built aside and moved in place, so that a concurrent reader never sees half an index.
+    tmp_dir = index_dir.with_name('{}.tmp-{}'.format(index_dir.name, os.getpid()))
+    try:
+        index.save(tmp_dir)
+        write_meta(tmp_dir, filename, max_order, sha1)
+        if index_dir.exists():
+            shutil.rmtree(str(index_dir), ignore_errors=True)
+        os.replace(str(tmp_dir), str(index_dir))
+    except OSError as e:
+        logger.warning('cannot save the n-gram index of {}: {}'.format(filename, e))
+        shutil.rmtree(str(tmp_dir), ignore_errors=True)
+        return index
+    return NgramIndex.load(index_dir, max_order)
@@ -43,6 +43,7 @@ default_normalizers = {
         'embedding_based': normalize_eb,
         'adem': str.upper,
         'distinct': capitalize_plus,
+        'entropy': capitalize_plus,
         'utterance_len': '#words',
     }
 }
@@ -0,0 +1,149 @@
+"""
+Score the responses of a model while its sampler is still writing them.
+
+The responses file is tailed as the sampler appends lines, and each new batch is fed to the streaming
+metrics of the model alongside the matching batch of references (and contexts). The system scores are
+finalized when the sampler exits.
+"""
+import itertools
+import logging
+import time
+from pathlib import Path
+
+from eval.consts import RESPONSES
+
+logger = logging.getLogger(__name__)
+
+# how long to wait for the sampler to write more lines.
+POLL_SECONDS = 1
+DEFAULT_BATCH_SIZE = 64
+
+
+def tail_batches(filename, sampler, batch_size, poll_seconds=POLL_SECONDS):
+    """
+    Yield the lines appended to filename in batches of at most batch_size until sampler exits.
+    A partial batch is yielded whenever no complete line is available for now, so that scoring
+    keeps up with the sampler.
+
+    :param filename: the file the sampler writes to.
+    :param sampler: a subprocess.Popen.
+    :param batch_size:
+    :param poll_seconds:
+    :return:
+    """
+    filename = Path(filename)
+    while not filename.exists():
+        if sampler.poll() is not None:
+            return
+        time.sleep(poll_seconds)
+
+    with filename.open() as f:
+        batch = []
+        partial = ''
+        while True:
+            # polled before reading, so that the lines written before the exit are all read.
+            exited = sampler.poll() is not None
+            line = f.readline()
+            if line.endswith('\n'):
+                batch.append(partial + line)
+                partial = ''
+                if len(batch) == batch_size:
+                    yield batch
+                    batch = []
+                continue
+            partial += line
+            if line:
+                continue
+            if exited:
+                if partial:
+                    batch.append(partial)
+                if batch:
+                    yield batch
+                return
+            if batch:
+                yield batch
+                batch = []
+            time.sleep(poll_seconds)
+
+
+def can_pipeline(loader, under_test):
+    """
+    Tell if under_test can be scored as its responses are written, i.e. its metric streams the responses.
+    """
+    metric = under_test.metric
+    return metric.streaming and RESPONSES in metric.shard_keys and loader.can_stream(under_test, metric.shard_keys)
+
+
+def evaluate_pipelined(evaluator, under_tests, sampler, batch_size=None):
+    """
+    Evaluate under_tests sharing the responses being written by sampler.
+
+    :param evaluator: an Evaluator whose loader and exporter are used.
+    :param under_tests: under_tests for which can_pipeline() is true, all on the same responses.
+    :param sampler: the subprocess.Popen writing the responses.
+    :param batch_size:
+    :return: a dict from under_test to the stats of its run. The under_tests whose resources
+        were unavailable are left out, and nothing is exported if the sampler failed.
+    """
+    loader = evaluator.loader
+    try:
+        start = time.perf_counter()
+        runs = {}
+        for under_test in under_tests:
+            metric = under_test.metric
+            resources = loader.load_resources(under_test, skip=metric.shard_keys)
+            if resources is None:
+                continue
+            # the other corpora are already complete and read along.
+            corpora = {
+                key: loader.iter_items(key, under_test)
+                for key in metric.shard_keys if key != RESPONSES
+            }
+            runs[under_test] = dict(resources=resources, corpora=corpora, state=metric.init(**resources),
+                                    utterance=[], seconds=0.0)
+        loaded = time.perf_counter()
+
+        responses = loader.get_filename_for_key(RESPONSES, next(iter(under_tests)))
+        logger.info('tailing {} for {} under_tests'.format(responses, len(runs)))
+        for lines in tail_batches(responses, sampler, batch_size or DEFAULT_BATCH_SIZE):
+            for under_test, run in runs.items():
+                updating = time.perf_counter()
+                batch = loader.parse_lines(RESPONSES, under_test, lines)
+                aligned = {key: loader.make_batch(key, under_test, itertools.islice(corpus, len(batch)))
+                           for key, corpus in run['corpora'].items()}
+                if any(len(items) != len(batch) for items in aligned.values()):
+                    raise ValueError('{} of {!r} are not aligned'.format(', '.join(under_test.metric.shard_keys),
+                                                                         under_test))
+                run['utterance'].extend(under_test.metric.update(run['state'], responses=batch, **aligned,
+                                                                 **run['resources']))
+                run['seconds'] += time.perf_counter() - updating
+            logger.info('scored {} more responses from {}'.format(len(lines), responses))
+
+        returncode = sampler.wait()
+        if returncode != 0:
+            logger.error('sampler of {} exited with {}, discarding its scores'.format(responses, returncode))
+            return {}
+
+        results = {}
+        for under_test, run in runs.items():
+            if any(next(corpus, None) is not None for corpus in run['corpora'].values()):
+                logger.error('{} of {!r} are not aligned'.format(', '.join(under_test.metric.shard_keys), under_test))
+                continue
+            finalizing = time.perf_counter()
+            utterance = run['utterance']
+            system = under_test.metric.finalize(run['state'], utterance)
+            computed = time.perf_counter()
+            evaluator.exporter.export_json((utterance, system), under_test)
+            results[under_test] = dict(
+                load_seconds=loaded - start,
+                # not counting the time spent waiting for the sampler.
+                compute_seconds=run['seconds'] + computed - finalizing,
+                export_seconds=time.perf_counter() - computed,
+                num_examples=len(utterance),
+                # the under_tests of the pipeline share this process and its batches.
+                peak_memory=None,
+            )
+        return results
+    finally:
+        for under_test in under_tests:
+            loader.release(under_test)
@@ -0,0 +1,103 @@
+import collections
+import logging
+
+from eval.loader import get_format_name
+from eval.scheduler import HISTORY
+from eval.utils import format_size, format_seconds
+
+logger = logging.getLogger(__name__)
+
+FRESH = 'fresh'
+STALE = 'stale'
+MISSING = 'missing'
+
+
+class PlanEntry:
+    """
+    What would happen to an under_test in a run, and what it would cost.
+    """
+
+    def __init__(self, under_test, status, reason, resources, num_examples, seconds, memory, estimated_from):
+        self.under_test = under_test
+        self.status = status
+        self.reason = reason
+        self.resources = resources
+        self.num_examples = num_examples
+        self.seconds = seconds
+        self.memory = memory
+        self.estimated_from = estimated_from
+
+    def __repr__(self):
+        return '<{} {} {}>'.format(self.__class__.__qualname__, self.under_test.prefix, self.status)
+
+
+def get_resources(loader, under_test):
+    """
+    :return: the sorted (filename, format name) of the resources that under_test loads.
+    """
+    return sorted(set((str(filename), get_format_name(load_fn))
+                      for filename, load_fn in loader.get_resource_keys(under_test)))
+
+
+def make_plan(engine):
+    """
+    Make a PlanEntry for every under_test of engine without running any of them.
+
+    :param engine:
+    :return:
+    """
+    loader = engine.loader
+    entries = []
+    for under_test in engine.under_tests:
+        filenames = loader.get_filenames(under_test)
+        missing = [str(file) for file in filenames.values() if not file.exists()]
+        if missing:
+            status, reason = MISSING, 'missing input {}'.format(', '.join(missing))
+        else:
+            reason = engine.explain_outdated(under_test)
+            status = STALE if reason else FRESH
+        num_examples = engine.cost_model.get_num_examples(under_test)
+        seconds, estimated_from = engine.cost_model.estimate_seconds(under_test)
+        memory = engine.cost_model.estimate_memory(under_test)
+        entries.append(PlanEntry(
+            under_test=under_test,
+            status=status,
+            reason=reason,
+            resources=get_resources(loader, under_test),
+            num_examples=num_examples,
+            seconds=seconds,
+            memory=memory,
+            estimated_from=estimated_from,
+        ))
+    return entries
+
+
+def format_plan(entries, jobs=1):
+    lines = []
+    row = '{:<60} {:<8} {:>8} {:>10} {:>9}  {}'
+    lines.append(row.format('under_test', 'status', 'examples', 'time', 'memory', 'resources / reason'))
+    for entry in entries:
+        seconds = format_seconds(entry.seconds) if entry.seconds is not None else '?'
+        examples = entry.num_examples if entry.num_examples is not None else '?'
+        detail = ','.join('{}:{}'.format(format, filename) for filename, format in entry.resources)
+        if entry.reason:
+            detail += ' / ' + entry.reason
+        lines.append(row.format(entry.under_test.prefix, entry.status, examples, seconds,
+                                format_size(entry.memory), detail))
+
+    counts = collections.Counter(entry.status for entry in entries)
+    to_run = [entry for entry in entries if entry.status == STALE]
+    total_seconds = sum(entry.seconds or 0 for entry in to_run)
+    peak_memory = max((entry.memory for entry in to_run), default=0)
+    from_history = sum(1 for entry in to_run if entry.estimated_from == HISTORY)
+    users = collections.Counter(resource for entry in to_run for resource in entry.resources)
+    lines.append('')
+    lines.append('{} under_tests: {} fresh, {} stale, {} missing input'.format(
+        len(entries), counts[FRESH], counts[STALE], counts[MISSING]))
+    lines.append('{} resources to load, {} of them shared by several under_tests'.format(
+        len(users), sum(1 for count in users.values() if count > 1)))
+    lines.append('estimated time: {} serial, {} with {} jobs ({} of {} estimates from history)'.format(
+        format_seconds(total_seconds), format_seconds(total_seconds / max(jobs, 1)), jobs,
+        from_history, len(to_run)))
+    lines.append('estimated peak memory: {} per worker'.format(format_size(peak_memory)))
+    return '\n'.join(lines)
@@ -0,0 +1,147 @@
+"""
+Opt-in profiling of the phases of each under_test: loading its resources, computing its scores and exporting them.
+
+In cpu mode, each phase runs under cProfile. In mem mode, it runs under tracemalloc, recording its peak memory
+and a snapshot of its allocations. The files of each under_test are saved under save_dir/.profile and
+aggregated into a summary of the whole run.
+"""
+import contextlib
+import cProfile
+import io
+import logging
+import pstats
+import shutil
+import tracemalloc
+from pathlib import Path
+
+from eval.consts import PROFILE_DIR
+from eval.utils import format_size
+
+logger = logging.getLogger(__name__)
+
+CPU = 'cpu'
+MEM = 'mem'
+PROFILE_MODES = (CPU, MEM)
+
+PHASES = ('load', 'compute', 'export')
+SUMMARY = 'summary.txt'
+PEAK_MEMORY_TABLE = 'peak_memory.tsv'
+# number of hot functions or allocation sites in the summary.
+TOP_N = 30
+
+
+class Profiler:
+
+    def __init__(self, save_dir, mode):
+        if mode not in PROFILE_MODES:
+            raise ValueError('unknown profile mode: {}'.format(mode))
+        self.mode = mode
+        self.profile_dir = Path(save_dir).joinpath(PROFILE_DIR)
+
+    def reset(self):
+        """
+        Remove the files of a previous run.
+        """
+        if self.profile_dir.exists():
+            shutil.rmtree(str(self.profile_dir))
+        self.profile_dir.mkdir(parents=True)
+
+    def get_path(self, under_test, phase, suffix):
+        return self.profile_dir.joinpath('{}.{}{}'.format(under_test.prefix, phase, suffix))
+
+    @contextlib.contextmanager
+    def phase(self, under_test, phase):
+        """
+        Profile the body of the with statement as a phase of under_test.
+        """
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        if self.mode == CPU:
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+                profile.dump_stats(str(self.get_path(under_test, phase, '.prof')))
+            return
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        start, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        try:
+            yield
+        finally:
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.take_snapshot().dump(str(self.get_path(under_test, phase, '.snapshot')))
+            with self.profile_dir.joinpath(PEAK_MEMORY_TABLE).open('a') as f:
+                # the peak above what was allocated before the phase, and what the phase left allocated.
+                f.write('{}\t{}\t{}\t{}\n'.format(under_test.prefix, phase, peak - start, current - start))
+
+    def summarize(self):
+        """
+        Aggregate the profiles of all the under_tests and write the summary.
+
+        :return: the summary as str.
+        """
+        if self.mode == CPU:
+            summary = self.summarize_cpu()
+        else:
+            summary = self.summarize_mem()
+        self.profile_dir.joinpath(SUMMARY).write_text(summary)
+        logger.info('profile summary saved to {}'.format(self.profile_dir.joinpath(SUMMARY)))
+        return summary
+
+    def summarize_cpu(self):
+        lines = []
+        for phase in PHASES:
+            files = sorted(self.profile_dir.glob('*.{}.prof'.format(phase)))
+            if not files:
+                continue
+            out = io.StringIO()
+            stats = pstats.Stats(*map(str, files), stream=out)
+            # otherwise every file is listed before the stats.
+            stats.files = []
+            lines.append('=== {}: {} under_tests, {:.2f}s ==='.format(phase, len(files), stats.total_tt))
+            stats.sort_stats('tottime').print_stats(TOP_N)
+            lines.append(out.getvalue())
+        return '\n'.join(lines)
+
+    def summarize_mem(self):
+        table = self.profile_dir.joinpath(PEAK_MEMORY_TABLE)
+        rows = []
+        if table.exists():
+            for line in table.read_text().splitlines():
+                prefix, phase, peak, current = line.split('\t')
+                rows.append((prefix, phase, int(peak), int(current)))
+        lines = ['=== peak memory by under_test and phase ===']
+        row = '{:<60} {:<8} {:>10} {:>10}'
+        lines.append(row.format('under_test', 'phase', 'peak', 'retained'))
+        for prefix, phase, peak, current in sorted(rows, key=lambda r: r[2], reverse=True):
+            lines.append(row.format(prefix, phase, format_size(peak), format_size(current)))
+
+        for phase in PHASES:
+            files = sorted(self.profile_dir.glob('*.{}.snapshot'.format(phase)))
+            if not files:
+                continue
+            # the allocation sites live at the end of each phase, summed over all under_tests.
+            sizes = {}
+            for file in files:
+                for stat in tracemalloc.Snapshot.load(str(file)).statistics('lineno'):
+                    frame = stat.traceback[0]
+                    key = '{}:{}'.format(frame.filename, frame.lineno)
+                    sizes[key] = sizes.get(key, 0) + stat.size
+            lines.append('')
+            lines.append('=== {}: top allocation sites over {} under_tests ==='.format(phase, len(files)))
+            for key, size in sorted(sizes.items(), key=lambda item: item[1], reverse=True)[:TOP_N]:
+                lines.append('{:>10}  {}'.format(format_size(size), key))
+        return '\n'.join(lines) + '\n'
+
+
+def profile_phase(profiler, under_test, phase):
+    """
+    Profile a phase if profiler is not None.
+    """
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.phase(under_test, phase)
@@ -0,0 +1,131 @@
+"""
+Approximate evaluation: score the examples of a corpus in a random order and stop as soon as
+the confidence interval of the mean utterance score is narrow enough.
+
+Only a system score that is the mean of the utterance scores is bounded by that interval. The corpus-level
+scores, such as those of BLEU, ROUGE or distinct-n, are computed exactly instead.
+"""
+import logging
+import math
+import numbers
+import statistics
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIDENCE = 0.95
+# the confidence interval is checked after each batch of this many examples.
+DEFAULT_BATCH_SIZE = 100
+# too few examples may have a deceptively small variance.
+DEFAULT_MIN_EXAMPLES = 200
+DEFAULT_SEED = 0
+
+
+class RunningMean:
+    """
+    The mean and variance of a stream of numbers, by Welford's algorithm.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    @property
+    def variance(self):
+        if self.count < 2:
+            return math.inf
+        return self.m2 / (self.count - 1)
+
+    def half_width(self, confidence=DEFAULT_CONFIDENCE):
+        """
+        The half width of the confidence interval of the mean, by the normal approximation.
+        """
+        z = statistics.NormalDist().inv_cdf((1 + confidence) / 2)
+        return z * math.sqrt(self.variance / max(self.count, 1))
+
+
+def get_utterance_value(metric, score):
+    # the field the exporter would extract, as a number.
+    if isinstance(metric.utterance_field, str):
+        score = getattr(score, metric.utterance_field)
+    if not isinstance(score, numbers.Number):
+        raise TypeError('utterance score of {} is not a number'.format(metric.fullname))
+    return float(score)
+
+
+def take(corpus, indices):
+    """
+    The items of corpus at indices, as a corpus of the same kind if it can select them, e.g. a TokenIdCorpus.
+    """
+    if hasattr(corpus, 'take'):
+        return corpus.take(indices)
+    return [corpus[i] for i in indices]
+
+
+def can_progress(under_test):
+    """
+    Tell if under_test can be scored on a subset of its examples.
+    """
+    metric = under_test.metric
+    if not metric.mean_system:
+        return False
+    return bool(metric.shard_keys) and (metric.utterance_field is None or isinstance(metric.utterance_field, str))
+
+
+def compute_progressive(under_test, payload, tolerance, confidence=DEFAULT_CONFIDENCE,
+                        batch_size=DEFAULT_BATCH_SIZE, min_examples=DEFAULT_MIN_EXAMPLES, seed=DEFAULT_SEED):
+    """
+    Score random examples of under_test until the confidence interval of the mean utterance score
+    has a half width below tolerance, or all examples are scored.
+
+    :param under_test:
+    :param payload: the resources of under_test.
+    :param tolerance: the largest acceptable half width.
+    :param confidence:
+    :param batch_size:
+    :param min_examples:
+    :param seed: the seed of the random order, so that runs are reproducible.
+    :return: (result, approximation). result is over the scored examples, in their original order.
+        approximation describes the subset and the confidence interval.
+    """
+    metric = under_test.metric
+    num_examples = len(payload[metric.shard_keys[0]])
+    order = np.random.RandomState(seed).permutation(num_examples)
+    running = RunningMean()
+    scores = {}
+    for start in range(0, num_examples, batch_size):
+        indices = order[start:start + batch_size].tolist()
+        batch = dict(payload)
+        for key in metric.shard_keys:
+            batch[key] = take(payload[key], indices)
+        for index, score in zip(indices, metric.score_utterance(**batch)):
+            scores[index] = score
+            running.add(get_utterance_value(metric, score))
+        half_width = running.half_width(confidence)
+        if running.count >= min_examples and half_width < tolerance:
+            break
+    logger.info('scored {}/{} examples of {!r}, mean {:.4f} +/- {:.4f}'.format(
+        running.count, num_examples, under_test, running.mean, running.half_width(confidence)))
+
+    indices = sorted(scores)
+    subset = dict(payload)
+    for key in metric.shard_keys:
+        subset[key] = take(payload[key], indices)
+    utterance = [scores[i] for i in indices]
+    approximation = dict(
+        num_examples=len(indices),
+        total_examples=num_examples,
+        ci_half_width=running.half_width(confidence),
+        confidence=confidence,
+        seed=seed,
+        indices=indices,
+    )
+    return (utterance, metric.score_system(utterance, **subset)), approximation
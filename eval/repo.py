@@ -64,6 +64,10 @@ all_metrics = {
         'n': [1, 2, 3, 4],
         'smoothing': True,
     },
+    'self_bleu': {
+        'n': [2, 3, 4],
+        'smoothing': True,
+    },
     'rouge': {
         'alpha': 0.9,
         'weight': 1.2,
@@ -77,6 +81,9 @@ all_metrics = {
     'distinct_n': {
         'n': [1, 2]
     },
+    'entropy_n': {
+        'n': [1, 2]
+    },
     'embedding_based': {
         'variants': [
             'vector_average',
@@ -0,0 +1,122 @@
+"""
+ROUGE-N on the clipped n-gram matches of eval.bleu, and ROUGE-L and ROUGE-W on the LCS kernels of eval.lcs.
+
+Each sentence score carries the sufficient statistics of its pair, i.e. the n-gram overlap or the (weighted) LCS,
+and the lengths of the hypothesis and the reference, so that the corpus score is aggregated from the sentence scores
+without looking at the text again.
+
+The sentence scores are those of the rouge package, including its ROUGE-W, which aligns a pair by the WLCS
+of the default weight, rewards the runs of matches that are consecutive in the reference, and normalizes
+the recall by f(f(length)).
+
+The corpus score of ROUGE-N is that of the summed overlaps. The corpus scores of ROUGE-L and ROUGE-W are
+pooled scores, not the summary-level ROUGE of Lin (2004): the LCS of each hypothesis is only taken with its own
+reference, not with the union of the LCS of all the hypotheses, which would be quadratic in the size of
+the corpus, and the precision and recall are those of the summed statistics. They replace the means of
+the sentence scores that the system scores of ROUGE-L and ROUGE-W used to be.
+"""
+import collections
+
+from eval import bleu
+from eval.lcs import get_runs, get_weight_fn, lcs_length, wlcs_matches
+
+# the weight of ROUGE-1.5.5, where the F-measure is the harmonic mean of precision and recall.
+DEFAULT_ALPHA = 0.5
+DEFAULT_WEIGHT = 1.2
+
+# the n-gram overlap of a pair and the numbers of n-grams of its hypothesis and reference.
+OverlapStats = collections.namedtuple('OverlapStats', 'overlap hyp_count ref_count')
+# hyp_len and ref_len are f(len) and f(f(len)) for ROUGE-W.
+LcsStats = collections.namedtuple('LcsStats', 'lcs hyp_len ref_len')
+Score = collections.namedtuple('Score', 'precision recall f1_measure stats')
+
+
+def f_measure(precision, recall, alpha=DEFAULT_ALPHA):
+    """
+    F = 1 / (alpha / P + (1 - alpha) / R), as in ROUGE-1.5.5.
+    """
+    if alpha is None:
+        alpha = DEFAULT_ALPHA
+    if not precision or not recall:
+        return 0.0
+    return precision * recall / ((1 - alpha) * precision + alpha * recall)
+
+
+def sum_stats(stats, stats_type=LcsStats):
+    return stats_type(*map(sum, zip(*stats))) if stats else stats_type(0, 0, 0)
+
+
+def get_overlap_stats(pair_stats: bleu.PairStats, n):
+    """
+    Get the ROUGE-N stats of a pair from its BLEU stats. With a single reference, the clipped matches of BLEU
+    are the overlap of ROUGE-N and the closest reference length is the length of the reference.
+    """
+    return OverlapStats(pair_stats.numerators[n - 1], max(0, pair_stats.hyp_len - n + 1),
+                        max(0, pair_stats.ref_len - n + 1))
+
+
+def rouge_n_score(stats: OverlapStats, alpha=DEFAULT_ALPHA):
+    precision = stats.overlap / stats.hyp_count if stats.hyp_count else 0.0
+    recall = stats.overlap / stats.ref_count if stats.ref_count else 0.0
+    return Score(precision, recall, f_measure(precision, recall, alpha), stats)
+
+
+def rouge_n_sentence_level(summary, reference, n, alpha=DEFAULT_ALPHA):
+    pair_stats = bleu.get_pair_stats([reference], summary, n)
+    return rouge_n_score(get_overlap_stats(pair_stats, n), alpha)
+
+
+def rouge_n_corpus_level(utterance, alpha=DEFAULT_ALPHA):
+    """
+    :param utterance: the sentence scores of rouge_n_sentence_level() or rouge_n_score().
+    """
+    return rouge_n_score(sum_stats([score.stats for score in utterance], OverlapStats), alpha)
+
+
+def rouge_l_stats(summary, reference):
+    return LcsStats(lcs_length(summary, reference), len(summary), len(reference))
+
+
+def rouge_l_score(stats: LcsStats, alpha=DEFAULT_ALPHA):
+    precision = stats.lcs / stats.hyp_len if stats.hyp_len else 0.0
+    recall = stats.lcs / stats.ref_len if stats.ref_len else 0.0
+    return Score(precision, recall, f_measure(precision, recall, alpha), stats)
+
+
+def rouge_l_sentence_level(summary, reference, alpha=DEFAULT_ALPHA):
+    return rouge_l_score(rouge_l_stats(summary, reference), alpha)
+
+
+def rouge_l_pooled_level(utterance, alpha=DEFAULT_ALPHA):
+    """
+    :param utterance: the sentence scores of rouge_l_sentence_level().
+    """
+    return rouge_l_score(sum_stats([score.stats for score in utterance]), alpha)
+
+
+def rouge_w_stats(summary, reference, weight=DEFAULT_WEIGHT):
+    f = get_weight_fn(weight)
+    # as the rouge package, the pair is aligned with the default weight whatever the weight.
+    matches = wlcs_matches(summary, reference, DEFAULT_WEIGHT)
+    wlcs = sum(f(run) for run in get_runs(matches))
+    return LcsStats(wlcs, f(len(summary)), f(f(len(reference))))
+
+
+def rouge_w_score(stats: LcsStats, alpha=DEFAULT_ALPHA, weight=DEFAULT_WEIGHT):
+    # f^-1(WLCS / f(length)) with f(k) = k ** weight, where the f(length) of the reference is f(f(length)).
+    inverse = 1 / weight
+    precision = (stats.lcs / stats.hyp_len) ** inverse if stats.hyp_len else 0.0
+    recall = (stats.lcs / stats.ref_len) ** inverse if stats.ref_len else 0.0
+    return Score(precision, recall, f_measure(precision, recall, alpha), stats)
+
+
+def rouge_w_sentence_level(summary, reference, alpha=DEFAULT_ALPHA, weight=DEFAULT_WEIGHT):
+    if weight is None:
+        weight = DEFAULT_WEIGHT
+    return rouge_w_score(rouge_w_stats(summary, reference, weight), alpha, weight)
+
+
+def rouge_w_pooled_level(utterance, alpha=DEFAULT_ALPHA, weight=DEFAULT_WEIGHT):
+    if weight is None:
+        weight = DEFAULT_WEIGHT
+    return rouge_w_score(sum_stats([score.stats for score in utterance]), alpha, weight)
@@ -0,0 +1,107 @@
+"""
+The ROUGE scores of other alphas and weights, computed from the sufficient stats that the ROUGE metrics save
+under STATS_DIR next to their scores, without reading or scoring the text again.
+
+The overlaps of ROUGE-N and the LCS of ROUGE-L do not depend on alpha or weight, so any of them can be swept.
+The WLCS of ROUGE-W is found with its weight, so the stats of ROUGE-W only sweep alpha at that weight.
+"""
+import json
+import logging
+from pathlib import Path
+
+import numpy as np
+
+from eval import rouge_engine
+from eval.consts import STATS_DIR
+
+logger = logging.getLogger(__name__)
+
+
+def load_stats(path):
+    """
+    Load a stats file of the Exporter.
+
+    :return: the meta, i.e. metric, fields and params, and the stats of every utterance as namedtuples.
+    """
+    with np.load(str(path)) as npz:
+        meta = json.loads(str(npz['meta']))
+        rows = npz['stats'].tolist()
+    stats_type = rouge_engine.OverlapStats if get_variant(meta) == 'rouge_n' else rouge_engine.LcsStats
+    if meta['fields'] and list(stats_type._fields) != meta['fields']:
+        raise ValueError('{} has stats {}, not those of ROUGE'.format(path, meta['fields']))
+    return meta, [stats_type(*row) for row in rows]
+
+
+def get_variant(meta):
+    return meta['params']['variant']
+
+
+def get_weight(meta):
+    weight = meta['params']['params'].get('weight')
+    return rouge_engine.DEFAULT_WEIGHT if weight is None else weight
+
+
+def get_score_fn(meta, weight=None):
+    """
+    :return: a function from stats and alpha to the Score of a variant.
+    """
+    variant = get_variant(meta)
+    if variant == 'rouge_n':
+        return rouge_engine.rouge_n_score
+    if variant == 'rouge_l':
+        return rouge_engine.rouge_l_score
+    if variant == 'rouge_w':
+        if weight is not None and weight != get_weight(meta):
+            raise ValueError('the WLCS of {} was computed with weight {}, rerun it with weight {}'.format(
+                meta['metric'], get_weight(meta), weight))
+        weight = get_weight(meta)
+        return lambda stats, alpha: rouge_engine.rouge_w_score(stats, alpha, weight)
+    raise ValueError('unknown variant: {}'.format(variant))
+
+
+def sweep_stats(meta, stats, alphas, weights=(None,)):
+    """
+    Compute the scores of every combination of alphas and weights.
+
+    :param meta:
+    :param stats: the stats of every utterance.
+    :param alphas:
+    :param weights: the weights of ROUGE-W, None for the one of the stats. Ignored by ROUGE-N and ROUGE-L.
+    :return: a list of dicts of alpha, weight, the utterance F-measures and the system score.
+    """
+    if get_variant(meta) == 'rouge_w':
+        weights = [get_weight(meta) if weight is None else weight for weight in weights]
+    else:
+        weights = (None,)
+    total = rouge_engine.sum_stats(stats, type(stats[0]) if stats else rouge_engine.LcsStats)
+    results = []
+    for weight in weights:
+        score_fn = get_score_fn(meta, weight)
+        for alpha in alphas:
+            results.append(dict(
+                alpha=alpha,
+                weight=weight,
+                utterance=[score_fn(s, alpha).f1_measure for s in stats],
+                system=score_fn(total, alpha),
+            ))
+    return results
+
+
+def get_stats_path(save_dir, prefix):
+    return Path(save_dir).joinpath(STATS_DIR, prefix).with_suffix('.npz')
+
+
+def sweep(save_dir, prefix, alphas, weights=(None,)):
+    """
+    Sweep the ROUGE scores of an under_test from its saved stats.
+
+    :param save_dir: the output dir of the engine.
+    :param prefix: the prefix of the under_test, e.g. hred-ubuntu-rouge_l.
+    :return: see sweep_stats().
+    """
+    path = get_stats_path(save_dir, prefix)
+    if not path.exists():
+        raise FileNotFoundError('no stats for {} in {}, run the engine on it first'.format(prefix, save_dir))
+    meta, stats = load_stats(path)
+    logger.info('sweeping {} utterances of {}'.format(len(stats), prefix))
+    return sweep_stats(meta, stats, alphas, weights)
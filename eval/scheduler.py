@@ -0,0 +1,108 @@
+import logging
+import time
+from pathlib import Path
+
+from eval.utils import count_lines, format_seconds, format_size
+
+logger = logging.getLogger(__name__)
+
+HISTORY = 'history'
+CORPUS_SIZE = 'corpus size'
+
+
+class CostModel:
+    """
+    Estimate the run time and memory of under_tests from the runtimes of past runs,
+    or from the size of their corpora when they never ran.
+    """
+
+    def __init__(self, history, loader):
+        self.history = history
+        self.loader = loader
+        # filename => number of lines
+        self.line_counts = {}
+
+    def get_num_examples(self, under_test):
+        """
+        Estimate the number of examples of under_test by the lines of its responses.
+        """
+        responses = getattr(under_test.model, 'responses', None)
+        if responses is None or not Path(responses).is_file():
+            return None
+        if responses not in self.line_counts:
+            self.line_counts[responses] = count_lines(responses)
+        return self.line_counts[responses]
+
+    def estimate_seconds(self, under_test):
+        """
+        :return: (seconds, estimated_from), seconds is None if it cannot be estimated.
+        """
+        num_examples = self.get_num_examples(under_test)
+        if num_examples is None:
+            return None, None
+        seconds_per_example = self.history.get_seconds_per_example(under_test)
+        if seconds_per_example is not None:
+            return seconds_per_example * num_examples, HISTORY
+        return under_test.metric.cost_per_example * num_examples, CORPUS_SIZE
+
+    def estimate_memory(self, under_test):
+        memory = self.history.get_peak_memory(under_test)
+        if memory is not None:
+            return memory
+        return sum(self.loader.estimate_size(key) for key in self.loader.get_resource_keys(under_test))
+
+
+class Scheduler:
+    """
+    Decide which under_test to start next in a parallel run: the longest first, among those fitting
+    in what is left of the memory budget. Also keeps track of the ETA of the run.
+    """
+
+    def __init__(self, cost_model: CostModel, under_tests, jobs, max_memory=None):
+        self.jobs = jobs
+        self.max_memory = max_memory
+        self.seconds = {}
+        self.memory = {}
+        for under_test in under_tests:
+            seconds, _ = cost_model.estimate_seconds(under_test)
+            self.seconds[under_test] = seconds or 0.0
+            self.memory[under_test] = cost_model.estimate_memory(under_test)
+        self.pending = sorted(under_tests, key=self.seconds.get, reverse=True)
+        # under_test => start time
+        self.running = {}
+        self.num_done = 0
+
+    @property
+    def running_memory(self):
+        return sum(self.memory[under_test] for under_test in self.running)
+
+    def next(self):
+        """
+        Pop the next under_test to start, or None if none should start now.
+        """
+        if not self.pending or len(self.running) >= self.jobs:
+            return None
+        for index, under_test in enumerate(self.pending):
+            fits = self.max_memory is None or self.running_memory + self.memory[under_test] <= self.max_memory
+            # an under_test too large for the budget still runs, alone.
+            if fits or not self.running:
+                self.running[under_test] = time.perf_counter()
+                return self.pending.pop(index)
+        return None
+
+    def done(self, under_test):
+        del self.running[under_test]
+        self.num_done += 1
+
+    def eta(self):
+        now = time.perf_counter()
+        remaining = sum(self.seconds[under_test] for under_test in self.pending)
+        remaining += sum(max(self.seconds[under_test] - (now - start), 0.0)
+                         for under_test, start in self.running.items())
+        return remaining / self.jobs
+
+    def log_progress(self):
+        total = self.num_done + len(self.running) + len(self.pending)
+        logger.info('progress: {}/{} done, {} running ({}), ETA {}'.format(
+            self.num_done, total, len(self.running), format_size(self.running_memory),
+            format_seconds(self.eta())))
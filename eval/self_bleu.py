@@ -0,0 +1,186 @@
+"""
+Self-BLEU (Zhu et al., 2018): the BLEU of every response with all the other responses of the corpus
+as its references, which is high when a model keeps giving the same responses.
+
+Scoring every response against the N - 1 others is quadratic. Instead, the n-grams of the corpus are counted
+once, and every n-gram keeps its largest count with the response it comes from, and its second largest count.
+The clipping count of an n-gram for a response, i.e. its largest count among the other responses, is the
+largest count unless the response is the one it comes from, and then the second largest. The closest
+reference length is found likewise among the sorted lengths. So the pair stats of every response come from
+a few sorts of the n-grams of the corpus, and are the same as those of nltk's sentence_bleu(others, response),
+up to the collisions of 64-bit hashes.
+
+In the sampled mode, only random responses are looked up and scored, each still against all the others,
+until the confidence interval of their mean is narrow enough.
+"""
+import logging
+
+import numpy as np
+
+from eval import bleu
+from eval.ngram_index import count_ngrams
+from eval.progressive import (RunningMean, DEFAULT_BATCH_SIZE, DEFAULT_CONFIDENCE, DEFAULT_MIN_EXAMPLES,
+                              DEFAULT_SEED)
+
+logger = logging.getLogger(__name__)
+
+
+def get_closest_lengths(lengths):
+    """
+    :return: for each sentence, the length of the other sentences closest to its own, the shorter on a tie,
+        as nltk's closest_ref_length. A sentence with no others gets its own length.
+    """
+    values, frequencies = np.unique(lengths, return_counts=True)
+    positions = np.searchsorted(values, lengths)
+    closest = lengths.copy()
+    # a length that only this sentence has is not among its references.
+    alone = frequencies[positions] == 1
+    below = np.where(positions > 0, values[np.maximum(positions - 1, 0)], -1)
+    above = np.where(positions + 1 < len(values), values[np.minimum(positions + 1, len(values) - 1)], -1)
+    has_below = positions > 0
+    has_above = positions + 1 < len(values)
+    use_below = has_below & (~has_above | (lengths - below <= above - lengths))
+    use_above = has_above & ~use_below
+    closest[alone & use_below] = below[alone & use_below]
+    closest[alone & use_above] = above[alone & use_above]
+    return closest
+
+
+def get_ranges(starts, ends):
+    """
+    :return: the concatenation of range(start, end) for every start and end.
+    """
+    sizes = ends - starts
+    if not sizes.sum():
+        return np.zeros(0, dtype=np.int64)
+    shifts = starts - np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    return np.arange(sizes.sum(), dtype=np.int64) + np.repeat(shifts, sizes)
+
+
+class SelfBleuIndex:
+    """
+    The n-grams of a corpus, for every sentence, and for every distinct n-gram of every order its largest count,
+    the sentence of that count and its second largest count, from which the pair stats of any sentence
+    against all the others are looked up.
+    """
+
+    def __init__(self, token_lists, max_order=bleu.MAX_ORDER):
+        groups, hashes, counts, lengths = count_ngrams(token_lists, max_order)
+        self.max_order = max_order
+        # the n-grams of each sentence, by group as those of count_ngrams().
+        self.groups = groups
+        self.hashes = hashes
+        self.counts = counts.astype(np.int64)
+        self.lengths = lengths.astype(np.int64)
+        self.offsets = np.searchsorted(groups, np.arange(len(lengths) * max_order + 1))
+        self.closest_lengths = get_closest_lengths(self.lengths)
+
+        # the distinct n-grams, by order, hash and count descending.
+        sentences, orders = np.divmod(groups, max_order)
+        order = np.lexsort((-self.counts, hashes, orders))
+        sorted_orders, sorted_hashes = orders[order], hashes[order]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = (sorted_orders[1:] != sorted_orders[:-1]) | (sorted_hashes[1:] != sorted_hashes[:-1])
+        starts = np.flatnonzero(first)
+        self.ngram_hashes = sorted_hashes[starts]
+        # the distinct n-grams of each order are sorted by hash between these offsets.
+        self.order_offsets = np.searchsorted(sorted_orders[starts], np.arange(max_order + 1))
+        self.largest = self.counts[order[starts]]
+        self.largest_sentence = sentences[order[starts]]
+        # an n-gram of a single sentence has no second count.
+        sizes = np.diff(np.append(starts, len(order)))
+        self.second = np.zeros(len(starts), dtype=np.int64)
+        self.second[sizes > 1] = self.counts[order[starts[sizes > 1] + 1]]
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def get_pair_stats(self, indices):
+        """
+        Compute the PairStats of the given sentences against all the others.
+        """
+        max_order = self.max_order
+        indices = np.asarray(indices, dtype=np.int64)
+        starts = self.offsets[indices * max_order]
+        ends = self.offsets[(indices + 1) * max_order]
+        entries = get_ranges(starts, ends)
+        # the position in indices of the sentence of each entry.
+        owners = np.repeat(np.arange(len(indices)), ends - starts)
+        orders = self.groups[entries] % max_order
+        hashes = self.hashes[entries]
+        ngrams = np.empty(len(entries), dtype=np.int64)
+        for order in range(max_order):
+            selected = orders == order
+            start, stop = self.order_offsets[order], self.order_offsets[order + 1]
+            ngrams[selected] = start + np.searchsorted(self.ngram_hashes[start:stop], hashes[selected])
+        # the largest count among the other sentences.
+        clipping = np.where(indices[owners] == self.largest_sentence[ngrams], self.second[ngrams],
+                            self.largest[ngrams])
+        matches = np.minimum(self.counts[entries], clipping)
+        numerators = np.bincount(owners * max_order + orders, weights=matches, minlength=len(indices) * max_order)
+        numerators = numerators.astype(np.int64).reshape(len(indices), max_order).tolist()
+        stats = []
+        for numerator, hyp_len, ref_len in zip(numerators, self.lengths[indices].tolist(),
+                                               self.closest_lengths[indices].tolist()):
+            denominators = tuple(max(1, hyp_len - n + 1) for n in range(1, max_order + 1))
+            stats.append(bleu.PairStats(tuple(numerator), denominators, hyp_len, ref_len))
+        return stats
+
+
+def get_self_pair_stats(token_lists, max_order=bleu.MAX_ORDER):
+    """
+    Compute the PairStats of every sentence against all the others.
+    """
+    index = SelfBleuIndex(token_lists, max_order)
+    return index.get_pair_stats(np.arange(len(index)))
+
+
+class SelfBleuIndexCache(bleu.BleuStatsCache):
+    """
+    The SelfBleuIndex of the last few corpora, shared by every order and smoothing method.
+    """
+
+    def get_index(self, responses, max_order=bleu.MAX_ORDER):
+        return self.get(None, responses, max_order)
+
+    def compute(self, references, hypotheses, max_order):
+        return SelfBleuIndex(hypotheses, max_order)
+
+
+index_cache = SelfBleuIndexCache()
+
+
+def sample_scores(index: SelfBleuIndex, score_fn, tolerance, confidence=DEFAULT_CONFIDENCE,
+                  batch_size=DEFAULT_BATCH_SIZE, min_examples=DEFAULT_MIN_EXAMPLES, seed=DEFAULT_SEED):
+    """
+    Score random sentences until the confidence interval of their mean, the Self-BLEU of the corpus,
+    has a half width below tolerance. Only the sampled sentences are looked up, each against all the others.
+
+    :param index: the SelfBleuIndex of the corpus.
+    :param score_fn: a function from PairStats to a sentence score.
+    :return: (utterance, approximation) as compute_progressive(), the scores of the sampled sentences
+        in their original order and a description of the sample and its confidence interval.
+    """
+    num_sentences = len(index)
+    order = np.random.RandomState(seed).permutation(num_sentences)
+    running = RunningMean()
+    scores = {}
+    for start in range(0, num_sentences, batch_size):
+        indices = order[start:start + batch_size]
+        for i, stats in zip(indices.tolist(), index.get_pair_stats(indices)):
+            scores[i] = score_fn(stats)
+            running.add(scores[i])
+        if running.count >= min_examples and running.half_width(confidence) < tolerance:
+            break
+    logger.info('sampled {}/{} sentences, self-bleu {:.4f} +/- {:.4f}'.format(
+        running.count, num_sentences, running.mean, running.half_width(confidence)))
+    indices = sorted(scores)
+    approximation = dict(
+        num_examples=len(indices),
+        total_examples=num_sentences,
+        ci_half_width=running.half_width(confidence),
+        confidence=confidence,
+        seed=seed,
+        indices=indices,
+    )
+    return [scores[i] for i in indices], approximation
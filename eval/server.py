@@ -0,0 +1,337 @@
+"""
+A long-lived scoring server keeping the embeddings, tokenized references and other shared resources loaded.
+
+The server speaks JSON over HTTP on a Unix socket (or a local TCP port):
+    GET  /metrics   the fullnames of the metrics it serves.
+    POST /score     {"metric", "responses", "references"[, "contexts"]} scores a batch of
+                    sentences (str or lists of tokens).
+    POST /evaluate  {"metric", "params", "version", "model", "dataset"} evaluates an under_test, given
+                    the attributes of its model and dataset, and returns {"result", "stats"}: what Exporter
+                    would write for it and the rows and meta of its stats, if any.
+
+A request may carry the params and code version of its metric, as the manifest describes them. The server
+refuses with 409 a request whose metric differs from its own, so that a client never gets scores computed
+with other params.
+
+The server only reads the files of the models and datasets it was configured with, and refuses with 403
+an under_test of any other. It does not serve the metrics running external tools in a subprocess.
+"""
+import http.client
+import http.server
+import json
+import logging
+import os
+import socket
+import socketserver
+import time
+from pathlib import Path
+
+from eval.consts import CONTEXTS, RESPONSES, REFERENCES, REFERENCE_NGRAMS
+from eval.engine import Evaluator
+from eval.exporter import Exporter, MemoryExporter
+from eval.loader import ResourceLoader
+from eval.manifest import get_metric_params, get_code_version
+from eval.metrics import SubprocessMetric
+from eval.models import Model
+from eval.ngram_index import NgramIndex
+from eval.utils import Dataset, UnderTest
+
+logger = logging.getLogger(__name__)
+
+# the keys of a /score request that carry sentences.
+SENTENCE_KEYS = (CONTEXTS, RESPONSES, REFERENCES)
+
+
+class MetricMismatchError(Exception):
+    """
+    The metric of a request differs from that of the server in its params or code version.
+    """
+
+
+class ForbiddenError(Exception):
+    """
+    A request names a model or dataset that the server was not configured with.
+    """
+
+
+def get_metric_signature(metric):
+    # as it is sent in json.
+    return json.loads(json.dumps(dict(params=get_metric_params(metric), version=get_code_version(metric))))
+
+
+def get_attrs_signature(attrs):
+    # the attributes of a model or dataset, as they are sent in json.
+    return json.dumps(attrs, sort_keys=True, default=Exporter.default)
+
+
+def split_sentences(sentences):
+    return [s.split() if isinstance(s, str) else s for s in sentences]
+
+
+class ScoringService:
+    """
+    What the server does for each request, with its resources kept warm by a single ResourceLoader.
+    """
+
+    def __init__(self, metrics, models=(), datasets=(), batch_size=None, max_memory=None):
+        self.metrics = {}
+        for metric in metrics:
+            if isinstance(metric, SubprocessMetric):
+                # its command would run with the paths of the requests.
+                logger.warning('not serving {}, which runs {}'.format(metric.fullname, metric.external_tool))
+                continue
+            self.metrics[metric.fullname] = metric
+        self.models = {get_attrs_signature(vars(model)): model for model in models}
+        self.datasets = {get_attrs_signature(vars(dataset)): dataset for dataset in datasets}
+        self.loader = ResourceLoader(max_memory)
+        self.exporter = MemoryExporter()
+        self.evaluator = Evaluator(self.exporter, self.loader, batch_size=batch_size)
+
+    def get_metric(self, request):
+        name = request['metric']
+        try:
+            metric = self.metrics[name]
+        except KeyError:
+            raise ValueError('unknown metric: {}'.format(name))
+        signature = get_metric_signature(metric)
+        for key in ('params', 'version'):
+            if key in request and request[key] != signature[key]:
+                raise MetricMismatchError('the {} of {} differ from those of the server: {} != {}'.format(
+                    key, name, request[key], signature[key]))
+        return metric
+
+    def get_configured(self, configured, attrs, kind):
+        try:
+            return configured[get_attrs_signature(attrs)]
+        except KeyError:
+            raise ForbiddenError('{} {} is not configured on the server'.format(kind, attrs.get('name')))
+
+    def score(self, request):
+        metric = self.get_metric(request)
+        requires = self.loader.get_normalized_requires(metric.requires)
+        # a placeholder under_test to resolve the resources other than the sentences, e.g. embeddings.
+        under_test = UnderTest(metric, Model('batch', 'batch', None), Dataset('batch', None, None))
+        payload = {}
+        for key in requires:
+            if key in SENTENCE_KEYS:
+                payload[key] = split_sentences(request[key])
+            elif key == REFERENCE_NGRAMS:
+                # too short-lived to be worth saving.
+                payload[key] = NgramIndex.build(split_sentences(request[REFERENCES]))
+            else:
+                payload[key] = self.loader.load_resource_for_key(key, under_test, requires)
+        return self.exporter.process_result(metric(**payload), under_test)
+
+    def evaluate(self, request):
+        metric = self.get_metric(request)
+        model = self.get_configured(self.models, request['model'], 'model')
+        dataset = self.get_configured(self.datasets, request['dataset'], 'dataset')
+        under_test = UnderTest(metric, model, dataset)
+        if self.evaluator(under_test) is None:
+            raise ValueError('resources of {!r} unavailable'.format(under_test))
+        result, stats = self.exporter.pop_result(under_test)
+        if stats is not None:
+            rows, meta = stats
+            stats = dict(rows=rows.tolist(), meta=meta)
+        return dict(result=result, stats=stats)
+
+
+class ScoringHandler(http.server.BaseHTTPRequestHandler):
+
+    def address_string(self):
+        # a Unix socket has no client address.
+        return str(self.client_address or 'local')
+
+    def send_json(self, code, data):
+        body = json.dumps(data, default=Exporter.default).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self.send_json(200, sorted(self.server.service.metrics))
+        else:
+            self.send_json(404, {'error': 'unknown path {}'.format(self.path)})
+
+    def do_POST(self):
+        handlers = {
+            '/score': self.server.service.score,
+            '/evaluate': self.server.service.evaluate,
+        }
+        if self.path not in handlers:
+            self.send_json(404, {'error': 'unknown path {}'.format(self.path)})
+            return
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        start = time.perf_counter()
+        try:
+            response = handlers[self.path](request)
+        except MetricMismatchError as e:
+            logger.warning('refused %s: %s', self.path, e)
+            self.send_json(409, {'error': str(e)})
+        except ForbiddenError as e:
+            logger.warning('refused %s: %s', self.path, e)
+            self.send_json(403, {'error': str(e)})
+        except Exception as e:
+            logger.exception('failed to handle %s', self.path)
+            self.send_json(400, {'error': str(e)})
+        else:
+            logger.info('%s %s in %.2fs', self.path, request.get('metric'), time.perf_counter() - start)
+            self.send_json(200, response)
+
+
+class UnixHTTPServer(socketserver.UnixStreamServer):
+    # like http.server.HTTPServer, but without the host name lookup a Unix socket does not have.
+
+    def server_bind(self):
+        socketserver.UnixStreamServer.server_bind(self)
+        self.server_name = str(self.server_address)
+        self.server_port = 0
+
+
+def make_server(service: ScoringService, socket_path=None, port=None):
+    if port is not None:
+        server = http.server.HTTPServer(('127.0.0.1', port), ScoringHandler)
+    else:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = UnixHTTPServer(socket_path, ScoringHandler)
+    server.service = service
+    return server
+
+
+def serve(service: ScoringService, socket_path=None, port=None):
+    server = make_server(service, socket_path, port)
+    logger.info('serving {} metrics on {}'.format(len(service.metrics), port or socket_path))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if port is None and os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, socket_path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.socket_path)
+
+
+class ScoringClient:
+
+    def __init__(self, socket_path=None, port=None):
+        self.socket_path = socket_path
+        self.port = port
+
+    def connect(self):
+        if self.port is not None:
+            return http.client.HTTPConnection('127.0.0.1', self.port)
+        return UnixHTTPConnection(self.socket_path)
+
+    def request(self, method, path, data=None):
+        connection = self.connect()
+        try:
+            body = json.dumps(data, default=Exporter.default) if data is not None else None
+            connection.request(method, path, body=body, headers={'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            result = json.loads(response.read())
+        finally:
+            connection.close()
+        if response.status == 409:
+            raise MetricMismatchError(result.get('error'))
+        if response.status == 403:
+            raise ForbiddenError(result.get('error'))
+        if response.status != 200:
+            raise RuntimeError(result.get('error'))
+        return result
+
+    def is_alive(self):
+        try:
+            self.metrics()
+        except (OSError, http.client.HTTPException):
+            return False
+        return True
+
+    def metrics(self):
+        return self.request('GET', '/metrics')
+
+    def score(self, metric, responses, references, contexts=None):
+        data = dict(metric=metric, responses=responses, references=references)
+        if contexts is not None:
+            data[CONTEXTS] = contexts
+        return self.request('POST', '/score', data)
+
+    def evaluate(self, under_test):
+        return self.request('POST', '/evaluate', dict(
+            metric=under_test.metric_name,
+            model=vars(under_test.model),
+            dataset=vars(under_test.dataset),
+            **get_metric_signature(under_test.metric)
+        ))
+
+
+class RemoteEvaluator:
+    """
+    An Evaluator dispatching the under_tests the server knows to it, and running the others locally.
+    The shards of an under_test are always run locally.
+    """
+
+    def __init__(self, client: ScoringClient, local: Evaluator):
+        self.client = client
+        self.local = local
+        self.exporter = local.exporter
+        self.loader = local.loader
+        self.remote_metrics = set(client.metrics())
+
+    def is_remote(self, under_test):
+        return under_test.metric_name in self.remote_metrics
+
+    def count_shards(self, under_test):
+        return self.local.count_shards(under_test)
+
+    def evaluate_shard(self, under_test, index):
+        return self.local.evaluate_shard(under_test, index)
+
+    def __call__(self, under_test):
+        if not self.is_remote(under_test):
+            return self.local(under_test)
+        logger.info('Dispatching under_test to the server: %r', under_test)
+        start = time.perf_counter()
+        try:
+            response = self.client.evaluate(under_test)
+        except (MetricMismatchError, ForbiddenError) as e:
+            logger.warning('running {!r} locally: {}'.format(under_test, e))
+            return self.local(under_test)
+        computed = time.perf_counter()
+        result, stats = response['result'], response['stats']
+        if stats is not None:
+            self.exporter.save_stats(stats['rows'], stats['meta'], under_test)
+        output_bytes = self.exporter.export_processed(result, under_test)
+        return dict(
+            load_seconds=0.0,
+            compute_seconds=computed - start,
+            export_seconds=time.perf_counter() - computed,
+            num_examples=len(result['utterance']),
+            peak_memory=None,
+            output_bytes=output_bytes,
+        )
+
+
+def get_client(socket_path=None, port=None):
+    """
+    Get a client of a running server, or None if there is no server.
+    """
+    if port is None and not Path(socket_path).exists():
+        return None
+    client = ScoringClient(socket_path, port)
+    if not client.is_alive():
+        logger.warning('scoring server at {} is not responding'.format(port or socket_path))
+        return None
+    return client
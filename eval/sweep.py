@@ -0,0 +1,88 @@
+"""
+Evaluate every checkpoint of a model in one engine run, for learning curves of the metrics.
+
+All the checkpoints are under_tests of the same run, so the resources of the dataset side (references,
+contexts, embeddings) are loaded once and shared by all of them.
+"""
+import json
+import logging
+
+from eval.models import find_serban_checkpoints
+
+logger = logging.getLogger(__name__)
+
+SWEEP_TABLE = 'sweep.tsv'
+
+
+def find_sweep_models(model_dirs, sample=True):
+    """
+    Find the checkpoints of the models in model_dirs, with their responses.
+
+    :param model_dirs: dirs of Serban models, i.e. model_root/dataset/model.
+    :param sample: whether to sample the responses of the checkpoints which have none.
+        If false, such checkpoints are left out.
+    :return: a list of SerbanModels, one per checkpoint.
+    """
+    models = []
+    for model_dir in model_dirs:
+        checkpoints = find_serban_checkpoints(model_dir)
+        logger.info('found {} checkpoints in {}'.format(len(checkpoints), model_dir))
+        for model in checkpoints:
+            if not model.responses.exists():
+                if not sample:
+                    logger.warning('no responses for checkpoint {}, skipping'.format(model.weights))
+                    continue
+                model.sample()
+            models.append(model)
+    return models
+
+
+def get_system_scores(engine, models):
+    """
+    Read the system scores of the under_tests on models from the output of engine.
+
+    :return: a dict from model to a dict from metric name to system score.
+    """
+    scores = {model: {} for model in models}
+    for under_test in engine.under_tests:
+        if under_test.model not in scores:
+            continue
+        output = engine.exporter.get_output_path(under_test)
+        if not output.exists():
+            continue
+        scores[under_test.model][under_test.metric_name] = json.loads(output.read_text())['system']
+    return scores
+
+
+def format_score(score):
+    if isinstance(score, float):
+        return '{:.4f}'.format(score)
+    if isinstance(score, dict):
+        return json.dumps(score, sort_keys=True)
+    return str(score)
+
+
+def format_sweep_table(scores):
+    """
+    Format the scores as a tab-separated table, with a row per checkpoint in training order
+    and a column per metric.
+    """
+    metrics = sorted({metric for row in scores.values() for metric in row})
+    lines = ['\t'.join(['model', 'dataset', 'checkpoint'] + metrics)]
+    for model, row in scores.items():
+        cells = [model.base_name, model.trained_on, model.checkpoint]
+        cells.extend(format_score(row[metric]) if metric in row else '-' for metric in metrics)
+        lines.append('\t'.join(cells))
+    return '\n'.join(lines)
+
+
+def sweep(engine, models):
+    """
+    Run engine, whose config has the checkpoint models, and write the table of their scores.
+
+    :return: the table as str.
+    """
+    engine.run()
+    table = format_sweep_table(get_system_scores(engine, models))
+    engine.exporter.save_dir.joinpath(SWEEP_TABLE).write_text(table + '\n')
+    return table
@@ -0,0 +1,151 @@
+"""
+Machine-readable telemetry of engine runs, as one JSONL file of events per run under save_dir/.telemetry.
+
+Every event has the fields "event", "run" (the id of the run) and "time". The events are:
+    run_start   the version and settings of the run.
+    skip        an under_test left alone, with the reason.
+    under_test  an under_test that finished, with its timings, throughput, cache hits and misses,
+                number of examples and output bytes.
+    failed      an under_test that failed, with the reason.
+    run_end     the wall time of the run and the count of each outcome.
+"""
+import collections
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from eval import __version__
+from eval.consts import TELEMETRY_DIR
+
+# the fields of the stats of an under_test kept in its event.
+STATS_FIELDS = ('load_seconds', 'compute_seconds', 'export_seconds', 'num_examples', 'cache_hits', 'cache_misses',
+                'output_bytes', 'peak_memory', 'approximate')
+# a metric is flagged as a regression when it is slower per example by this ratio.
+DEFAULT_THRESHOLD = 1.2
+
+
+class Telemetry:
+    """
+    The event log of the runs of an engine. Events are dropped until a run starts.
+    """
+
+    def __init__(self, save_dir):
+        self.telemetry_dir = Path(save_dir).joinpath(TELEMETRY_DIR)
+        self.run_id = None
+        self.path = None
+        self.started = None
+        self.counts = collections.Counter()
+        # record() may be called from several threads.
+        self.lock = threading.Lock()
+
+    def start_run(self, **settings):
+        # with the microseconds, so that the runs started within a second sort in order.
+        now = time.time()
+        self.run_id = '{}.{:06d}-{}'.format(time.strftime('%Y%m%d-%H%M%S', time.localtime(now)),
+                                           int(now % 1 * 1000000), os.getpid())
+        self.telemetry_dir.mkdir(parents=True, exist_ok=True)
+        self.path = self.telemetry_dir.joinpath(self.run_id + '.jsonl')
+        self.started = time.perf_counter()
+        self.emit('run_start', version=__version__, **settings)
+        self.counts.clear()
+
+    def end_run(self):
+        self.emit('run_end', seconds=time.perf_counter() - self.started, **self.counts)
+        self.run_id = None
+
+    def emit(self, event, **fields):
+        if self.run_id is None:
+            return
+        line = json.dumps(dict(event=event, run=self.run_id, time=time.time(), **fields), default=str)
+        with self.lock:
+            self.counts[event] += 1
+            with self.path.open('a') as f:
+                f.write(line + '\n')
+
+    def skip(self, under_test, reason):
+        self.emit('skip', under_test=under_test.prefix, reason=reason)
+
+    def failed(self, under_test, reason):
+        self.emit('failed', under_test=under_test.prefix, reason=reason)
+
+    def finished(self, under_test, stats):
+        fields = {key: stats[key] for key in STATS_FIELDS if key in stats}
+        compute_seconds = stats.get('compute_seconds')
+        if compute_seconds:
+            fields['examples_per_second'] = stats['num_examples'] / compute_seconds
+        self.emit('under_test', under_test=under_test.prefix, model=under_test.model_name,
+                  dataset=under_test.dataset_name, metric=under_test.metric_name, **fields)
+
+
+def load_events(path):
+    with Path(path).open() as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def find_runs(save_dir):
+    """
+    :return: the telemetry files of the runs in save_dir, the oldest first.
+    """
+    return sorted(Path(save_dir).joinpath(TELEMETRY_DIR).glob('*.jsonl'))
+
+
+def summarize_run(events):
+    """
+    Sum the timings and examples of the finished under_tests of a run by metric.
+
+    :return: a dict from metric name to a dict of totals.
+    """
+    metrics = collections.defaultdict(collections.Counter)
+    for event in events:
+        if event['event'] != 'under_test':
+            continue
+        totals = metrics[event['metric']]
+        totals['under_tests'] += 1
+        for key in ('load_seconds', 'compute_seconds', 'export_seconds', 'num_examples', 'cache_hits',
+                    'cache_misses', 'output_bytes'):
+            totals[key] += event.get(key) or 0
+    return metrics
+
+
+def get_wall_seconds(events):
+    for event in events:
+        if event['event'] == 'run_end':
+            return event['seconds']
+    return None
+
+
+def compare_runs(old_events, new_events, threshold=DEFAULT_THRESHOLD):
+    """
+    Compare the compute time per example of every metric between two runs.
+
+    :return: the comparison as str, with the regressions flagged.
+    """
+    old, new = summarize_run(old_events), summarize_run(new_events)
+    row = '{:<40} {:>12} {:>12} {:>8} {:>10} {:>10}  {}'
+    lines = [row.format('metric', 'old ms/ex', 'new ms/ex', 'ratio', 'old load', 'new load', '')]
+    regressions = 0
+    for metric in sorted(set(old) | set(new)):
+        if metric not in old or metric not in new:
+            only_in = 'only in the {} run'.format('old' if metric in old else 'new')
+            lines.append(row.format(metric, *(['-'] * 5), only_in))
+            continue
+        per_example = [
+            1000 * totals['compute_seconds'] / totals['num_examples'] if totals['num_examples'] else 0.0
+            for totals in (old[metric], new[metric])
+        ]
+        ratio = per_example[1] / per_example[0] if per_example[0] else float('inf')
+        flag = ''
+        if ratio > threshold:
+            flag = 'REGRESSION'
+            regressions += 1
+        lines.append(row.format(metric, '{:.3f}'.format(per_example[0]), '{:.3f}'.format(per_example[1]),
+                                '{:.2f}'.format(ratio), '{:.2f}s'.format(old[metric]['load_seconds']),
+                                '{:.2f}s'.format(new[metric]['load_seconds']), flag))
+    old_wall, new_wall = get_wall_seconds(old_events), get_wall_seconds(new_events)
+    lines.append('')
+    if old_wall is not None and new_wall is not None:
+        lines.append('wall time: {:.2f}s -> {:.2f}s'.format(old_wall, new_wall))
+    lines.append('{} regressions over {:.0%}'.format(regressions, threshold - 1))
+    return '\n'.join(lines)
@@ -1,6 +1,10 @@
 from typing import Sequence
 
+import contextlib
 import logging
+import os
+import tempfile
+import threading
 import numpy as np
 from pathlib import Path
 
@@ -8,6 +12,9 @@ from eval.consts import *
 
 logger = logging.getLogger(__name__)
 
+# how often MemorySampler reads the resident set size.
+MEMORY_SAMPLE_SECONDS = 0.05
+
 
 def ruber_data(train_dir, data_dir, embedding):
     data_dir = Path(data_dir)
@@ -102,6 +109,99 @@ def should_make(target: Path, sources: Sequence[Path]):
     )
 
 
+def count_lines(filename):
+    """
+    Count the lines of a text file without decoding it.
+    The last line is counted even if it does not end with a newline.
+    :param filename:
+    :return:
+    """
+    lines = 0
+    last = b'\n'
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            lines += chunk.count(b'\n')
+            last = chunk[-1:]
+    if last != b'\n':
+        lines += 1
+    return lines
+
+
+def get_rss():
+    """
+    Get the resident set size of this process in bytes.
+    :return:
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        import resource
+        # the peak rather than the current size, in KB on Linux.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class MemorySampler:
+    """
+    Sample the resident set size of this process in a background thread while in the block,
+    to get its peak above what it was when the block began, i.e. the memory of the block itself.
+    """
+
+    def __init__(self, interval=MEMORY_SAMPLE_SECONDS):
+        self.interval = interval
+        self.baseline = 0
+        self.peak_rss = 0
+        self.stop = threading.Event()
+        self.thread = None
+
+    def sample(self):
+        while not self.stop.wait(self.interval):
+            self.peak_rss = max(self.peak_rss, get_rss())
+
+    def __enter__(self):
+        self.baseline = self.peak_rss = get_rss()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop.set()
+        self.thread.join()
+        # a block shorter than the interval is not sampled otherwise.
+        self.peak_rss = max(self.peak_rss, get_rss())
+
+    @property
+    def peak(self):
+        return self.peak_rss - self.baseline
+
+
+def format_size(size):
+    for unit in ('B', 'K', 'M', 'G'):
+        if size < 1024:
+            return '{:.1f}{}'.format(size, unit)
+        size /= 1024
+    return '{:.1f}T'.format(size)
+
+
+def format_seconds(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '{}:{:02d}:{:02d}'.format(hours, minutes, seconds)
+
+
+def parse_size(size):
+    """
+    Parse a human readable size like 512M or 8G into a number of bytes.
+    :param size:
+    :return:
+    """
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+    size = str(size).strip().upper().rstrip('B')
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
 def make_parent_dirs(filename: Path):
     """
     Make the parent dirs for a given path.
@@ -111,3 +211,23 @@ def make_parent_dirs(filename: Path):
     parent: Path = filename.parent
     parent.mkdir(parents=True, exist_ok=True)
     return filename
+
+
+@contextlib.contextmanager
+def open_atomic(filename, mode='w'):
+    """
+    Open a tmp file of its own in the dir of filename, which replaces filename once it is written,
+    so that concurrent writers of the same file never see a partial file nor race on a shared tmp file.
+    :param filename:
+    :param mode: 'w' or 'wb'.
+    :return:
+    """
+    filename = Path(filename)
+    fd, tmp = tempfile.mkstemp(prefix='.' + filename.name, suffix='.tmp', dir=str(filename.parent))
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        os.replace(tmp, str(filename))
+    except BaseException:
+        os.unlink(tmp)
+        raise
@@ -0,0 +1,84 @@
+"""
+Keep the engine and its resources resident and re-evaluate the under_tests whose input files change.
+"""
+import collections
+import logging
+import time
+
+from eval.engine import plan_order
+from eval.loader import get_file_stat
+
+logger = logging.getLogger(__name__)
+
+POLL_SECONDS = 1
+# a file is evaluated after it has not changed for this long, so that a half-written file is not.
+DEFAULT_SETTLE_SECONDS = 5
+
+
+class Watcher:
+    """
+    Poll the input files of the under_tests of an engine, and tell which under_tests are affected
+    by the files that changed and settled since the last poll.
+    """
+
+    def __init__(self, engine, settle_seconds=DEFAULT_SETTLE_SECONDS):
+        self.engine = engine
+        self.settle_seconds = settle_seconds
+        # filename => under_tests reading it.
+        self.readers = collections.defaultdict(list)
+        for under_test in engine.under_tests:
+            for filename in engine.loader.get_filenames(under_test).values():
+                self.readers[str(filename)].append(under_test)
+        # filename => its last seen stat, None if it does not exist.
+        self.stats = {filename: get_file_stat(filename) for filename in self.readers}
+        # filename => when it was last seen changing, for the files not settled yet.
+        self.changing = {}
+        logger.info('watching {} files of {} under_tests'.format(len(self.readers), len(engine.under_tests)))
+
+    def poll(self):
+        """
+        :return: the under_tests reading the files that settled since the last poll.
+        """
+        now = time.monotonic()
+        for filename, old_stat in self.stats.items():
+            stat = get_file_stat(filename)
+            if stat != old_stat:
+                self.stats[filename] = stat
+                self.changing[filename] = now
+
+        settled = [filename for filename, changed in self.changing.items()
+                   if now - changed >= self.settle_seconds and self.stats[filename] is not None]
+        affected = []
+        for filename in settled:
+            del self.changing[filename]
+            logger.info('{} changed'.format(filename))
+            affected.extend(under_test for under_test in self.readers[filename] if under_test not in affected)
+        return affected
+
+
+def watch(engine, settle_seconds=DEFAULT_SETTLE_SECONDS, poll_seconds=POLL_SECONDS):
+    """
+    Run the outdated under_tests of engine, then re-run them as their inputs change, until interrupted.
+    The resources stay cached between runs, subject to the memory budget, and are reloaded when changed.
+    """
+    engine.exporter.export_config(engine.config)
+    watcher = Watcher(engine, settle_seconds)
+    engine.run_serial(plan_order(engine.get_outdated(), engine.loader), keep_resources=True)
+    logger.info('waiting for changes')
+    try:
+        while True:
+            time.sleep(poll_seconds)
+            affected = watcher.poll()
+            if not affected:
+                continue
+            # a file touched but not modified leaves its under_tests up to date.
+            outdated = [under_test for under_test in affected if engine.explain_outdated(under_test)]
+            logger.info('{} under_tests affected, {} outdated'.format(len(affected), len(outdated)))
+            try:
+                engine.run_serial(plan_order(outdated, engine.loader), keep_resources=True)
+            except Exception:
+                logger.exception('failed to run the affected under_tests')
+            engine.manifest.save()
+            logger.info('waiting for changes')
+    except KeyboardInterrupt:
+        logger.info('stopped watching')
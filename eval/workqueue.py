@@ -0,0 +1,298 @@
+"""
+A work queue in a shared directory, for running the engine on several nodes sharing a filesystem.
+
+The queue has one subdir per state of a work item: pending, running, done and failed.
+Moving an item between states is an atomic rename, so at most one worker claims a pending item.
+A worker holds the lease of a running item by touching it periodically. When a worker dies,
+its lease expires and the item goes back to pending for another worker to claim.
+An item that fails goes back to pending too, until it has failed MAX_ATTEMPTS times.
+"""
+import json
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+ALL_STATES = (PENDING, RUNNING, DONE, FAILED)
+
+QUEUE_JSON = 'queue.json'
+DEFAULT_LEASE_SECONDS = 300
+# how long an idle worker waits before looking for work again.
+POLL_SECONDS = 10
+# how many times an item is run before it is left failed.
+MAX_ATTEMPTS = 3
+
+
+def get_worker_id():
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+
+class WorkItem:
+    """
+    An under_test, or a shard of it, identified by the prefix of the under_test.
+    """
+
+    def __init__(self, prefix, shard=None, num_shards=None, stats=None, worker=None, attempts=0):
+        self.prefix = prefix
+        self.shard = shard
+        self.num_shards = num_shards
+        self.stats = stats
+        self.worker = worker
+        # the number of failed runs.
+        self.attempts = attempts
+
+    @property
+    def id(self):
+        if self.shard is None:
+            return self.prefix
+        return '{}.{:06d}'.format(self.prefix, self.shard)
+
+    def __repr__(self):
+        return '<{} {}>'.format(self.__class__.__qualname__, self.id)
+
+    def to_json(self):
+        return json.dumps(self.__dict__)
+
+    @classmethod
+    def from_json(cls, text):
+        return cls(**json.loads(text))
+
+
+class WorkQueue:
+
+    def __init__(self, root, lease_seconds=DEFAULT_LEASE_SECONDS):
+        self.root = Path(root)
+        self.lease_seconds = lease_seconds
+
+    def get_path(self, state, item_id):
+        return self.root.joinpath(state, item_id + '.json')
+
+    @property
+    def settings(self):
+        return json.loads(self.root.joinpath(QUEUE_JSON).read_text())
+
+    def publish(self, items, settings):
+        """
+        Publish items for workers to claim.
+
+        :param items: WorkItems.
+        :param settings: how the workers should construct their engines.
+        :return:
+        """
+        for state in ALL_STATES:
+            self.root.joinpath(state).mkdir(parents=True, exist_ok=True)
+        self.root.joinpath(QUEUE_JSON).write_text(json.dumps(settings))
+        for item in items:
+            if any(self.get_path(state, item.id).exists() for state in ALL_STATES):
+                logger.info('{} already published'.format(item))
+                continue
+            self.write(PENDING, item)
+        logger.info('published {} items to {}'.format(len(items), self.root))
+
+    def write(self, state, item):
+        path = self.get_path(state, item.id)
+        # a tmp file of its own, as a reclaimed item may be written by two workers at once.
+        fd, tmp = tempfile.mkstemp(prefix='.' + path.name, suffix='.tmp', dir=str(path.parent))
+        with os.fdopen(fd, 'w') as f:
+            f.write(item.to_json())
+        os.replace(tmp, str(path))
+
+    def read(self, state, item_id):
+        return WorkItem.from_json(self.get_path(state, item_id).read_text())
+
+    def list(self, state):
+        return sorted(path.stem for path in self.root.joinpath(state).glob('*.json'))
+
+    def move(self, item_id, src, dst):
+        """
+        Atomically move an item from state src to state dst.
+
+        :return: True if this call moved it, False if someone else did.
+        """
+        try:
+            os.rename(str(self.get_path(src, item_id)), str(self.get_path(dst, item_id)))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def claim(self, worker):
+        for item_id in self.list(PENDING):
+            # a rename keeps the mtime, so the lease is renewed first,
+            # lest reclaim_expired() take the item back before it is rewritten.
+            try:
+                os.utime(str(self.get_path(PENDING, item_id)))
+            except FileNotFoundError:
+                continue
+            if self.move(item_id, PENDING, RUNNING):
+                item = self.read(RUNNING, item_id)
+                item.worker = worker
+                self.write(RUNNING, item)
+                logger.info('{} claimed {}'.format(worker, item))
+                return item
+        return None
+
+    def renew(self, item):
+        try:
+            os.utime(str(self.get_path(RUNNING, item.id)))
+        except FileNotFoundError:
+            logger.warning('lease of {} was lost'.format(item))
+
+    def finish(self, item, stats=None):
+        item.stats = stats
+        if stats is not None:
+            state = DONE
+        else:
+            item.attempts += 1
+            state = PENDING if item.attempts < MAX_ATTEMPTS else FAILED
+            logger.warning('{} failed {} times, {}'.format(
+                item, item.attempts, 'retrying' if state == PENDING else 'giving up'))
+        self.write(RUNNING, item)
+        if not self.move(item.id, RUNNING, state):
+            # the lease expired and the item was reclaimed; record the result anyway.
+            self.write(state, item)
+
+    def reclaim_expired(self):
+        now = time.time()
+        for item_id in self.list(RUNNING):
+            try:
+                mtime = self.get_path(RUNNING, item_id).stat().st_mtime
+            except FileNotFoundError:
+                continue
+            if now - mtime > self.lease_seconds and self.move(item_id, RUNNING, PENDING):
+                logger.warning('lease of {} expired, back to pending'.format(item_id))
+
+    def requeue_failed(self):
+        """
+        Move the failed items back to pending, with their attempts reset.
+
+        :return: the ids of the requeued items.
+        """
+        item_ids = self.list(FAILED)
+        for item_id in item_ids:
+            item = self.read(FAILED, item_id)
+            item.attempts = 0
+            item.stats = None
+            self.write(FAILED, item)
+            self.move(item_id, FAILED, PENDING)
+        return item_ids
+
+    def is_drained(self):
+        return not self.list(PENDING) and not self.list(RUNNING)
+
+    def hold_lease(self, item):
+        """
+        Renew the lease of item in a background thread until the returned event is set.
+        """
+        stop = threading.Event()
+
+        def heartbeat():
+            while not stop.wait(self.lease_seconds / 3):
+                self.renew(item)
+
+        threading.Thread(target=heartbeat, daemon=True).start()
+        return stop
+
+
+def make_items(engine):
+    """
+    Make a WorkItem for every outdated under_test of engine, or one per shard if sharding.
+    """
+    items = []
+    evaluator = engine.evaluator
+    for under_test in engine.get_outdated():
+        if engine.shard_size and under_test.metric.shard_keys:
+            num_shards = evaluator.count_shards(under_test)
+            if num_shards is None:
+                continue
+            items.extend(WorkItem(under_test.prefix, index, num_shards) for index in range(num_shards))
+        else:
+            items.append(WorkItem(under_test.prefix))
+    return items
+
+
+def publish(engine, queue: WorkQueue, config_file=None):
+    settings = dict(
+        config=str(Path(config_file).absolute()) if config_file else None,
+        save_dir=str(engine.exporter.save_dir.absolute()),
+        shard_size=engine.shard_size,
+    )
+    engine.exporter.export_config(engine.config)
+    queue.publish(make_items(engine), settings)
+
+
+def work(engine, queue: WorkQueue, worker=None):
+    """
+    Claim and run items until the queue is drained.
+    """
+    worker = worker or get_worker_id()
+    under_tests = {under_test.prefix: under_test for under_test in engine.under_tests}
+    while True:
+        item = queue.claim(worker)
+        if item is None:
+            if queue.is_drained():
+                break
+            queue.reclaim_expired()
+            time.sleep(POLL_SECONDS)
+            continue
+
+        under_test = under_tests[item.prefix]
+        stop = queue.hold_lease(item)
+        try:
+            if item.shard is None:
+                stats = engine.evaluator(under_test)
+            else:
+                stats = engine.evaluator.evaluate_shard(under_test, item.shard)
+        except Exception:
+            logger.exception('{} failed'.format(item))
+            stats = None
+        finally:
+            stop.set()
+        queue.finish(item, stats)
+    logger.info('{}: queue {} is drained'.format(worker, queue.root))
+
+
+def merge(engine, queue: WorkQueue):
+    """
+    Assemble the score files of sharded under_tests and record every finished under_test.
+    The failed items are requeued for the workers to run again, and raise an error, as their under_tests
+    are not finished.
+    """
+    under_tests = {under_test.prefix: under_test for under_test in engine.under_tests}
+    items_by_prefix = {}
+    for item_id in queue.list(DONE):
+        item = queue.read(DONE, item_id)
+        items_by_prefix.setdefault(item.prefix, []).append(item)
+
+    for prefix, items in sorted(items_by_prefix.items()):
+        under_test = under_tests[prefix]
+        sharded = items[0].shard is not None
+        if sharded and len(items) < items[0].num_shards:
+            logger.info('{}: {}/{} shards done'.format(prefix, len(items), items[0].num_shards))
+            continue
+        if sharded:
+            # all shards are checkpointed, so this only computes the system score and exports.
+            if engine.evaluator(under_test) is None:
+                continue
+        stats = dict(load_seconds=0.0, compute_seconds=0.0, export_seconds=0.0, num_examples=0)
+        for item in items:
+            for key in stats:
+                stats[key] += item.stats[key]
+        # the shards ran in separate processes, so the peak is that of the largest.
+        stats['peak_memory'] = max((item.stats.get('peak_memory') or 0 for item in items), default=0)
+        stats['approximate'] = any(item.stats.get('approximate') for item in items)
+        engine.record(under_test, stats)
+        for item in items:
+            queue.get_path(DONE, item.id).unlink()
+    failed = queue.requeue_failed()
+    if failed:
+        raise RuntimeError('{} items failed and were requeued, run the workers and merge again: {}'.format(
+            len(failed), ', '.join(failed)))
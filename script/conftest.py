@@ -0,0 +1,37 @@
+"""
+Fixtures shared by the tests of the engine: a toy config of two models on a small dataset.
+"""
+import random
+
+import pytest
+
+from eval.models import Model
+from eval.utils import Dataset
+
+NUM_LINES = 20
+
+
+def write_corpus(filename, seed, num_lines=NUM_LINES):
+    rng = random.Random(seed)
+    lines = [' '.join(str(rng.randrange(8)) for _ in range(rng.randrange(1, 11))) for _ in range(num_lines)]
+    filename.write_text(''.join(line + '\n' for line in lines))
+
+
+@pytest.fixture
+def toy_config(tmp_path):
+    """
+    A function making a config of the given metrics, on corpora of NUM_LINES lines under tmp_path/data.
+    """
+    data_dir = tmp_path.joinpath('data')
+    data_dir.mkdir()
+    for seed, name in enumerate(('contexts', 'references', 'hred', 'lstm')):
+        write_corpus(data_dir.joinpath(name + '.txt'), seed)
+
+    def make_config(metrics):
+        return dict(
+            models=[Model(name, 'toy', str(data_dir.joinpath(name + '.txt'))) for name in ('hred', 'lstm')],
+            datasets=[Dataset('toy', str(data_dir.joinpath('contexts.txt')), str(data_dir.joinpath('references.txt')))],
+            metrics=metrics,
+        )
+
+    return make_config
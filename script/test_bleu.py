@@ -0,0 +1,103 @@
+"""
+The one-pass BLEU of eval.bleu against nltk's sentence_bleu and corpus_bleu, which it must match to the last bit.
+"""
+import random
+import warnings
+
+import pytest
+from nltk.translate.bleu_score import SmoothingFunction, corpus_bleu, sentence_bleu
+
+from eval import bleu
+
+ORDERS = (1, 2, 3, 4)
+
+
+def make_sentence(rng, vocab_size=6, max_len=12):
+    return [str(rng.randrange(vocab_size)) for _ in range(rng.randrange(max_len))]
+
+
+def make_corpus(seed, size=40, max_refs=3):
+    rng = random.Random(seed)
+    hypotheses = [make_sentence(rng) for _ in range(size)]
+    references = [[make_sentence(rng) for _ in range(rng.randint(1, max_refs))] for _ in range(size)]
+    return references, hypotheses
+
+
+def get_smoothing_function(method):
+    return getattr(SmoothingFunction(), 'method{}'.format(method))
+
+
+def nltk_or_error(fn, *args, **kwargs):
+    # nltk warns about zero counts, and method 6 needs a non-zero precision of trigrams.
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        try:
+            return fn(*args, **kwargs)
+        except (AssertionError, IndexError, ZeroDivisionError) as e:
+            return type(e)
+
+
+def ours_or_error(fn, *args, **kwargs):
+    try:
+        return fn(*args, **kwargs)
+    except (AssertionError, IndexError, ZeroDivisionError) as e:
+        return type(e)
+
+
+@pytest.mark.parametrize('method', bleu.SMOOTHING_METHODS)
+@pytest.mark.parametrize('n', ORDERS)
+def test_sentence_bleu(method, n):
+    references, hypotheses = make_corpus(seed=method * 10 + n)
+    weights = bleu.get_weights(n)
+    max_order = bleu.get_max_order(n, method)
+    for refs, hyp in zip(references, hypotheses):
+        expected = nltk_or_error(sentence_bleu, refs, hyp, weights, get_smoothing_function(method))
+        stats = bleu.get_pair_stats(refs, hyp, max_order)
+        assert ours_or_error(bleu.sentence_bleu, stats, weights, method) == expected
+
+
+@pytest.mark.parametrize('method', bleu.SMOOTHING_METHODS)
+@pytest.mark.parametrize('n', ORDERS)
+def test_corpus_bleu(method, n):
+    references, hypotheses = make_corpus(seed=100 + method * 10 + n)
+    weights = bleu.get_weights(n)
+    max_order = bleu.get_max_order(n, method)
+    expected = nltk_or_error(corpus_bleu, references, hypotheses, weights, get_smoothing_function(method))
+    pair_stats = [bleu.get_pair_stats(refs, hyp, max_order) for refs, hyp in zip(references, hypotheses)]
+    assert ours_or_error(bleu.corpus_bleu_from_pairs, pair_stats, weights, method) == expected
+
+
+def test_corpus_bleu_stats_streaming():
+    references, hypotheses = make_corpus(seed=7)
+    state = bleu.CorpusBleuStats()
+    for refs, hyp in zip(references, hypotheses):
+        state.add(refs, hyp)
+    for n in ORDERS:
+        weights = bleu.get_weights(n)
+        assert state.corpus_bleu(weights) == nltk_or_error(corpus_bleu, references, hypotheses, weights)
+
+
+def test_get_pair_stats_single_reference():
+    stats = bleu.get_pair_stats([['a', 'b', 'a', 'c']], ['a', 'a', 'a', 'b'], 2)
+    # a is clipped to 2, and only a b of the bigrams matches.
+    assert stats == bleu.PairStats((3, 1), (4, 3), 4, 4)
+
+
+def test_get_method():
+    assert bleu.get_method(True) == 1
+    assert bleu.get_method(False) == 0
+    assert bleu.get_method(7) == 7
+    with pytest.raises(ValueError):
+        bleu.get_method(8)
+
+
+def test_stats_cache_shares_orders():
+    cache = bleu.BleuStatsCache(size=2)
+    references, hypotheses = make_corpus(seed=3)
+    references = [refs[0] for refs in references]
+    stats = cache.get(references, hypotheses, 4)
+    # a lower order reuses the stats of the higher one.
+    assert cache.get(references, hypotheses, 2) is stats
+    assert cache.get(references, hypotheses, 5) is not stats
+    cache.clear()
+    assert not cache.entries
@@ -0,0 +1,72 @@
+"""
+The shard checkpoints of eval.checkpoint: resuming, discarding stale checkpoints and concurrent writes.
+"""
+import concurrent.futures
+import pickle
+from types import SimpleNamespace
+
+from eval.checkpoint import ShardCheckpoint, get_shard_payload, get_shard_ranges, pickle_atomic
+
+
+class FakeMetric:
+    version = 1
+
+    def __init__(self, n):
+        self.n = n
+
+
+def make_checkpoint(tmp_path, n=1, num_examples=10, shard_size=4):
+    under_test = SimpleNamespace(prefix='model-dataset-metric', metric=FakeMetric(n))
+    responses = tmp_path.joinpath('responses.txt')
+    if not responses.exists():
+        responses.write_text('a b\n' * num_examples)
+    return ShardCheckpoint(tmp_path.joinpath('save'), under_test, {'responses': responses}, num_examples, shard_size)
+
+
+def test_shard_ranges():
+    assert get_shard_ranges(10, 4) == [(0, 4), (4, 8), (8, 10)]
+    assert get_shard_ranges(0, 4) == []
+    payload = dict(responses=list(range(10)), references=list(range(10, 20)), embeddings='table')
+    shard = get_shard_payload(payload, ('responses', 'references'), 4, 8)
+    assert shard == dict(responses=[4, 5, 6, 7], references=[14, 15, 16, 17], embeddings='table')
+
+
+def test_resume(tmp_path):
+    checkpoint = make_checkpoint(tmp_path)
+    checkpoint.save(0, [1.0, 2.0])
+    assert checkpoint.load(1) is None
+    # a new run with the same inputs, metric and sharding resumes.
+    assert make_checkpoint(tmp_path).load(0) == [1.0, 2.0]
+
+
+def test_stale(tmp_path):
+    make_checkpoint(tmp_path).save(0, [1.0])
+    assert make_checkpoint(tmp_path, n=2).load(0) is None
+    make_checkpoint(tmp_path).save(0, [1.0])
+    assert make_checkpoint(tmp_path, shard_size=5).load(0) is None
+    make_checkpoint(tmp_path).save(0, [1.0])
+    tmp_path.joinpath('responses.txt').write_text('c d e\n' * 10)
+    assert make_checkpoint(tmp_path).load(0) is None
+
+
+def test_remove(tmp_path):
+    checkpoint = make_checkpoint(tmp_path)
+    checkpoint.save(0, [1.0])
+    checkpoint.remove()
+    assert not checkpoint.dir.exists()
+
+
+def test_pickle_atomic_concurrent(tmp_path):
+    filename = tmp_path.joinpath('shard.pkl')
+
+    def write(i):
+        for _ in range(50):
+            pickle_atomic(list(range(i, i + 100)), filename)
+
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        # a writer failing, e.g. when another moved its tmp file away, raises here.
+        list(executor.map(write, range(8)))
+    # the file is one whole write.
+    values = pickle.loads(filename.read_bytes())
+    assert values == list(range(values[0], values[0] + 100))
+    assert [path.name for path in tmp_path.iterdir()] == ['shard.pkl']
@@ -0,0 +1,227 @@
+"""
+The corpora and embeddings of eval.corpus, in process and in shared memory attached by other processes,
+and the token id corpora with the vocabularies of their datasets.
+"""
+import concurrent.futures
+import gc
+import os
+import pickle
+import subprocess
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from eval.corpus import EmbeddingTable, IdCorpus, SharedArray, TokenIdCorpus, Vocabulary
+from eval.ngram_index import count_ngrams, hash_token
+
+ROOT = str(Path(__file__).absolute().parent.parent)
+SENTENCES = [['a', 'b', 'c'], [], ['c', 'a'], ['d']]
+
+
+def test_id_corpus():
+    corpus = IdCorpus.from_token_lists(SENTENCES)
+    assert list(corpus) == SENTENCES
+    assert corpus[2] == ['c', 'a']
+    assert corpus[-1] == ['d']
+    assert corpus[1:3] == SENTENCES[1:3]
+    with pytest.raises(IndexError):
+        corpus[4]
+
+
+def test_embedding_table():
+    embeddings = {'a': np.array([1.0, 2.0]), 'b': np.array([3.0, 4.0])}
+    table = EmbeddingTable.from_mapping(embeddings)
+    assert 'a' in table and 'c' not in table
+    assert sorted(table) == ['a', 'b']
+    assert table['b'].tolist() == [3.0, 4.0]
+
+
+def get_sentences(corpus):
+    return list(corpus)
+
+
+def test_shared_corpus():
+    corpus = IdCorpus.from_token_lists(SENTENCES).share()
+    try:
+        assert corpus.is_shared
+        # only the names of the blocks are pickled.
+        assert len(pickle.dumps(corpus)) < 1000
+        with concurrent.futures.ProcessPoolExecutor(2) as executor:
+            assert list(executor.map(get_sentences, [corpus] * 4)) == [SENTENCES] * 4
+        assert list(corpus) == SENTENCES
+    finally:
+        corpus.unlink()
+
+
+def test_shared_array_read_only():
+    shared = SharedArray.from_array(np.arange(5))
+    try:
+        with pytest.raises(ValueError):
+            shared.array[0] = 1
+        attached = pickle.loads(pickle.dumps(shared))
+        assert not attached.owner
+        assert attached.array.tolist() == [0, 1, 2, 3, 4]
+        # only the creator unlinks.
+        attached.unlink()
+        assert SharedArray.attach(shared.shm.name, (5,), shared.array.dtype.str, os.getpid()).array.tolist() == [0, 1, 2, 3, 4]
+    finally:
+        shared.unlink()
+
+
+def test_attach_from_another_process():
+    shared = SharedArray.from_array(np.arange(10))
+    try:
+        code = ('from eval.corpus import SharedArray\n'
+                'shared = SharedArray.attach({!r}, (10,), {!r}, {})\n'
+                'print(int(shared.array.sum()))\n').format(shared.shm.name, shared.array.dtype.str, os.getpid())
+        env = dict(os.environ, PYTHONPATH=ROOT)
+        result = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True, check=True)
+        assert result.stdout.strip() == '45'
+        # the process exiting neither warns of a leak nor unlinks the block of its creator.
+        assert 'leaked' not in result.stderr
+        assert SharedArray.attach(shared.shm.name, (10,), shared.array.dtype.str, os.getpid()).array.sum() == 45
+    finally:
+        shared.unlink()
+
+
+@pytest.mark.parametrize('start_method', ['fork', 'spawn'])
+def test_unlink_after_pool(tmp_path, start_method):
+    # the workers of a pool share the resource tracker of their parent, which must still track the blocks.
+    code = ('import concurrent.futures, multiprocessing\n'
+            'from eval.corpus import IdCorpus\n'
+            'def get_length(corpus):\n'
+            '    return len(corpus)\n'
+            'if __name__ == "__main__":\n'
+            '    multiprocessing.set_start_method({!r})\n'
+            '    corpus = IdCorpus.from_token_lists([["a", "b"]] * 3).share()\n'
+            '    with concurrent.futures.ProcessPoolExecutor(2) as executor:\n'
+            '        print(list(executor.map(get_length, [corpus] * 4)))\n'
+            '    corpus.unlink()\n').format(start_method)
+    # spawned workers import the main module again.
+    script = tmp_path.joinpath('pool.py')
+    script.write_text(code)
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    result = subprocess.run([sys.executable, str(script)], env=env, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == '[3, 3, 3, 3]'
+    assert 'Traceback' not in result.stderr
+    assert 'leaked' not in result.stderr
+
+
+def test_token_id_corpus():
+    vocab = Vocabulary()
+    corpus = TokenIdCorpus.from_token_lists(SENTENCES, vocab)
+    assert [vocab.decode(ids) for ids in corpus] == SENTENCES
+    assert corpus[2] == vocab.encode(['c', 'a'])
+    for part in (corpus[1:3], corpus[::2], corpus[3:1], corpus.take([3, 0, 3])):
+        assert isinstance(part, TokenIdCorpus) and part.vocab is vocab
+    assert list(corpus[1:3]) == list(corpus)[1:3]
+    # a slice is a view of the ids.
+    assert corpus[1:3].ids.base is corpus.ids
+    assert list(corpus[::2]) == list(corpus)[::2]
+    assert len(corpus[3:1]) == 0
+    assert list(corpus.take([3, 0, 3])) == [corpus[3], corpus[0], corpus[3]]
+
+
+def test_token_id_hashing():
+    vocab = Vocabulary(['d'])
+    references = TokenIdCorpus.from_token_lists(SENTENCES, vocab)
+    # the corpora of a dataset share its vocabulary, which grows as they are loaded.
+    responses = TokenIdCorpus.from_token_lists([['e', 'a'], ['b', 'c', 'e']], vocab)
+    for corpus, sentences in ((references, SENTENCES), (responses, [['e', 'a'], ['b', 'c', 'e']])):
+        hashes, offsets = hash_token.hash_corpus(corpus)
+        assert hashes.tolist() == [hash_token(token) for sentence in sentences for token in sentence]
+        for expected, actual in zip(count_ngrams(sentences, 3), count_ngrams(corpus, 3)):
+            assert np.array_equal(expected, actual)
+    # bare ids mean nothing without their vocabulary.
+    with pytest.raises(TypeError):
+        count_ngrams(list(references))
+
+
+def get_token_hashes(corpus):
+    return hash_token.hash_corpus(corpus)[0].tolist()
+
+
+def test_shared_token_id_corpus():
+    vocab = Vocabulary(['d'])
+    corpus = TokenIdCorpus.from_token_lists(SENTENCES, vocab)
+    # an unshared corpus pickles with its vocabulary.
+    assert pickle.loads(pickle.dumps(corpus)).vocab.tokens == vocab.tokens
+    shared = corpus.share()
+    try:
+        assert shared.is_shared and not corpus.is_shared
+        # in this process, the corpus keeps the live vocabulary, which still grows.
+        assert shared.vocab is vocab and shared[0:2].vocab is vocab
+        vocab.encode(['e', 'f'])
+        assert len(pickle.dumps(shared)) < 1000
+        attached = pickle.loads(pickle.dumps(shared))
+        # the snapshot has the tokens of the corpus.
+        assert attached.vocab.tokens == ['d', 'a', 'b', 'c']
+        assert list(attached) == list(corpus)
+        expected = get_token_hashes(corpus)
+        with concurrent.futures.ProcessPoolExecutor(2) as executor:
+            assert list(executor.map(get_token_hashes, [shared, shared[1:]])) == [expected, expected[3:]]
+    finally:
+        shared.unlink()
+
+
+def test_loader_vocabularies(tmp_path):
+    pytest.importorskip('embedding_based')
+    from types import SimpleNamespace
+    from eval.loader import ResourceLoader, load_token_ids
+
+    tmp_path.joinpath('responses.txt').write_text('e a\nb c e\n')
+    tmp_path.joinpath('references.txt').write_text('a b c\nd\n')
+    metric = SimpleNamespace(requires={'responses': 'token_ids', 'references': 'token_ids'})
+    sources = {'model.responses': str(tmp_path.joinpath('responses.txt')),
+               'dataset.references': str(tmp_path.joinpath('references.txt'))}
+
+    def make_under_test(dataset_name):
+        return SimpleNamespace(metric=metric, dataset_name=dataset_name, get_resource_file=sources.get)
+
+    loader = ResourceLoader()
+    resources = loader.load_resources(make_under_test('dataset'))
+    vocab = resources['responses'].vocab
+    assert resources['references'].vocab is vocab
+    assert [vocab.decode(ids) for ids in resources['references']] == [['a', 'b', 'c'], ['d']]
+    # another dataset has a vocabulary of its own.
+    assert loader.get_vocab(make_under_test('other')) is not vocab
+    assert load_token_ids(sources['dataset.references'], Vocabulary())[0] == [0, 1, 2]
+
+    # the vocabulary is freed with the last corpus using it.
+    for resource_key in list(loader.resources_cache):
+        loader.evict(resource_key)
+    del resources, vocab
+    gc.collect()
+    assert 'dataset' not in loader.vocabularies
+
+
+def test_loader_shared_token_ids(tmp_path):
+    pytest.importorskip('embedding_based')
+    from types import SimpleNamespace
+    from eval.loader import ResourceLoader, load_token_ids
+
+    tmp_path.joinpath('responses.txt').write_text('e a\nb c e\n')
+    tmp_path.joinpath('references.txt').write_text('a b c\nd\n')
+    metric = SimpleNamespace(requires={'responses': 'token_ids', 'references': 'token_ids'})
+    sources = {'model.responses': str(tmp_path.joinpath('responses.txt')),
+               'dataset.references': str(tmp_path.joinpath('references.txt'))}
+    under_test = SimpleNamespace(metric=metric, dataset_name='dataset', get_resource_file=sources.get)
+
+    loader = ResourceLoader(shared=True)
+    shared = loader.share(under_test)
+    try:
+        assert sorted(load_fn.__name__ for _, load_fn in shared) == ['load_token_ids'] * 2
+        assert all(resource.is_shared for resource in shared.values())
+        # a worker attaches to the corpora, and encodes the others with the ids of the dataset.
+        worker = ResourceLoader()
+        worker.adopt(pickle.loads(pickle.dumps(shared)), under_test)
+        resources = worker.load_resources(under_test)
+        vocab = worker.get_vocab(under_test)
+        assert vocab.tokens == loader.get_vocab(under_test).tokens
+        assert [vocab.decode(ids) for ids in resources['references']] == [['a', 'b', 'c'], ['d']]
+        assert list(load_token_ids(sources['model.responses'], vocab)) == list(resources['responses'])
+    finally:
+        for resource in shared.values():
+            resource.unlink()
@@ -0,0 +1,118 @@
+"""
+The diversity engine of eval.diversity against distinct-n and entropy-n counted directly and the distinct_n package,
+and the error of its HyperLogLog sketch.
+"""
+import collections
+import math
+import random
+
+import numpy as np
+import pytest
+
+from eval import diversity
+
+
+def make_sentences(seed, size=300, vocab_size=30, max_len=15):
+    rng = random.Random(seed)
+    return [[str(rng.randrange(vocab_size)) for _ in range(rng.randrange(max_len))] for _ in range(size)]
+
+
+def count_ngrams(tokens, n):
+    return collections.Counter(tuple(tokens[i:i + n]) for i in range(len(tokens) - n + 1))
+
+
+def get_entropy(counts):
+    total = sum(counts.values())
+    return -sum(count / total * math.log(count / total) for count in counts.values()) if total else 0.0
+
+
+@pytest.mark.parametrize('n', [1, 2, 3, 4])
+def test_sentence_level(n):
+    sentences = make_sentences(seed=0)
+    stats = diversity.DiversityStats()
+    sentence_stats = stats.add(sentences)
+    expected = [len(count_ngrams(s, n)) / len(s) if s else 0.0 for s in sentences]
+    assert diversity.get_distinct_n(sentence_stats, n) == expected
+    entropy = diversity.get_entropy_n(sentence_stats, n)
+    assert entropy == pytest.approx([get_entropy(count_ngrams(s, n)) for s in sentences])
+
+
+@pytest.mark.parametrize('n', [1, 2, 3, 4])
+def test_corpus_level(n):
+    sentences = make_sentences(seed=1)
+    counts = collections.Counter()
+    for sentence in sentences:
+        counts.update(count_ngrams(sentence, n))
+    stats = diversity.DiversityStats()
+    stats.add(sentences)
+    assert stats.distinct_n(n) == len(counts) / sum(map(len, sentences))
+    assert stats.entropy_n(n) == pytest.approx(get_entropy(counts))
+
+
+def test_batches():
+    sentences = make_sentences(seed=2)
+    whole = diversity.DiversityStats()
+    whole.add(sentences)
+    batched = diversity.DiversityStats()
+    for start in range(0, len(sentences), 7):
+        batched.add(sentences[start:start + 7])
+    for n in range(1, 5):
+        assert batched.distinct_n(n) == whole.distinct_n(n)
+        assert batched.entropy_n(n) == pytest.approx(whole.entropy_n(n))
+
+
+def test_empty():
+    stats = diversity.DiversityStats()
+    sentence_stats = stats.add([[], []])
+    assert diversity.get_distinct_n(sentence_stats, 1) == [0.0, 0.0]
+    assert stats.distinct_n(1) == 0.0
+    assert stats.entropy_n(1) == 0.0
+
+
+@pytest.mark.parametrize('n', [1, 2, 3, 4])
+def test_distinct_n(n):
+    distinct_n = pytest.importorskip('distinct_n')
+    sentences = make_sentences(seed=3)
+    sentence_stats = diversity.DiversityStats().add(sentences)
+    expected = [distinct_n.distinct_n_sentence_level(s, n) for s in sentences]
+    assert diversity.get_distinct_n(sentence_stats, n) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize('precision', [None, 10])
+def test_distinct_score(precision):
+    # the utterance scores of DistinctScore are those of the distinct_n package it replaced.
+    distinct_n = pytest.importorskip('distinct_n')
+    pytest.importorskip('embedding_based')
+    pytest.importorskip('lsdscc')
+    from eval.metrics import DistinctScore
+
+    sentences = make_sentences(seed=5)
+    for metric in DistinctScore.parse_config(dict(n=[1, 2, 3], precision=precision)):
+        utterance, _ = metric(responses=sentences)
+        assert utterance == pytest.approx([distinct_n.distinct_n_sentence_level(s, metric.n) for s in sentences])
+
+
+@pytest.mark.parametrize('cardinality', [10, 1000, 100000])
+def test_hyperloglog(cardinality):
+    precision = 12
+    sketch = diversity.HyperLogLog(precision)
+    hashes = np.random.RandomState(cardinality).randint(0, 2 ** 63, size=cardinality, dtype=np.int64)
+    hashes = hashes.astype(np.uint64)
+    # the duplicates must not count.
+    sketch.add(np.concatenate([hashes, hashes[:cardinality // 2]]))
+    standard_error = 1.04 / math.sqrt(2 ** precision)
+    assert sketch.distinct() == pytest.approx(cardinality, rel=4 * standard_error)
+
+
+def test_hyperloglog_stats():
+    sentences = make_sentences(seed=4, size=3000, vocab_size=200)
+    exact = diversity.DiversityStats()
+    exact.add(sentences)
+    sketched = diversity.DiversityStats(precision=14)
+    sketched.add(sentences)
+    for n in range(1, 5):
+        assert sketched.distinct_n(n) == pytest.approx(exact.distinct_n(n), rel=0.04)
+    with pytest.raises(ValueError):
+        sketched.entropy_n(1)
+    with pytest.raises(ValueError):
+        diversity.HyperLogLog(20)
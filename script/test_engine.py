@@ -0,0 +1,124 @@
+"""
+Runs of eval.engine.Engine on a toy config: in a process pool against a serial run, the failures of
+under_tests in the workers, and the external tools overlapped with the in-process metrics.
+"""
+import json
+
+import pytest
+
+pytest.importorskip('embedding_based')
+pytest.importorskip('lsdscc')
+
+from eval import metrics
+from eval.engine import Engine
+from eval.telemetry import find_runs, load_events
+
+
+class FailingScore(metrics.MetricWrapper):
+    name = 'failing'
+    requires = (metrics.RESPONSES,)
+
+    def score_utterance(self, responses):
+        raise RuntimeError('failing on purpose')
+
+
+class ToolScore(metrics.SubprocessMetric):
+    """
+    Count the tokens of the responses with awk, logging when each run starts and ends.
+    """
+    name = 'tool'
+    requires = {metrics.RESPONSES: 'filename'}
+    external_tool = 'awk'
+    max_concurrency = 1
+
+    def __init__(self, log_file, fail=False):
+        self.log_file = str(log_file)
+        self.fail = fail
+
+    def get_command(self, responses):
+        return "echo start >> {log}; sleep 0.2; echo end >> {log}; {exit}awk '{{print NF}}' {responses}".format(
+            log=self.log_file, responses=responses, exit='exit 1; ' if self.fail else '')
+
+    def parse_output(self, text):
+        return [int(line) for line in text.split()], None
+
+
+def get_metrics():
+    configs = [
+        (metrics.UtteranceLenScore, dict()),
+        (metrics.BleuScore, dict(n=[2], smoothing=True)),
+        (metrics.DistinctScore, dict(n=[1, 2])),
+        (metrics.RougeScore, dict(variants=['rouge_l'])),
+    ]
+    return [metric for cls, config in configs for metric in cls.parse_config(config)]
+
+
+def read_outputs(save_dir):
+    return {path.name: json.loads(path.read_text()) for path in save_dir.glob('*.json') if path.name != 'config.json'}
+
+
+def get_events(save_dir, event):
+    return [e for e in load_events(find_runs(save_dir)[-1]) if e['event'] == event]
+
+
+def run_engine(tmp_path, config, name, **kwargs):
+    save_dir = tmp_path.joinpath(name)
+    save_dir.mkdir()
+    engine = Engine(config, save_dir, **kwargs)
+    engine.run()
+    return engine, save_dir
+
+
+def test_parallel_matches_serial(tmp_path, toy_config):
+    config = toy_config(get_metrics())
+    _, serial_dir = run_engine(tmp_path, config, 'serial')
+    engine, parallel_dir = run_engine(tmp_path, config, 'parallel', jobs=2)
+    outputs = read_outputs(serial_dir)
+    assert len(outputs) == 2 * 5
+    assert read_outputs(parallel_dir) == outputs
+    assert len(get_events(parallel_dir, 'under_test')) == 10
+    # the shared resources are freed after their last under_test.
+    assert not engine.loader.resources_cache and not engine.loader.pinned
+    # and are up to date for the next run.
+    engine.run()
+    assert len(get_events(parallel_dir, 'skip')) == 10
+
+
+def test_worker_failure(tmp_path, toy_config):
+    config = toy_config([metrics.UtteranceLenScore(), FailingScore()])
+    _, save_dir = run_engine(tmp_path, config, 'save', jobs=2)
+    assert sorted(read_outputs(save_dir)) == ['hred-toy-utterance_len.json', 'lstm-toy-utterance_len.json']
+    failed = get_events(save_dir, 'failed')
+    assert sorted(event['under_test'] for event in failed) == ['hred-toy-failing', 'lstm-toy-failing']
+    assert all('failing on purpose' in event['reason'] for event in failed)
+
+
+def read_log(log_file):
+    return log_file.read_text().split()
+
+
+def test_overlapped_matches_serial(tmp_path, toy_config):
+    log_file = tmp_path.joinpath('tool.log')
+    config = toy_config([ToolScore(log_file)] + get_metrics())
+    _, serial_dir = run_engine(tmp_path, config, 'serial')
+    _, overlapped_dir = run_engine(tmp_path, config, 'overlapped', overlap_external=True)
+    outputs = read_outputs(serial_dir)
+    assert outputs['hred-toy-tool.json']['utterance'] == outputs['hred-toy-utterance_len.json']['utterance']
+    assert read_outputs(overlapped_dir) == outputs
+    # at most max_concurrency runs of the tool at a time.
+    assert read_log(log_file)[4:] == ['start', 'end', 'start', 'end']
+
+
+def test_tool_limits(tmp_path, toy_config):
+    log_file = tmp_path.joinpath('tool.log')
+    run_engine(tmp_path, toy_config([ToolScore(log_file)]), 'save', overlap_external=True, tool_limits=dict(awk=2))
+    assert read_log(log_file) == ['start', 'start', 'end', 'end']
+
+
+def test_tool_failure(tmp_path, toy_config):
+    config = toy_config([ToolScore(tmp_path.joinpath('tool.log'), fail=True), metrics.UtteranceLenScore()])
+    _, save_dir = run_engine(tmp_path, config, 'save', overlap_external=True)
+    assert sorted(read_outputs(save_dir)) == ['hred-toy-utterance_len.json', 'lstm-toy-utterance_len.json']
+    failed = get_events(save_dir, 'failed')
+    assert sorted(event['under_test'] for event in failed) == ['hred-toy-tool', 'lstm-toy-tool']
+    assert all('CalledProcessError' in event['reason'] for event in failed)
@@ -1,3 +1,5 @@
 #!/usr/bin/env bash
 
+# the parity tests need the extra 'test' of setup.py, or they are skipped.
+python -m pytest -q -rs script
 python main.py -p save
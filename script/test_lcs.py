@@ -0,0 +1,126 @@
+"""
+The LCS and WLCS kernels of eval.lcs against the dynamic programs of Lin (2004), and ROUGE-L and ROUGE-W
+of eval.rouge_engine against the rouge package, i.e. easy-rouge.
+"""
+import random
+
+import pytest
+
+from eval import lcs, rouge_engine
+
+
+def make_pair(rng, vocab_size, max_len):
+    a = [rng.randrange(vocab_size) for _ in range(rng.randrange(max_len))]
+    b = [rng.randrange(vocab_size) for _ in range(rng.randrange(max_len))]
+    return a, b
+
+
+def make_pairs(seed, size=300, max_len=30):
+    rng = random.Random(seed)
+    return [make_pair(rng, rng.choice([2, 5, 20]), max_len) for _ in range(size)]
+
+
+def reference_lcs(a, b):
+    c = [[0] * (len(b) + 1) for _ in range(len(a) + 1)]
+    for i in range(1, len(a) + 1):
+        for j in range(1, len(b) + 1):
+            if a[i - 1] == b[j - 1]:
+                c[i][j] = c[i - 1][j - 1] + 1
+            else:
+                c[i][j] = max(c[i - 1][j], c[i][j - 1])
+    return c[len(a)][len(b)]
+
+
+def reference_wlcs_matches(a, b, weight):
+    # the WLCS of Lin (2004), figure 3, with f(k) = k ** weight, traced back as the rouge package does.
+    def f(k):
+        return k ** weight
+
+    c = [[0] * (len(b) + 1) for _ in range(len(a) + 1)]
+    w = [[0] * (len(b) + 1) for _ in range(len(a) + 1)]
+    moves = {}
+    for i in range(1, len(a) + 1):
+        for j in range(1, len(b) + 1):
+            if a[i - 1] == b[j - 1]:
+                k = w[i - 1][j - 1]
+                c[i][j] = c[i - 1][j - 1] + f(k + 1) - f(k)
+                w[i][j] = k + 1
+                moves[i, j] = 'd'
+            elif c[i - 1][j] > c[i][j - 1]:
+                c[i][j] = c[i - 1][j]
+                moves[i, j] = 'u'
+            else:
+                c[i][j] = c[i][j - 1]
+                moves[i, j] = 'l'
+    matches = []
+    i, j = len(a), len(b)
+    while i and j:
+        if moves[i, j] == 'd':
+            i, j = i - 1, j - 1
+            matches.append(j)
+        elif moves[i, j] == 'u':
+            i -= 1
+        else:
+            j -= 1
+    return matches[::-1]
+
+
+def test_lcs_length():
+    for a, b in make_pairs(seed=0):
+        assert lcs.lcs_length(a, b) == reference_lcs(a, b)
+    # longer than a machine word.
+    for a, b in make_pairs(seed=1, size=20, max_len=200):
+        assert lcs.lcs_length(a, b) == reference_lcs(a, b)
+
+
+@pytest.mark.parametrize('weight', [1.2, 1.5, 2])
+def test_wlcs_matches(weight):
+    for a, b in make_pairs(seed=2):
+        assert lcs.wlcs_matches(a, b, weight) == reference_wlcs_matches(a, b, weight)
+
+
+@pytest.mark.parametrize('weight', [1.2, 2])
+def test_wlcs_diagonals(weight, monkeypatch):
+    # every pair takes the anti-diagonal sweep.
+    monkeypatch.setattr(lcs, 'WLCS_DIAGONAL_LENGTH', 1)
+    for a, b in make_pairs(seed=3) + make_pairs(seed=4, size=5, max_len=300):
+        assert lcs.wlcs_matches(a, b, weight) == reference_wlcs_matches(a, b, weight)
+
+
+def test_wlcs_tokens():
+    a = 'the cat sat on the mat'.split()
+    b = 'the cat was on a mat'.split()
+    assert lcs.wlcs_matches(a, b, 1.2) == reference_wlcs_matches(a, b, 1.2) == [0, 1, 3, 5]
+    assert lcs.wlcs_matches(a, [], 1.2) == []
+    assert lcs.get_runs([0, 1, 3, 5, 6, 7]) == [2, 1, 3]
+
+
+def test_pooled_level():
+    pairs = make_pairs(seed=5)
+    utterance = [rouge_engine.rouge_l_sentence_level(b, a) for a, b in pairs]
+    total = rouge_engine.sum_stats([score.stats for score in utterance])
+    assert total == (sum(reference_lcs(a, b) for a, b in pairs), sum(len(b) for _, b in pairs),
+                     sum(len(a) for a, _ in pairs))
+    assert rouge_engine.rouge_l_pooled_level(utterance) == rouge_engine.rouge_l_score(total)
+
+
+@pytest.mark.parametrize('alpha', [0.5, 0.9])
+def test_rouge_l(alpha):
+    rouge = pytest.importorskip('rouge')
+    for a, b in make_pairs(seed=6):
+        expected = rouge.rouge_l_sentence_level(b, a, alpha=alpha)
+        got = rouge_engine.rouge_l_sentence_level(b, a, alpha=alpha)
+        assert (got.precision, got.recall, got.f1_measure) == pytest.approx(
+            (expected.precision, expected.recall, expected.f1_measure))
+
+
+@pytest.mark.parametrize('alpha', [0.5, 0.9])
+@pytest.mark.parametrize('weight', [1.2, 2])
+def test_rouge_w(alpha, weight):
+    rouge = pytest.importorskip('rouge')
+    # the long pairs take the anti-diagonal sweep.
+    for a, b in make_pairs(seed=7) + make_pairs(seed=8, size=3, max_len=600):
+        expected = rouge.rouge_w_sentence_level(b, a, alpha=alpha, weight=weight)
+        got = rouge_engine.rouge_w_sentence_level(b, a, alpha=alpha, weight=weight)
+        assert (got.precision, got.recall, got.f1_measure) == pytest.approx(
+            (expected.precision, expected.recall, expected.f1_measure))
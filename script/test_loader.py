@@ -0,0 +1,107 @@
+"""
+The resource lifetimes of eval.loader: the order of eval.engine.plan_order keeping shared resources resident,
+freeing each resource after its last planned use, evicting within the memory budget and reloading files
+that changed.
+"""
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('embedding_based')
+
+from eval.engine import plan_order
+from eval.loader import ResourceLoader
+
+
+class Loads:
+    # a format reading the text of a file, which records the files it read.
+
+    def __init__(self):
+        self.filenames = []
+
+    def __call__(self, filename):
+        self.filenames.append(Path(filename).name)
+        return Path(filename).read_text()
+
+
+@pytest.fixture
+def files(tmp_path):
+    sizes = dict(embeddings=1000, references=100, a=50, b=60)
+    for name, size in sizes.items():
+        tmp_path.joinpath(name).write_text('x' * size)
+    return {name: str(tmp_path.joinpath(name)) for name in sizes}
+
+
+def make_under_test(files, load_fn, responses, embeddings=False):
+    requires = {'responses': ('model.responses', load_fn), 'references': ('dataset.references', load_fn)}
+    sources = {'model.responses': files[responses], 'dataset.references': files['references']}
+    if embeddings:
+        requires['embeddings'] = ('metric.embeddings_file', load_fn)
+        sources['metric.embeddings_file'] = files['embeddings']
+    name = '{}{}'.format(responses, '+embeddings' if embeddings else '')
+    return SimpleNamespace(metric=SimpleNamespace(requires=requires), name=name, get_resource_file=sources.get)
+
+
+def get_cached(loader):
+    return sorted(Path(filename).name for filename, _ in loader.resources_cache)
+
+
+def test_plan_order(files):
+    load_fn = Loads()
+    under_tests = [make_under_test(files, load_fn, 'a'), make_under_test(files, load_fn, 'b', embeddings=True),
+                   make_under_test(files, load_fn, 'b'), make_under_test(files, load_fn, 'a', embeddings=True)]
+    ordered = plan_order(under_tests, ResourceLoader())
+    # the consumers of the largest resource back to back, then those on the same responses.
+    assert [under_test.name for under_test in ordered] == ['b+embeddings', 'a+embeddings', 'b', 'a']
+
+
+def test_release_after_last_use(files):
+    load_fn = Loads()
+    under_tests = [make_under_test(files, load_fn, 'a'), make_under_test(files, load_fn, 'b')]
+    loader = ResourceLoader()
+    loader.plan(under_tests)
+    for under_test in under_tests:
+        assert loader.load_resources(under_test) is not None
+    assert get_cached(loader) == ['a', 'b', 'references']
+    loader.release(under_tests[0])
+    assert get_cached(loader) == ['b', 'references']
+    loader.release(under_tests[1])
+    assert get_cached(loader) == []
+    assert load_fn.filenames == ['a', 'references', 'b']
+    assert (loader.cache_hits, loader.cache_misses) == (1, 3)
+
+
+def test_unplanned_are_kept(files):
+    loader = ResourceLoader()
+    under_test = make_under_test(files, Loads(), 'a')
+    loader.load_resources(under_test)
+    loader.release(under_test)
+    assert get_cached(loader) == ['a', 'references']
+
+
+def test_memory_budget(files):
+    load_fn = Loads()
+    under_tests = [make_under_test(files, load_fn, 'a'), make_under_test(files, load_fn, 'b'),
+                   make_under_test(files, load_fn, 'a')]
+    loader = ResourceLoader(max_memory=200)
+    loader.plan(under_tests[1:])
+    loader.load_resources(under_tests[0])
+    # the under_test loading b needs the references too, so a is evicted.
+    loader.load_resources(under_tests[1])
+    assert get_cached(loader) == ['b', 'references']
+    # a running worker keeps its resources, and so does the under_test loading, over the budget.
+    loader.pinned[(files['b'], load_fn)] += 1
+    loader.load_resources(under_tests[2])
+    assert get_cached(loader) == ['a', 'b', 'references']
+    assert load_fn.filenames == ['a', 'references', 'b', 'a']
+
+
+def test_reload_changed(files):
+    load_fn = Loads()
+    under_test = make_under_test(files, load_fn, 'a')
+    loader = ResourceLoader()
+    assert loader.load_resources(under_test)['responses'] == 'x' * 50
+    Path(files['a']).write_text('y' * 40)
+    assert loader.load_resources(under_test)['responses'] == 'y' * 40
+    assert load_fn.filenames == ['a', 'references', 'a']
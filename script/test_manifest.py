@@ -0,0 +1,131 @@
+"""
+The staleness checks of eval.manifest: content hashes of the inputs, params and code version of the metric,
+tolerance of approximate outputs, and saving the manifest from several threads.
+"""
+import concurrent.futures
+import json
+import os
+from types import SimpleNamespace
+
+from eval.manifest import BuildManifest, describe_param
+
+
+class ToyMetric:
+    version = 1
+
+    def __init__(self, n=2, smoothing=None):
+        self.n = n
+        self.smoothing = smoothing
+
+
+def make_under_test(metric=None, prefix='model-dataset-toy'):
+    return SimpleNamespace(metric=metric or ToyMetric(), prefix=prefix)
+
+
+def make_files(tmp_path):
+    responses = tmp_path.joinpath('responses.txt')
+    responses.write_text('a b\nc\n')
+    output = tmp_path.joinpath('output.json')
+    output.write_text('{}')
+    return dict(responses=responses), output
+
+
+def touch(filename, seconds):
+    # move the mtime by seconds, which the resolution of some filesystems needs.
+    stat = filename.stat()
+    os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + int(seconds * 1e9)))
+
+
+def test_up_to_date(tmp_path):
+    filenames, output = make_files(tmp_path)
+    under_test = make_under_test()
+    manifest = BuildManifest(tmp_path)
+    assert 'does not exist' in manifest.explain(tmp_path.joinpath('missing.json'), under_test, filenames)
+    manifest.record(under_test, filenames)
+    assert manifest.explain(output, under_test, filenames) is None
+    # the manifest persists.
+    assert BuildManifest(tmp_path).explain(output, under_test, filenames) is None
+
+
+def test_touched_but_same_content(tmp_path):
+    filenames, output = make_files(tmp_path)
+    under_test = make_under_test()
+    BuildManifest(tmp_path).record(under_test, filenames)
+    touch(filenames['responses'], 10)
+    manifest = BuildManifest(tmp_path)
+    assert manifest.explain(output, under_test, filenames) is None
+    # hashed again, and cached with the new mtime.
+    cached = manifest.files[str(filenames['responses'].absolute())]
+    assert cached['mtime'] == filenames['responses'].stat().st_mtime_ns
+
+
+def test_content_changed(tmp_path):
+    filenames, output = make_files(tmp_path)
+    under_test = make_under_test()
+    manifest = BuildManifest(tmp_path)
+    manifest.record(under_test, filenames)
+    # same size, so only the hash tells.
+    filenames['responses'].write_text('a c\nb\n')
+    touch(filenames['responses'], 10)
+    assert manifest.explain(output, under_test, filenames).startswith('content of input responses')
+    filenames['responses'].unlink()
+    assert 'does not exist' in manifest.explain(output, under_test, filenames)
+
+
+def test_metric_changed(tmp_path):
+    filenames, output = make_files(tmp_path)
+    manifest = BuildManifest(tmp_path)
+    manifest.record(make_under_test(ToyMetric(n=2)), filenames)
+    assert manifest.explain(output, make_under_test(ToyMetric(n=4)), filenames) == 'metric params changed'
+    metric = ToyMetric(n=2)
+    metric.version = 2
+    assert manifest.explain(output, make_under_test(metric), filenames).startswith('code version changed')
+
+
+def test_describe_param():
+    assert describe_param(dict(n=(1, 2), f=len)) == {'n': [1, 2], 'f': 'builtins.len'}
+    # described by their type, which is stable across runs unlike their repr.
+    assert describe_param(object()) == 'object'
+
+
+def test_tolerance(tmp_path):
+    filenames, output = make_files(tmp_path)
+    under_test = make_under_test()
+    manifest = BuildManifest(tmp_path)
+    manifest.record(under_test, filenames, tolerance=0.1)
+    assert manifest.explain(output, under_test, filenames).startswith('output is approximate')
+    assert manifest.explain(output, under_test, filenames, tolerance=0.05).startswith('output is approximate')
+    # as accurate as asked for.
+    assert manifest.explain(output, under_test, filenames, tolerance=0.2) is None
+    manifest.record(under_test, filenames)
+    assert manifest.explain(output, under_test, filenames, tolerance=0.2) is None
+
+
+def test_adopt_old_output(tmp_path):
+    filenames, output = make_files(tmp_path)
+    under_test = make_under_test()
+    touch(output, 10)
+    manifest = BuildManifest(tmp_path)
+    assert manifest.explain(output, under_test, filenames) is None
+    assert under_test.prefix in manifest.outputs
+    touch(filenames['responses'], 20)
+    other = make_under_test(prefix='model-dataset-other')
+    assert 'is newer than the output' in BuildManifest(tmp_path).explain(output, other, filenames)
+
+
+def test_concurrent_save(tmp_path):
+    filenames, _ = make_files(tmp_path)
+
+    def record(i):
+        # each engine has a manifest of its own on the same save_dir.
+        manifest = BuildManifest(tmp_path)
+        for j in range(20):
+            manifest.record(make_under_test(prefix='model-dataset-{}-{}'.format(i, j)), filenames)
+        return i
+
+    with concurrent.futures.ThreadPoolExecutor(4) as executor:
+        assert list(executor.map(record, range(4))) == list(range(4))
+    # the last save wins, whole.
+    outputs = json.loads(BuildManifest(tmp_path).filename.read_text())['outputs']
+    assert any(all('model-dataset-{}-{}'.format(i, j) in outputs for j in range(20)) for i in range(4))
+    assert [path.name for path in tmp_path.iterdir() if path.name.endswith('.tmp')] == []
@@ -0,0 +1,90 @@
+"""
+The reference n-gram index of eval.ngram_index against the pair stats of eval.bleu, and its build and reuse on disk.
+"""
+import collections
+import os
+import random
+
+import pytest
+
+from eval import bleu, ngram_index
+from eval.ngram_index import NgramIndex, count_ngrams, get_ngram_index
+
+
+def make_sentences(seed, size=50, vocab_size=8, max_len=15):
+    rng = random.Random(seed)
+    return [[str(rng.randrange(vocab_size)) for _ in range(rng.randrange(max_len))] for _ in range(size)]
+
+
+def test_count_ngrams():
+    sentences = make_sentences(seed=0)
+    groups, hashes, counts, lengths = count_ngrams(sentences, 4)
+    assert lengths.tolist() == [len(sentence) for sentence in sentences]
+    for i, sentence in enumerate(sentences):
+        expected = bleu.count_ngrams(sentence, 4)
+        for order in range(1, 5):
+            selected = groups == i * 4 + order - 1
+            got = sorted(counts[selected].tolist())
+            assert got == sorted(count for ngram, count in expected.items() if len(ngram) == order)
+
+
+@pytest.mark.parametrize('max_order', [1, 2, 4])
+def test_pair_stats(max_order):
+    references = make_sentences(seed=1)
+    hypotheses = make_sentences(seed=2)
+    index = NgramIndex.build(references)
+    expected = [bleu.get_pair_stats([ref], hyp, max_order) for ref, hyp in zip(references, hypotheses)]
+    assert index.get_pair_stats(hypotheses, max_order) == expected
+
+
+def test_selections():
+    references = make_sentences(seed=3)
+    hypotheses = make_sentences(seed=4)
+    index = NgramIndex.build(references)
+    expected = [bleu.get_pair_stats([ref], hyp) for ref, hyp in zip(references, hypotheses)]
+    assert index[10:20].get_pair_stats(hypotheses[10:20]) == expected[10:20]
+    assert index[-1].get_pair_stats(hypotheses[-1:]) == expected[-1:]
+    # the references of a batch, one by one as a stream yields them.
+    batch = list(index)[5:9]
+    assert ngram_index.as_index(batch).get_pair_stats(hypotheses[5:9]) == expected[5:9]
+    with pytest.raises(ValueError):
+        index.get_pair_stats(hypotheses[:-1])
+    with pytest.raises(ValueError):
+        index.get_pair_stats(hypotheses, index.max_order + 1)
+
+
+def write_lines(filename, sentences):
+    filename.write_text(''.join(' '.join(sentence) + '\n' for sentence in sentences))
+
+
+def tokenize(filename):
+    return [line.split() for line in open(str(filename))]
+
+
+def test_get_ngram_index(tmp_path):
+    filename = tmp_path.joinpath('references.txt')
+    references = make_sentences(seed=5)
+    hypotheses = make_sentences(seed=6)
+    write_lines(filename, references)
+    calls = collections.Counter()
+
+    def token_lists_fn(name):
+        calls['build'] += 1
+        return tokenize(name)
+
+    expected = [bleu.get_pair_stats([ref], hyp) for ref, hyp in zip(references, hypotheses)]
+    assert get_ngram_index(filename, token_lists_fn).get_pair_stats(hypotheses) == expected
+    assert get_ngram_index(filename, token_lists_fn).get_pair_stats(hypotheses) == expected
+    assert calls['build'] == 1
+
+    # touched but not changed.
+    os.utime(str(filename))
+    get_ngram_index(filename, token_lists_fn)
+    assert calls['build'] == 1
+
+    references = make_sentences(seed=7)
+    write_lines(filename, references)
+    expected = [bleu.get_pair_stats([ref], hyp) for ref, hyp in zip(references, hypotheses)]
+    assert get_ngram_index(filename, token_lists_fn).get_pair_stats(hypotheses) == expected
+    assert calls['build'] == 2
+    assert [path.name for path in tmp_path.iterdir() if 'tmp' in path.name] == []
@@ -0,0 +1,105 @@
+"""
+Scoring the responses of eval.pipeline while a sampler writes them: tailing the file in batches, and the
+pipelined run of the engine against a run on the finished file.
+"""
+import functools
+import json
+import subprocess
+import sys
+
+import pytest
+
+from eval import pipeline
+
+# copy the lines of a file to another, half a line at a time.
+SAMPLER = '''
+import sys, time
+src, dst = sys.argv[1:3]
+with open(src) as f:
+    lines = f.readlines()
+with open(dst, 'w') as f:
+    for line in lines:
+        half = len(line) // 2
+        for part in (line[:half], line[half:]):
+            f.write(part)
+            f.flush()
+            time.sleep(0.01)
+sys.exit(int(sys.argv[3]))
+'''
+
+
+def start_sampler(tmp_path, src, dst, returncode=0):
+    script = tmp_path.joinpath('sampler.py')
+    script.write_text(SAMPLER)
+    return subprocess.Popen([sys.executable, str(script), str(src), str(dst), str(returncode)])
+
+
+@pytest.mark.parametrize('text', ['a b\nc\n\nd e f\n' * 5, 'a b\nc\nd e f'])
+def test_tail_batches(tmp_path, text):
+    src, dst = tmp_path.joinpath('src.txt'), tmp_path.joinpath('dst.txt')
+    src.write_text(text)
+    sampler = start_sampler(tmp_path, src, dst)
+    batches = list(pipeline.tail_batches(dst, sampler, 3, poll_seconds=0.005))
+    assert all(0 < len(batch) <= 3 for batch in batches)
+    # the last line may lack its newline.
+    assert ''.join(line for batch in batches for line in batch) == text
+
+
+def test_tail_nothing_written(tmp_path):
+    sampler = subprocess.Popen([sys.executable, '-c', 'pass'])
+    assert list(pipeline.tail_batches(tmp_path.joinpath('never.txt'), sampler, 3, poll_seconds=0.005)) == []
+
+
+def read_outputs(save_dir):
+    return {path.name: json.loads(path.read_text()) for path in save_dir.glob('*.json') if path.name != 'config.json'}
+
+
+def get_metrics():
+    from eval import metrics
+
+    configs = [
+        (metrics.UtteranceLenScore, dict()),
+        (metrics.BleuScore, dict(n=[2], smoothing=True)),
+        (metrics.DistinctScore, dict(n=[1, 2])),
+    ]
+    return [metric for cls, config in configs for metric in cls.parse_config(config)]
+
+
+def test_run_pipelined(tmp_path, toy_config, monkeypatch):
+    pytest.importorskip('embedding_based')
+    pytest.importorskip('lsdscc')
+    from eval.engine import Engine, Evaluator
+    from eval.exporter import Exporter
+    from eval.loader import ResourceLoader
+    from eval.telemetry import find_runs, load_events
+
+    monkeypatch.setattr(pipeline, 'tail_batches', functools.partial(pipeline.tail_batches, poll_seconds=0.005))
+    config = toy_config(get_metrics())
+    expected_dir, save_dir = tmp_path.joinpath('expected'), tmp_path.joinpath('save')
+    for directory in (expected_dir, save_dir):
+        directory.mkdir()
+    Engine(config, expected_dir).run()
+
+    # the responses of hred are being sampled.
+    sampled = tmp_path.joinpath('sampled.txt')
+    hred = config['models'][0]
+    sampler = start_sampler(tmp_path, hred.responses, sampled)
+    expected = read_outputs(expected_dir)
+    for name in [name for name in expected if name.startswith('hred')]:
+        expected[name.replace('hred', 'sampled')] = dict(expected.pop(name), model='sampled')
+    hred.name, hred.responses = 'sampled', str(sampled)
+    engine = Engine(config, save_dir, batch_size=4)
+    engine.run_pipelined({str(sampled): sampler})
+    assert read_outputs(save_dir) == expected
+    # the run after the sampler found the sampled model scored already.
+    skipped = [event['under_test'] for event in load_events(find_runs(save_dir)[-1]) if event['event'] == 'skip']
+    assert sorted(skipped) == sorted(name[:-len('.json')] for name in expected if name.startswith('sampled'))
+
+    # a failed sampler exports nothing.
+    failed = start_sampler(tmp_path, tmp_path.joinpath('data', 'lstm.txt'), tmp_path.joinpath('failed.txt'), 1)
+    under_tests = [under_test for under_test in engine.under_tests if under_test.model_name == 'lstm']
+    for under_test in under_tests:
+        under_test.model.responses = str(tmp_path.joinpath('failed.txt'))
+    evaluator = Evaluator(Exporter(tmp_path.joinpath('failed')), ResourceLoader())
+    assert pipeline.evaluate_pipelined(evaluator, under_tests, failed, 4) == {}
+    assert not tmp_path.joinpath('failed').exists()
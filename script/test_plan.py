@@ -0,0 +1,55 @@
+"""
+The dry run of eval.plan: the status, resources and cost estimates of every under_test of an engine,
+before and after a run, without running anything.
+"""
+import os
+
+import pytest
+
+pytest.importorskip('embedding_based')
+pytest.importorskip('lsdscc')
+
+from eval import metrics
+from eval.engine import Engine
+from eval.plan import FRESH, MISSING, STALE, format_plan
+from eval.scheduler import CORPUS_SIZE, HISTORY
+
+
+def get_entries(plan):
+    return {entry.under_test.prefix: entry for entry in plan}
+
+
+def test_plan(tmp_path, toy_config):
+    config = toy_config([metrics.UtteranceLenScore()] + list(metrics.BleuScore.parse_config(dict(n=[2]))))
+    save_dir = tmp_path.joinpath('save')
+    save_dir.mkdir()
+    engine = Engine(config, save_dir)
+    entries = get_entries(engine.plan())
+    assert sorted(entries) == ['hred-toy-bleu_2', 'hred-toy-utterance_len', 'lstm-toy-bleu_2',
+                               'lstm-toy-utterance_len']
+    # nothing ran.
+    assert list(save_dir.glob('*.json')) == []
+    bleu = entries['hred-toy-bleu_2']
+    assert bleu.status == STALE and bleu.reason.startswith('output')
+    assert bleu.num_examples == 20 and bleu.estimated_from == CORPUS_SIZE
+    data_dir = tmp_path.joinpath('data')
+    # the resolved file and format of each resource.
+    assert bleu.resources == [(str(data_dir.joinpath('hred.txt')), 'token_ids'),
+                              (str(data_dir.joinpath('references.txt')), 'ngram_index')]
+    assert entries['hred-toy-utterance_len'].resources == [(str(data_dir.joinpath('hred.txt')), 'token_list')]
+
+    text = format_plan(entries.values(), jobs=2)
+    assert 'ngram_index:{}'.format(data_dir.joinpath('references.txt')) in text
+    assert '4 under_tests: 0 fresh, 4 stale, 0 missing input' in text
+    # the metrics load the responses in formats of their own, and share the index of the references.
+    assert '5 resources to load, 1 of them shared by several under_tests' in text
+
+    engine.run()
+    entries = get_entries(Engine(config, save_dir).plan())
+    assert all(entry.status == FRESH and entry.estimated_from == HISTORY for entry in entries.values())
+
+    os.unlink(data_dir.joinpath('lstm.txt'))
+    entries = get_entries(Engine(config, save_dir).plan())
+    assert entries['lstm-toy-bleu_2'].status == MISSING
+    assert entries['lstm-toy-bleu_2'].reason.startswith('missing input')
+    assert entries['hred-toy-bleu_2'].status == FRESH
@@ -0,0 +1,87 @@
+"""
+The profiles of eval.profiling: the files of each phase of each under_test in cpu and mem modes,
+and the summaries aggregating them.
+"""
+import tracemalloc
+from types import SimpleNamespace
+
+import pytest
+
+from eval.consts import PROFILE_DIR
+from eval.profiling import PEAK_MEMORY_TABLE, SUMMARY, Profiler, profile_phase
+
+
+def busy_loop():
+    return sum(i * i for i in range(100000))
+
+
+@pytest.fixture
+def stop_tracing():
+    yield
+    # mem mode leaves tracemalloc on for the next phases, which would slow down the other tests.
+    tracemalloc.stop()
+
+
+def test_unknown_mode(tmp_path):
+    with pytest.raises(ValueError):
+        Profiler(tmp_path, 'gpu')
+    with profile_phase(None, SimpleNamespace(prefix='model-dataset-metric'), 'load'):
+        pass
+    assert not tmp_path.joinpath(PROFILE_DIR).exists()
+
+
+def test_cpu(tmp_path):
+    profiler = Profiler(tmp_path, 'cpu')
+    profiler.reset()
+    for prefix in ('model-dataset-a', 'model-dataset-b'):
+        under_test = SimpleNamespace(prefix=prefix)
+        with profile_phase(profiler, under_test, 'compute'):
+            busy_loop()
+        with profile_phase(profiler, under_test, 'export'):
+            pass
+    profile_dir = tmp_path.joinpath(PROFILE_DIR)
+    assert sorted(path.name for path in profile_dir.iterdir()) == [
+        'model-dataset-a.compute.prof', 'model-dataset-a.export.prof',
+        'model-dataset-b.compute.prof', 'model-dataset-b.export.prof']
+    summary = profiler.summarize()
+    assert profile_dir.joinpath(SUMMARY).read_text() == summary
+    assert '=== compute: 2 under_tests' in summary and 'busy_loop' in summary
+    assert '=== load' not in summary
+    # a new run starts afresh.
+    profiler.reset()
+    assert list(profile_dir.iterdir()) == []
+
+
+def test_mem(tmp_path, stop_tracing):
+    profiler = Profiler(tmp_path, 'mem')
+    under_test = SimpleNamespace(prefix='model-dataset-metric')
+    with profile_phase(profiler, under_test, 'load'):
+        kept = [bytes(1024) for _ in range(1000)]
+    with profile_phase(profiler, under_test, 'compute'):
+        dropped = bytearray(4 * 1024 * 1024)
+        del dropped
+    rows = [line.split('\t') for line in tmp_path.joinpath(PROFILE_DIR, PEAK_MEMORY_TABLE).read_text().splitlines()]
+    (_, load, load_peak, load_retained), (_, compute, compute_peak, compute_retained) = rows
+    assert (load, compute) == ('load', 'compute')
+    assert int(load_retained) >= 1000 * 1024 and int(load_peak) >= int(load_retained)
+    # the peak of a phase counts what it freed before it ended.
+    assert int(compute_peak) >= 4 * 1024 * 1024 > int(compute_retained)
+    summary = profiler.summarize()
+    assert summary.splitlines()[2].startswith('model-dataset-metric') and 'compute' in summary.splitlines()[2]
+    assert '=== load: top allocation sites over 1 under_tests ===' in summary
+    assert 'test_profiling.py' in summary
+    del kept
+
+
+def test_engine_profile(tmp_path, toy_config):
+    pytest.importorskip('embedding_based')
+    pytest.importorskip('lsdscc')
+    from eval import metrics
+    from eval.engine import Engine
+
+    save_dir = tmp_path.joinpath('save')
+    save_dir.mkdir()
+    Engine(toy_config([metrics.UtteranceLenScore()]), save_dir, profile='cpu').run()
+    names = sorted(path.name for path in save_dir.joinpath(PROFILE_DIR).iterdir())
+    assert names == sorted(['{}-toy-utterance_len.{}.prof'.format(model, phase)
+                            for model in ('hred', 'lstm') for phase in ('load', 'compute', 'export')] + [SUMMARY])
@@ -0,0 +1,126 @@
+"""
+The approximate evaluation of eval.progressive: the running mean and its confidence interval, and scoring
+random examples until the interval is narrow enough.
+"""
+import collections
+import json
+import random
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from eval.corpus import TokenIdCorpus, Vocabulary
+from eval.progressive import RunningMean, can_progress, compute_progressive, take
+
+Score = collections.namedtuple('Score', 'f1 length')
+
+
+class LengthScore:
+    fullname = 'length'
+    shard_keys = ('responses',)
+    utterance_field = None
+    mean_system = True
+
+    def score_utterance(self, responses):
+        return [len(tokens) for tokens in responses]
+
+    def score_system(self, utterance, responses):
+        assert len(utterance) == len(responses)
+        return float(np.mean(utterance))
+
+
+def make_payload(num_examples, seed=0):
+    rng = random.Random(seed)
+    return dict(responses=[['a'] * rng.randrange(20) for _ in range(num_examples)])
+
+
+def test_running_mean():
+    values = np.random.RandomState(0).normal(size=100)
+    running = RunningMean()
+    assert running.half_width() == float('inf')
+    for value in values:
+        running.add(value)
+    assert running.mean == pytest.approx(values.mean())
+    assert running.variance == pytest.approx(values.var(ddof=1))
+    assert running.half_width(0.95) == pytest.approx(1.959964 * values.std(ddof=1) / 10, rel=1e-5)
+    assert running.half_width(0.99) > running.half_width(0.95)
+
+
+def test_early_stop():
+    payload = make_payload(1000)
+    under_test = SimpleNamespace(metric=LengthScore())
+    (utterance, system), approximation = compute_progressive(under_test, payload, tolerance=10.0)
+    # stopped at the least number of examples.
+    assert approximation['num_examples'] == len(utterance) == 200
+    assert approximation['total_examples'] == 1000 and approximation['ci_half_width'] < 10.0
+    # the scores of the subset, in the original order.
+    indices = approximation['indices']
+    assert indices == sorted(indices)
+    assert utterance == [len(payload['responses'][i]) for i in indices]
+    assert system == pytest.approx(np.mean(utterance))
+    assert abs(system - np.mean(LengthScore().score_utterance(**payload))) < 10.0
+    # the same seed, the same subset.
+    assert compute_progressive(under_test, payload, tolerance=10.0)[1] == approximation
+    assert compute_progressive(under_test, payload, tolerance=10.0, seed=1)[1]['indices'] != indices
+
+
+def test_exact_when_too_strict():
+    payload = make_payload(250)
+    under_test = SimpleNamespace(metric=LengthScore())
+    (utterance, system), approximation = compute_progressive(under_test, payload, tolerance=1e-6)
+    assert approximation['num_examples'] == 250
+    assert utterance == LengthScore().score_utterance(**payload)
+
+
+def test_utterance_field():
+    class F1Score(LengthScore):
+        utterance_field = 'f1'
+
+        def score_utterance(self, responses):
+            return [Score(1.0 / (1 + len(tokens)), len(tokens)) for tokens in responses]
+
+        def score_system(self, utterance, responses):
+            return None
+
+    under_test = SimpleNamespace(metric=F1Score())
+    (utterance, system), approximation = compute_progressive(under_test, make_payload(300), tolerance=1.0)
+    assert len(utterance) == 200 and system is None
+    assert all(isinstance(score, Score) for score in utterance)
+
+
+def test_take():
+    sentences = [['a', 'b'], [], ['c']]
+    assert take(sentences, [2, 0]) == [['c'], ['a', 'b']]
+    vocab = Vocabulary()
+    corpus = TokenIdCorpus.from_token_lists(sentences, vocab)
+    taken = take(corpus, [2, 0])
+    assert isinstance(taken, TokenIdCorpus) and [vocab.decode(ids) for ids in taken] == [['c'], ['a', 'b']]
+
+
+def test_can_progress():
+    assert can_progress(SimpleNamespace(metric=LengthScore()))
+    for attrs in (dict(mean_system=False), dict(shard_keys=()), dict(utterance_field=lambda score: score)):
+        metric = LengthScore()
+        metric.__dict__.update(attrs)
+        assert not can_progress(SimpleNamespace(metric=metric))
+
+
+def test_engine_tolerance(tmp_path, toy_config):
+    pytest.importorskip('embedding_based')
+    pytest.importorskip('lsdscc')
+    from eval import metrics
+    from eval.engine import Engine
+
+    config = toy_config([metrics.UtteranceLenScore()] + list(metrics.DistinctScore.parse_config(dict(n=[1]))))
+    save_dir = tmp_path.joinpath('save')
+    save_dir.mkdir()
+    engine = Engine(config, save_dir, tolerance=0.5)
+    engine.run()
+    output = json.loads(save_dir.joinpath('hred-toy-utterance_len.json').read_text())
+    assert output['approximation']['total_examples'] == 20
+    # distinct-n is a corpus-level score, computed exactly.
+    assert 'approximation' not in json.loads(save_dir.joinpath('hred-toy-distinct_1.json').read_text())
+    # approximate outputs are up to date for a tolerance as large, and not for an exact run.
+    assert Engine(config, save_dir, tolerance=0.5).get_outdated() == []
+    assert len(Engine(config, save_dir).get_outdated()) == 2
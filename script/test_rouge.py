@@ -0,0 +1,63 @@
+"""
+ROUGE-N of eval.rouge_engine, from the clipped matches of BLEU and the reference n-gram index,
+against the n-gram overlaps counted directly and the rouge package.
+"""
+import collections
+import random
+
+import pytest
+
+from eval import rouge_engine
+from eval.ngram_index import NgramIndex
+from eval.rouge_engine import OverlapStats
+
+
+def make_sentences(seed, size=200, vocab_size=6, max_len=15):
+    rng = random.Random(seed)
+    return [[str(rng.randrange(vocab_size)) for _ in range(rng.randrange(max_len))] for _ in range(size)]
+
+
+def count_ngrams(tokens, n):
+    return collections.Counter(tuple(tokens[i:i + n]) for i in range(len(tokens) - n + 1))
+
+
+def reference_overlap_stats(summary, reference, n):
+    summary_counts, reference_counts = count_ngrams(summary, n), count_ngrams(reference, n)
+    return OverlapStats(sum((summary_counts & reference_counts).values()), sum(summary_counts.values()),
+                        sum(reference_counts.values()))
+
+
+@pytest.mark.parametrize('n', [1, 2, 3, 4])
+def test_overlap_stats(n):
+    for summary, reference in zip(make_sentences(seed=0), make_sentences(seed=1)):
+        score = rouge_engine.rouge_n_sentence_level(summary, reference, n)
+        assert score.stats == reference_overlap_stats(summary, reference, n)
+
+
+@pytest.mark.parametrize('n', [1, 2, 4])
+def test_index_overlap_stats(n):
+    summaries, references = make_sentences(seed=2), make_sentences(seed=3)
+    pair_stats = NgramIndex.build(references).get_pair_stats(summaries)
+    for stats, summary, reference in zip(pair_stats, summaries, references):
+        assert rouge_engine.get_overlap_stats(stats, n) == reference_overlap_stats(summary, reference, n)
+
+
+def test_corpus_level():
+    summaries, references = make_sentences(seed=4), make_sentences(seed=5)
+    utterance = [rouge_engine.rouge_n_sentence_level(s, r, 2, alpha=0.9) for s, r in zip(summaries, references)]
+    total = rouge_engine.rouge_n_corpus_level(utterance, alpha=0.9)
+    overlap = sum(score.stats.overlap for score in utterance)
+    assert total.precision == overlap / sum(score.stats.hyp_count for score in utterance)
+    assert total.recall == overlap / sum(score.stats.ref_count for score in utterance)
+    assert total.f1_measure == rouge_engine.f_measure(total.precision, total.recall, 0.9)
+
+
+@pytest.mark.parametrize('alpha', [0.5, 0.9])
+@pytest.mark.parametrize('n', [1, 2, 3])
+def test_rouge_n(n, alpha):
+    rouge = pytest.importorskip('rouge')
+    for summary, reference in zip(make_sentences(seed=6), make_sentences(seed=7)):
+        expected = rouge.rouge_n_sentence_level(summary, reference, n=n, alpha=alpha)
+        got = rouge_engine.rouge_n_sentence_level(summary, reference, n, alpha=alpha)
+        assert (got.precision, got.recall, got.f1_measure) == pytest.approx(
+            (expected.precision, expected.recall, expected.f1_measure))
@@ -0,0 +1,70 @@
+"""
+The alpha sweep of eval.rouge_sweep over the stats saved by the Exporter, against ROUGE scored directly by
+eval.rouge_engine at the same alpha.
+"""
+import functools
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from eval import rouge_engine, rouge_sweep
+from eval.consts import STATS_DIR
+from eval.exporter import Exporter
+
+ALPHAS = [0.1, 0.5, 0.9]
+
+
+def make_sentences(seed, size=100, vocab_size=8, max_len=15):
+    rng = random.Random(seed)
+    return [[str(rng.randrange(vocab_size)) for _ in range(rng.randrange(max_len))] for _ in range(size)]
+
+
+def get_variants():
+    # variant, params, sentence level and system level with the params of the metric.
+    return [
+        ('rouge_n', dict(n=2), functools.partial(rouge_engine.rouge_n_sentence_level, n=2),
+         rouge_engine.rouge_n_corpus_level),
+        ('rouge_l', dict(), rouge_engine.rouge_l_sentence_level, rouge_engine.rouge_l_pooled_level),
+        ('rouge_w', dict(weight=2.0), functools.partial(rouge_engine.rouge_w_sentence_level, weight=2.0),
+         functools.partial(rouge_engine.rouge_w_pooled_level, weight=2.0)),
+    ]
+
+
+def save_stats(save_dir, variant, params, sentence_level):
+    # the attributes of a RougeScore that the stats meta records.
+    metric = SimpleNamespace(variant=variant, params=dict(params, alpha=None), stats_field='stats')
+    under_test = SimpleNamespace(metric=metric, metric_name=variant, prefix='model-dataset-{}'.format(variant))
+    summaries, references = make_sentences(seed=0), make_sentences(seed=1)
+    utterance = [sentence_level(s, r) for s, r in zip(summaries, references)]
+    Exporter(save_dir).export_stats((utterance, None), under_test)
+    return under_test.prefix, summaries, references
+
+
+@pytest.mark.parametrize('variant, params, sentence_level, system_level', get_variants(),
+                         ids=[variant[0] for variant in get_variants()])
+def test_sweep(tmp_path, variant, params, sentence_level, system_level):
+    prefix, summaries, references = save_stats(tmp_path, variant, params, sentence_level)
+    assert [path.name for path in tmp_path.joinpath(STATS_DIR).iterdir()] == [prefix + '.npz']
+    results = rouge_sweep.sweep(tmp_path, prefix, ALPHAS)
+    assert [result['alpha'] for result in results] == ALPHAS
+    for result in results:
+        alpha = result['alpha']
+        expected = [sentence_level(s, r, alpha=alpha) for s, r in zip(summaries, references)]
+        assert result['utterance'] == pytest.approx([score.f1_measure for score in expected])
+        system = system_level(expected, alpha=alpha)
+        assert result['system'][:3] == pytest.approx(system[:3])
+
+
+def test_sweep_weight(tmp_path):
+    _, params, sentence_level, _ = get_variants()[2]
+    prefix, _, _ = save_stats(tmp_path, 'rouge_w', params, sentence_level)
+    assert [result['weight'] for result in rouge_sweep.sweep(tmp_path, prefix, [0.5], [None, 2.0])] == [2.0, 2.0]
+    # the WLCS depends on the weight.
+    with pytest.raises(ValueError):
+        rouge_sweep.sweep(tmp_path, prefix, [0.5], [1.2])
+
+
+def test_no_stats(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        rouge_sweep.sweep(tmp_path, 'model-dataset-rouge_l', [0.5])
@@ -0,0 +1,131 @@
+"""
+The cost model of eval.scheduler over the run history of eval.history, the longest-first scheduling of
+parallel runs within a memory budget, and the peak memory measured by eval.utils.MemorySampler.
+"""
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from eval.history import RunHistory
+from eval.scheduler import CORPUS_SIZE, HISTORY, CostModel, Scheduler
+from eval.utils import MemorySampler
+
+
+class ToyUnderTest:
+    # hashable, as the scheduler keys its estimates by under_test.
+
+    def __init__(self, metric_name, responses, cost_per_example):
+        self.metric = SimpleNamespace(cost_per_example=cost_per_example)
+        self.metric_name = metric_name
+        self.dataset_name = 'dataset'
+        self.model = SimpleNamespace(responses=responses)
+
+
+def make_under_test(tmp_path, metric_name, num_examples, cost_per_example=1e-4):
+    responses = tmp_path.joinpath('{}.txt'.format(metric_name))
+    responses.write_text('a\n' * num_examples)
+    return ToyUnderTest(metric_name, str(responses), cost_per_example)
+
+
+def make_stats(seconds, num_examples, peak_memory=None):
+    return dict(load_seconds=seconds / 2, compute_seconds=seconds / 2, num_examples=num_examples,
+                peak_memory=peak_memory)
+
+
+class FakeLoader:
+    # the memory of an under_test is the size of its resources.
+
+    def __init__(self, sizes):
+        self.sizes = sizes
+
+    def get_resource_keys(self, under_test):
+        return [under_test.metric_name]
+
+    def estimate_size(self, key):
+        return self.sizes.get(key, 0)
+
+
+def test_history(tmp_path):
+    under_test = make_under_test(tmp_path, 'bleu', 10)
+    history = RunHistory(tmp_path)
+    assert history.get_seconds_per_example(under_test) is None
+    history.record(under_test, make_stats(2.0, 10, peak_memory=100))
+    history.record(under_test, make_stats(4.0, 20, peak_memory=50))
+    # the history persists.
+    history = RunHistory(tmp_path)
+    assert history.get_seconds_per_example(under_test) == pytest.approx(0.2)
+    assert history.get_peak_memory(under_test) == 100
+    assert history.entries['bleu/dataset']['runs'] == 2
+
+
+def test_cost_model(tmp_path):
+    history = RunHistory(tmp_path)
+    cost_model = CostModel(history, FakeLoader(dict(bleu=1000)))
+    under_test = make_under_test(tmp_path, 'bleu', 10, cost_per_example=0.5)
+    assert cost_model.estimate_seconds(under_test) == (5.0, CORPUS_SIZE)
+    assert cost_model.estimate_memory(under_test) == 1000
+    history.record(under_test, make_stats(1.0, 100, peak_memory=300))
+    assert cost_model.estimate_seconds(under_test) == (pytest.approx(0.1), HISTORY)
+    assert cost_model.estimate_memory(under_test) == 300
+    # a model without responses on disk.
+    under_test.model.responses = str(tmp_path.joinpath('missing.txt'))
+    assert cost_model.estimate_seconds(under_test) == (None, None)
+
+
+def make_scheduler(tmp_path, sizes, jobs, max_memory=None):
+    # the seconds of an under_test are its number of examples.
+    under_tests = [make_under_test(tmp_path, name, num_examples, cost_per_example=1.0)
+                   for name, num_examples in [('short', 1), ('long', 3), ('medium', 2)]]
+    return Scheduler(CostModel(RunHistory(tmp_path), FakeLoader(sizes)), under_tests, jobs, max_memory)
+
+
+def get_names(scheduler):
+    names = []
+    under_test = scheduler.next()
+    while under_test is not None:
+        names.append(under_test.metric_name)
+        under_test = scheduler.next()
+    return names
+
+
+def test_longest_first(tmp_path):
+    scheduler = make_scheduler(tmp_path, {}, jobs=2)
+    assert scheduler.eta() == pytest.approx(3.0)
+    long, medium = scheduler.pending[:2]
+    assert get_names(scheduler) == ['long', 'medium']
+    scheduler.done(long)
+    assert get_names(scheduler) == ['short']
+    scheduler.done(medium)
+    assert scheduler.num_done == 2 and get_names(scheduler) == []
+
+
+def test_memory_budget(tmp_path):
+    sizes = dict(long=60, medium=50, short=30)
+    scheduler = make_scheduler(tmp_path, sizes, jobs=3, max_memory=100)
+    # medium does not fit next to long, but short does.
+    assert get_names(scheduler) == ['long', 'short']
+    assert scheduler.running_memory == 90
+    for under_test in list(scheduler.running):
+        scheduler.done(under_test)
+    assert get_names(scheduler) == ['medium']
+
+
+def test_too_large_runs_alone(tmp_path):
+    scheduler = make_scheduler(tmp_path, dict(long=500, medium=10, short=10), jobs=2, max_memory=100)
+    assert get_names(scheduler) == ['long']
+    scheduler.done(next(iter(scheduler.running)))
+    assert get_names(scheduler) == ['medium', 'short']
+
+
+def test_memory_sampler():
+    with MemorySampler(interval=0.01) as memory:
+        data = np.ones(50 * 1024 * 1024, dtype=np.uint8)
+        time.sleep(0.05)
+    del data
+    # the peak of the block, not of the process.
+    assert 40 * 1024 * 1024 < memory.peak < 200 * 1024 * 1024
+    with MemorySampler(interval=0.01) as memory:
+        pass
+    assert memory.peak < 10 * 1024 * 1024
@@ -0,0 +1,89 @@
+"""
+The Self-BLEU of eval.self_bleu against nltk's sentence_bleu of every response with all the others as references,
+and its sampled mode.
+"""
+import random
+import warnings
+
+import numpy as np
+import pytest
+from nltk.translate.bleu_score import SmoothingFunction, sentence_bleu
+
+from eval import bleu, self_bleu
+
+
+def make_sentences(seed, size=60, vocab_size=6, max_len=12):
+    rng = random.Random(seed)
+    return [[str(rng.randrange(vocab_size)) for _ in range(rng.randrange(max_len))] for _ in range(size)]
+
+
+def reference_pair_stats(sentences, max_order):
+    return [bleu.get_pair_stats(sentences[:i] + sentences[i + 1:], sentence, max_order)
+            for i, sentence in enumerate(sentences)]
+
+
+@pytest.mark.parametrize('max_order', [2, 4, 5])
+def test_pair_stats(max_order):
+    sentences = make_sentences(seed=max_order)
+    assert self_bleu.get_self_pair_stats(sentences, max_order) == reference_pair_stats(sentences, max_order)
+
+
+def test_pair_stats_lookup():
+    sentences = make_sentences(seed=0)
+    index = self_bleu.SelfBleuIndex(sentences, 4)
+    expected = reference_pair_stats(sentences, 4)
+    indices = [5, 0, 59, 5, 17]
+    assert index.get_pair_stats(np.array(indices)) == [expected[i] for i in indices]
+    assert index.get_pair_stats(np.zeros(0, dtype=np.int64)) == []
+
+
+def test_duplicates():
+    # the largest count of an n-gram is shared by two sentences, and a sentence has no other of its length.
+    sentences = [['a', 'b'], ['a', 'b'], ['a', 'a', 'b'], ['c'], []]
+    assert self_bleu.get_self_pair_stats(sentences, 2) == reference_pair_stats(sentences, 2)
+
+
+@pytest.mark.parametrize('method', [0, 1, 3, 7])
+def test_sentence_bleu(method):
+    sentences = make_sentences(seed=10 + method)
+    smoothing_function = getattr(SmoothingFunction(), 'method{}'.format(method))
+    max_order = bleu.get_max_order(2, method)
+    weights = bleu.get_weights(2)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        expected = [sentence_bleu(sentences[:i] + sentences[i + 1:], sentence, weights, smoothing_function)
+                    for i, sentence in enumerate(sentences)]
+    stats = self_bleu.get_self_pair_stats(sentences, max_order)
+    assert [bleu.sentence_bleu(s, weights, method) for s in stats] == expected
+
+
+def test_sample_scores():
+    sentences = make_sentences(seed=20, size=500)
+    index = self_bleu.SelfBleuIndex(sentences, 4)
+    weights = bleu.get_weights(4)
+
+    def score_fn(stats):
+        return bleu.sentence_bleu(stats, weights, 1)
+
+    full = [score_fn(stats) for stats in index.get_pair_stats(np.arange(len(index)))]
+    utterance, approximation = self_bleu.sample_scores(index, score_fn, tolerance=0.05, batch_size=50,
+                                                       min_examples=100)
+    indices = approximation['indices']
+    assert indices == sorted(set(indices))
+    assert approximation['num_examples'] == len(indices) == len(utterance)
+    assert approximation['total_examples'] == len(sentences)
+    assert 100 <= len(indices) < len(sentences)
+    assert approximation['ci_half_width'] < 0.05
+    # each sampled response is scored against all the others.
+    assert utterance == [full[i] for i in indices]
+    assert self_bleu.sample_scores(index, score_fn, tolerance=0.05, batch_size=50, min_examples=100)[1] == \
+        approximation
+
+
+def test_sample_all():
+    sentences = make_sentences(seed=21, size=30)
+    index = self_bleu.SelfBleuIndex(sentences, 4)
+    # a zero tolerance is never met, so every response is scored.
+    utterance, approximation = self_bleu.sample_scores(index, lambda stats: stats.hyp_len, tolerance=0.0)
+    assert approximation['indices'] == list(range(len(sentences)))
+    assert utterance == [len(sentence) for sentence in sentences]
@@ -0,0 +1,85 @@
+"""
+The scoring server of eval.server on a Unix socket: the metrics and files it serves, and the RemoteEvaluator
+dispatching to it.
+"""
+import json
+import threading
+
+import pytest
+
+pytest.importorskip('embedding_based')
+pytest.importorskip('lsdscc')
+
+from eval import metrics
+from eval.engine import Evaluator
+from eval.exporter import Exporter
+from eval.loader import ResourceLoader
+from eval.models import Model
+from eval.server import ForbiddenError, RemoteEvaluator, ScoringClient, ScoringService, make_server
+from eval.utils import Dataset, UnderTest
+
+
+class EchoScore(metrics.SubprocessMetric):
+    name = 'echo'
+    requires = {metrics.RESPONSES: 'filename'}
+    external_tool = 'echo'
+
+    def get_command(self, responses):
+        return 'echo {}'.format(responses)
+
+
+@pytest.fixture
+def toy(tmp_path):
+    responses = tmp_path.joinpath('responses.txt')
+    responses.write_text('a b c\nd\n\ne f\n')
+    other = tmp_path.joinpath('other.txt')
+    other.write_text('a\n')
+    dataset = Dataset('toy', str(tmp_path.joinpath('contexts.txt')), str(tmp_path.joinpath('references.txt')))
+    return Model('model', 'toy', str(responses)), Model('other', 'toy', str(other)), dataset
+
+
+@pytest.fixture
+def client(tmp_path, toy):
+    model, _, dataset = toy
+    service = ScoringService([metrics.UtteranceLenScore(), EchoScore()], [model], [dataset])
+    server = make_server(service, str(tmp_path.joinpath('server.sock')))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield ScoringClient(str(tmp_path.joinpath('server.sock')))
+    server.shutdown()
+    server.server_close()
+
+
+def test_no_subprocess_metrics(client):
+    assert client.metrics() == ['utterance_len']
+
+
+def test_evaluate(client, toy):
+    model, other, dataset = toy
+    response = client.evaluate(UnderTest(metrics.UtteranceLenScore(), model, dataset))
+    assert response['result']['utterance'] == [3, 1, 0, 2]
+    # only the files of the config are read.
+    with pytest.raises(ForbiddenError):
+        client.evaluate(UnderTest(metrics.UtteranceLenScore(), other, dataset))
+    moved = Model('model', 'toy', '/etc/passwd')
+    with pytest.raises(ForbiddenError):
+        client.evaluate(UnderTest(metrics.UtteranceLenScore(), moved, dataset))
+
+
+def test_remote_evaluator(tmp_path, client, toy):
+    model, other, dataset = toy
+    local = Evaluator(Exporter(tmp_path), ResourceLoader(), shard_size=3)
+    evaluator = RemoteEvaluator(client, local)
+    assert evaluator.loader is local.loader
+    served = UnderTest(metrics.UtteranceLenScore(), model, dataset)
+    assert evaluator.is_remote(served)
+    assert evaluator(served)['load_seconds'] == 0.0
+    # a model the server does not know runs locally.
+    unknown = UnderTest(metrics.UtteranceLenScore(), other, dataset)
+    assert evaluator(unknown)['load_seconds'] > 0.0
+    for under_test, expected in ((served, [3, 1, 0, 2]), (unknown, [1])):
+        result = json.loads(Exporter(tmp_path).get_output_path(under_test).read_text())
+        assert result['utterance'] == expected
+    # the shards run locally.
+    assert evaluator.count_shards(served) == 2
+    assert evaluator.evaluate_shard(served, 1)['num_examples'] == 1
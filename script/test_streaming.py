@@ -0,0 +1,126 @@
+"""
+Streaming of eval.loader: the aligned batches of the corpora, and the metrics fed batch by batch with init(),
+update() and finalize() against the same metrics computed on the whole corpora.
+"""
+import random
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('embedding_based')
+pytest.importorskip('lsdscc')
+
+from eval import metrics
+from eval.corpus import TokenIdCorpus
+from eval.loader import ResourceLoader
+
+NUM_LINES = 50
+
+
+def write_corpus(filename, seed, num_lines=NUM_LINES):
+    rng = random.Random(seed)
+    lines = [' '.join(str(rng.randrange(8)) for _ in range(rng.randrange(11))) for _ in range(num_lines)]
+    filename.write_text(''.join(line + '\n' for line in lines))
+    return [line.split() for line in lines]
+
+
+def make_under_test(tmp_path, metric, num_references=NUM_LINES):
+    responses = write_corpus(tmp_path.joinpath('responses.txt'), seed=0)
+    references = write_corpus(tmp_path.joinpath('references.txt'), seed=1, num_lines=num_references)
+    sources = {'model.responses': str(tmp_path.joinpath('responses.txt')),
+               'dataset.references': str(tmp_path.joinpath('references.txt'))}
+    under_test = SimpleNamespace(metric=metric, dataset_name='dataset', get_resource_file=sources.get)
+    return under_test, responses, references
+
+
+def test_iter_batches(tmp_path):
+    metric = SimpleNamespace(requires={'responses': 'token_list', 'references': 'token_ids'})
+    under_test, responses, references = make_under_test(tmp_path, metric)
+    loader = ResourceLoader()
+    batches = list(loader.iter_batches(under_test, ('responses', 'references'), 7))
+    assert [len(batch['responses']) for batch in batches] == [7] * 7 + [1]
+    assert [tokens for batch in batches for tokens in batch['responses']] == responses
+    vocab = loader.get_vocab(under_test)
+    for batch in batches:
+        # the batches of token ids share the vocabulary of the dataset.
+        assert isinstance(batch['references'], TokenIdCorpus) and batch['references'].vocab is vocab
+    assert [vocab.decode(ids) for batch in batches for ids in batch['references']] == references
+
+
+def test_parse_lines(tmp_path):
+    metric = SimpleNamespace(requires={'responses': 'token_list', 'references': 'token_ids'})
+    under_test, _, _ = make_under_test(tmp_path, metric)
+    loader = ResourceLoader()
+    batch = loader.parse_lines('references', under_test, ['a b', '', 'b c'])
+    assert [loader.get_vocab(under_test).decode(ids) for ids in batch] == [['a', 'b'], [], ['b', 'c']]
+    assert loader.parse_lines('responses', under_test, ['a b']) == [['a', 'b']]
+
+
+def test_not_aligned(tmp_path):
+    metric = SimpleNamespace(requires={'responses': 'token_list', 'references': 'token_list'})
+    under_test, _, _ = make_under_test(tmp_path, metric, num_references=NUM_LINES - 1)
+    with pytest.raises(ValueError):
+        list(ResourceLoader().iter_batches(under_test, ('responses', 'references'), 7))
+
+
+def get_streaming_metrics():
+    metrics_list = []
+    configs = [
+        (metrics.BleuScore, dict(n=[1, 2, 4], smoothing=True)),
+        (metrics.BleuScore, dict(n=[4], smoothing=7)),
+        (metrics.RougeScore, dict(variants=['rouge_n', 'rouge_l', 'rouge_w'], n=[1, 2])),
+        (metrics.DistinctScore, dict(n=[1, 2])),
+        (metrics.DistinctScore, dict(n=[2], precision=10)),
+        (metrics.EntropyScore, dict(n=[1, 3])),
+        (metrics.UtteranceLenScore, dict()),
+    ]
+    for cls, config in configs:
+        metrics_list.extend(cls.parse_config(config))
+    return metrics_list
+
+
+@pytest.mark.parametrize('metric', get_streaming_metrics(), ids=lambda metric: metric.fullname)
+@pytest.mark.parametrize('batch_size', [1, 7, 100])
+def test_streaming_metric(tmp_path, metric, batch_size):
+    assert metric.streaming
+    under_test, _, _ = make_under_test(tmp_path, metric)
+    loader = ResourceLoader()
+    assert loader.can_stream(under_test, metric.shard_keys)
+    expected_utterance, expected_system = metric(**loader.load_resources(under_test))
+
+    resources = loader.load_resources(under_test, skip=metric.shard_keys)
+    state = metric.init(**resources)
+    utterance = []
+    for batch in loader.iter_batches(under_test, metric.shard_keys, batch_size):
+        utterance.extend(metric.update(state, **batch, **resources))
+    system = metric.finalize(state, utterance)
+
+    if metric.utterance_field is None:
+        assert utterance == pytest.approx(expected_utterance)
+    else:
+        # the scores with their stats.
+        assert utterance == expected_utterance
+    if expected_system is None:
+        assert system is None
+    elif isinstance(expected_system, float):
+        assert system == pytest.approx(expected_system)
+    else:
+        assert system == expected_system
+
+
+def test_embedding_based():
+    def sentence_level(hypothesis, reference, embeddings):
+        return sum(embeddings[token] for token in hypothesis) - len(reference)
+
+    metric = metrics.EmbeddingBasedScore('vector_average', 'embeddings.bin', sentence_level)
+    responses, references = [['a', 'b'], ['b'], []], [['a'], ['a', 'b'], ['b']]
+    embeddings = dict(a=1.0, b=2.0)
+    utterance, system = metric(responses, references, embeddings)
+    assert utterance == [2.0, 0.0, -1.0]
+    assert system == metrics.MeanScore(pytest.approx(1 / 3))
+    # sharded or streamed, the system score is the mean of all the sentence scores.
+    state = metric.init()
+    streamed = metric.update(state, responses[:2], references[:2], embeddings)
+    streamed += metric.update(state, responses[2:], references[2:], embeddings)
+    assert streamed == utterance
+    assert metric.finalize(state, streamed) == system
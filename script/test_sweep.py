@@ -0,0 +1,92 @@
+"""
+The checkpoint sweep of eval.sweep: finding the checkpoints of Serban models with their responses,
+and the table of their system scores in training order.
+"""
+import os
+import shutil
+
+import pytest
+
+from eval import sweep
+from eval.models import SerbanModel
+from eval.sweep import SWEEP_TABLE, find_sweep_models, format_sweep_table
+
+
+def make_checkpoint(model_dir, checkpoint_id, mtime, suffixes=('_model.npz', '_timing.npz', '_state.pkl')):
+    for suffix in suffixes:
+        filename = model_dir.joinpath(checkpoint_id + suffix)
+        filename.write_bytes(b'')
+        os.utime(filename, (mtime, mtime))
+
+
+@pytest.fixture
+def model_dir(tmp_path):
+    model_dir = tmp_path.joinpath('models', 'toy', 'HRED')
+    model_dir.mkdir(parents=True)
+    make_checkpoint(model_dir, 'hred_auto_1.5', 1000)
+    make_checkpoint(model_dir, 'hred', 3000)
+    make_checkpoint(model_dir, 'hred_auto_2', 2000)
+    # still being saved.
+    make_checkpoint(model_dir, 'hred_auto_3', 4000, suffixes=('_model.npz',))
+    return model_dir
+
+
+def write_responses(model, source):
+    shutil.copy(source, str(model.responses))
+
+
+def test_find_sweep_models(tmp_path, model_dir, monkeypatch):
+    assert find_sweep_models([model_dir], sample=False) == []
+    sampled = []
+    monkeypatch.setattr(SerbanModel, 'sample', lambda model: sampled.append(model.name))
+    models = find_sweep_models([model_dir])
+    # in training order, and with names fit for the prefixes of under_tests.
+    assert [model.name for model in models] == ['hred@hred_auto_1_5', 'hred@hred_auto_2', 'hred@hred']
+    assert sampled == [model.name for model in models]
+    assert all(model.trained_on == 'toy' and model.base_name == 'hred' for model in models)
+    assert models[0].responses == model_dir.joinpath('hred_auto_1.5_output.txt')
+    assert models[0].prototype == 'prototype_toy_HRED'
+
+    models[1].responses.write_text('a\n')
+    assert [model.name for model in find_sweep_models([model_dir], sample=False)] == ['hred@hred_auto_2']
+
+
+def test_format_sweep_table():
+    models = []
+    for checkpoint in ('hred_auto_1', 'hred'):
+        model = SerbanModel(name='hred@' + checkpoint, trained_on='toy', responses=None)
+        model.base_name, model.checkpoint = 'hred', checkpoint
+        models.append(model)
+    first, last = models
+    scores = {first: dict(bleu=0.123456, rouge=dict(f1=0.5, p=0.25)), last: dict(bleu=0.5)}
+    assert format_sweep_table(scores).splitlines() == [
+        'model\tdataset\tcheckpoint\tbleu\trouge',
+        'hred\ttoy\thred_auto_1\t0.1235\t{"f1": 0.5, "p": 0.25}',
+        # a metric that did not run on a checkpoint.
+        'hred\ttoy\thred\t0.5000\t-',
+    ]
+
+
+def test_sweep(tmp_path, model_dir, toy_config, monkeypatch):
+    pytest.importorskip('embedding_based')
+    pytest.importorskip('lsdscc')
+    from eval import metrics
+    from eval.engine import Engine
+
+    data_dir = tmp_path.joinpath('data')
+    sources = [data_dir.joinpath('hred.txt'), data_dir.joinpath('lstm.txt'), data_dir.joinpath('hred.txt')]
+    monkeypatch.setattr(SerbanModel, 'sample', lambda model: write_responses(model, sources.pop(0)))
+    models = find_sweep_models([model_dir])
+    config = dict(toy_config([metrics.UtteranceLenScore()] + list(metrics.DistinctScore.parse_config(dict(n=[1])))),
+                  models=models)
+    save_dir = tmp_path.joinpath('save')
+    save_dir.mkdir()
+    table = sweep.sweep(Engine(config, save_dir), models)
+    assert save_dir.joinpath(SWEEP_TABLE).read_text() == table + '\n'
+    rows = [line.split('\t') for line in table.splitlines()]
+    assert rows[0] == ['model', 'dataset', 'checkpoint', 'distinct_1', 'utterance_len']
+    assert [row[:3] for row in rows[1:]] == [['hred', 'toy', 'hred_auto_1_5'], ['hred', 'toy', 'hred_auto_2'],
+                                             ['hred', 'toy', 'hred']]
+    # the first and last checkpoints have the same responses.
+    assert rows[1][3:] == rows[3][3:] != rows[2][3:]
+    assert all(len(cell.split('.')[-1]) == 4 for row in rows[1:] for cell in row[3:])
@@ -0,0 +1,97 @@
+"""
+The event log of eval.telemetry: the events of a run, and the comparison of two runs by metric.
+"""
+import concurrent.futures
+from types import SimpleNamespace
+
+import pytest
+
+from eval.telemetry import Telemetry, compare_runs, find_runs, load_events, summarize_run
+
+
+def make_under_test(model='model', metric='bleu'):
+    return SimpleNamespace(prefix='{}-dataset-{}'.format(model, metric), model_name=model, dataset_name='dataset',
+                           metric_name=metric)
+
+
+def make_stats(compute_seconds, num_examples=100):
+    return dict(load_seconds=0.5, compute_seconds=compute_seconds, export_seconds=0.1, num_examples=num_examples,
+                cache_hits=1, cache_misses=2, output_bytes=1000, peak_memory=None, approximate=False)
+
+
+def record_run(telemetry, seconds_by_metric):
+    telemetry.start_run(jobs=1)
+    for metric, seconds in seconds_by_metric.items():
+        telemetry.finished(make_under_test(metric=metric), make_stats(seconds))
+    telemetry.end_run()
+    return load_events(telemetry.path)
+
+
+def test_events(tmp_path):
+    telemetry = Telemetry(tmp_path)
+    # dropped until a run starts.
+    telemetry.skip(make_under_test(), 'up to date')
+    telemetry.start_run(jobs=2, force=False)
+    telemetry.skip(make_under_test(), 'up to date')
+    telemetry.failed(make_under_test(metric='rouge'), 'RuntimeError()')
+    telemetry.finished(make_under_test(metric='distinct'), make_stats(2.0))
+    telemetry.end_run()
+    events = load_events(telemetry.path)
+    assert [event['event'] for event in events] == ['run_start', 'skip', 'failed', 'under_test', 'run_end']
+    assert len({event['run'] for event in events}) == 1
+    assert events[0]['jobs'] == 2 and 'version' in events[0]
+    assert events[1] == dict(events[1], under_test='model-dataset-bleu', reason='up to date')
+    finished = events[3]
+    assert (finished['model'], finished['dataset'], finished['metric']) == ('model', 'dataset', 'distinct')
+    assert finished['examples_per_second'] == 50.0 and finished['cache_misses'] == 2
+    assert events[4]['skip'] == events[4]['failed'] == events[4]['under_test'] == 1
+
+
+def test_concurrent_emit(tmp_path):
+    telemetry = Telemetry(tmp_path)
+    telemetry.start_run()
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        list(executor.map(lambda i: telemetry.finished(make_under_test(model=str(i)), make_stats(1.0)), range(200)))
+    telemetry.end_run()
+    events = load_events(telemetry.path)
+    assert len(events) == 202 and events[-1]['under_test'] == 200
+
+
+def test_compare_runs(tmp_path):
+    telemetry = Telemetry(tmp_path)
+    old = record_run(telemetry, dict(bleu=1.0, rouge=2.0, meteor=1.0))
+    new = record_run(telemetry, dict(bleu=1.1, rouge=3.0, distinct=1.0))
+    assert summarize_run(new)['rouge']['compute_seconds'] == 3.0
+    lines = compare_runs(old, new, threshold=1.2).splitlines()
+    rows = {line.split()[0]: line for line in lines[1:] if line and not line.startswith(('wall', '1 '))}
+    assert rows['rouge'].endswith('REGRESSION') and '1.50' in rows['rouge']
+    assert not rows['bleu'].endswith('REGRESSION')
+    assert rows['meteor'].endswith('only in the old run') and rows['distinct'].endswith('only in the new run')
+    assert lines[-2].startswith('wall time:')
+    assert lines[-1] == '1 regressions over 20%'
+
+
+def test_find_runs(tmp_path):
+    assert find_runs(tmp_path) == []
+    telemetry = Telemetry(tmp_path)
+    telemetry.start_run()
+    telemetry.end_run()
+    assert find_runs(tmp_path) == [telemetry.path]
+
+
+def test_engine_events(tmp_path, toy_config):
+    pytest.importorskip('embedding_based')
+    pytest.importorskip('lsdscc')
+    from eval import metrics
+    from eval.engine import Engine
+
+    save_dir = tmp_path.joinpath('save')
+    save_dir.mkdir()
+    engine = Engine(toy_config([metrics.UtteranceLenScore()]), save_dir)
+    engine.run()
+    engine.run()
+    first, second = [load_events(path) for path in find_runs(save_dir)]
+    assert [event['event'] for event in first] == ['run_start', 'under_test', 'under_test', 'run_end']
+    assert all(event['num_examples'] == 20 for event in first if event['event'] == 'under_test')
+    assert [event['event'] for event in second] == ['run_start', 'skip', 'skip', 'run_end']
+    assert second[-1]['skip'] == 2
@@ -0,0 +1,104 @@
+"""
+The watch mode of eval.watch: the under_tests affected by the input files that changed and settled,
+and the re-runs of the outdated ones with the resources kept resident.
+"""
+import json
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('embedding_based')
+pytest.importorskip('lsdscc')
+
+from eval import metrics, watch
+from eval.engine import Engine
+
+
+def make_engine(tmp_path, toy_config):
+    config = toy_config([metrics.UtteranceLenScore()] + list(metrics.BleuScore.parse_config(dict(n=[2]))))
+    save_dir = tmp_path.joinpath('save')
+    save_dir.mkdir()
+    return Engine(config, save_dir)
+
+
+def get_prefixes(under_tests):
+    return sorted(under_test.prefix for under_test in under_tests)
+
+
+def append_line(filename, line='x y z'):
+    with open(filename, 'a') as f:
+        f.write(line + '\n')
+
+
+def test_poll(tmp_path, toy_config):
+    engine = make_engine(tmp_path, toy_config)
+    data_dir = tmp_path.joinpath('data')
+    watcher = watch.Watcher(engine, settle_seconds=0)
+    assert watcher.poll() == []
+    append_line(data_dir.joinpath('hred.txt'))
+    assert get_prefixes(watcher.poll()) == ['hred-toy-bleu_2', 'hred-toy-utterance_len']
+    assert watcher.poll() == []
+    append_line(data_dir.joinpath('references.txt'))
+    assert get_prefixes(watcher.poll()) == ['hred-toy-bleu_2', 'lstm-toy-bleu_2']
+    # a removed file is reported when it is back.
+    os.rename(data_dir.joinpath('lstm.txt'), data_dir.joinpath('lstm.bak'))
+    assert watcher.poll() == []
+    os.rename(data_dir.joinpath('lstm.bak'), data_dir.joinpath('lstm.txt'))
+    assert get_prefixes(watcher.poll()) == ['lstm-toy-bleu_2', 'lstm-toy-utterance_len']
+
+
+def test_settle(tmp_path, toy_config):
+    engine = make_engine(tmp_path, toy_config)
+    hred = tmp_path.joinpath('data', 'hred.txt')
+    watcher = watch.Watcher(engine, settle_seconds=0.2)
+    append_line(hred)
+    assert watcher.poll() == []
+    time.sleep(0.1)
+    # still being written.
+    append_line(hred)
+    assert watcher.poll() == []
+    time.sleep(0.15)
+    assert watcher.poll() == []
+    time.sleep(0.1)
+    assert len(watcher.poll()) == 2
+
+
+def read_output(engine, prefix):
+    return json.loads(engine.exporter.save_dir.joinpath(prefix + '.json').read_text())
+
+
+def test_watch(tmp_path, toy_config, monkeypatch):
+    engine = make_engine(tmp_path, toy_config)
+    data_dir = tmp_path.joinpath('data')
+    steps = [
+        lambda: append_line(data_dir.joinpath('hred.txt'), 'a b c d e f g h i j k l'),
+        # touched, with the same content.
+        lambda: os.utime(data_dir.joinpath('lstm.txt'), ns=(0, time.time_ns() + 10 ** 9)),
+    ]
+
+    def sleep(seconds):
+        if not steps:
+            raise KeyboardInterrupt
+        steps.pop(0)()
+
+    monkeypatch.setattr(watch, 'time', SimpleNamespace(sleep=sleep, monotonic=time.monotonic))
+    runs = []
+    run_serial = engine.run_serial
+
+    def record_run(under_tests, keep_resources=False):
+        runs.append((get_prefixes(under_tests), engine.loader.cache_hits))
+        run_serial(under_tests, keep_resources)
+
+    monkeypatch.setattr(engine, 'run_serial', record_run)
+    watch.watch(engine, settle_seconds=0)
+    assert [prefixes for prefixes, _ in runs] == [
+        ['hred-toy-bleu_2', 'hred-toy-utterance_len', 'lstm-toy-bleu_2', 'lstm-toy-utterance_len'],
+        ['hred-toy-bleu_2', 'hred-toy-utterance_len'],
+        # lstm was only touched.
+        [],
+    ]
+    assert read_output(engine, 'hred-toy-utterance_len')['utterance'][-1] == 12
+    # the references stayed resident for the re-run.
+    assert engine.loader.cache_hits > runs[1][1]
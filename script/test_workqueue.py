@@ -0,0 +1,113 @@
+"""
+The shared-directory work queue of eval.workqueue: claims, leases, retries of failed items and merging.
+"""
+import concurrent.futures
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from eval import workqueue
+from eval.workqueue import DONE, FAILED, PENDING, RUNNING, WorkItem, WorkQueue
+
+
+def make_queue(tmp_path, num_items=3, lease_seconds=60):
+    queue = WorkQueue(tmp_path.joinpath('queue'), lease_seconds)
+    queue.publish([WorkItem('model-dataset-metric', i, num_items) for i in range(num_items)], dict(shard_size=2))
+    return queue
+
+
+def age(queue, state, item_id, seconds):
+    path = str(queue.get_path(state, item_id))
+    past = time.time() - seconds
+    os.utime(path, (past, past))
+
+
+def test_publish(tmp_path):
+    queue = make_queue(tmp_path)
+    assert queue.list(PENDING) == ['model-dataset-metric.000000', 'model-dataset-metric.000001',
+                                   'model-dataset-metric.000002']
+    assert queue.settings == dict(shard_size=2)
+    item = queue.claim('worker')
+    # publishing again leaves the claimed item alone.
+    queue.publish([WorkItem('model-dataset-metric', i, 3) for i in range(3)], dict(shard_size=2))
+    assert queue.list(RUNNING) == [item.id]
+    assert len(queue.list(PENDING)) == 2
+
+
+def test_claim_once(tmp_path):
+    queue = make_queue(tmp_path, num_items=20)
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        claims = list(executor.map(lambda i: queue.claim('worker{}'.format(i)), range(30)))
+    claimed = [item.id for item in claims if item is not None]
+    assert sorted(claimed) == queue.list(RUNNING)
+    assert len(claimed) == len(set(claimed)) == 20
+
+
+def test_fresh_claim_is_not_reclaimed(tmp_path):
+    queue = make_queue(tmp_path, num_items=1, lease_seconds=60)
+    # an item published long ago keeps its mtime through the rename of the claim.
+    age(queue, PENDING, queue.list(PENDING)[0], 3600)
+    move = queue.move
+
+    def move_then_reclaim(item_id, src, dst):
+        moved = move(item_id, src, dst)
+        if src == PENDING:
+            # another worker looks for expired leases before the claim is written.
+            queue.reclaim_expired()
+        return moved
+
+    queue.move = move_then_reclaim
+    item = queue.claim('worker')
+    queue.move = move
+    assert queue.list(RUNNING) == [item.id]
+    assert queue.read(RUNNING, item.id).worker == 'worker'
+
+
+def test_reclaim_expired(tmp_path):
+    queue = make_queue(tmp_path, num_items=1, lease_seconds=60)
+    item = queue.claim('worker')
+    age(queue, RUNNING, item.id, 120)
+    queue.reclaim_expired()
+    assert queue.list(PENDING) == [item.id]
+    # the first worker finishing late still records its result.
+    queue.finish(item, dict(num_examples=2))
+    assert queue.list(DONE) == [item.id]
+
+
+def test_renew(tmp_path):
+    queue = make_queue(tmp_path, num_items=1, lease_seconds=60)
+    item = queue.claim('worker')
+    age(queue, RUNNING, item.id, 120)
+    queue.renew(item)
+    queue.reclaim_expired()
+    assert queue.list(RUNNING) == [item.id]
+
+
+def test_retry_failed(tmp_path):
+    queue = make_queue(tmp_path, num_items=1)
+    for attempt in range(1, workqueue.MAX_ATTEMPTS):
+        item = queue.claim('worker')
+        queue.finish(item, None)
+        assert queue.list(PENDING) == [item.id]
+        assert queue.read(PENDING, item.id).attempts == attempt
+    queue.finish(queue.claim('worker'), None)
+    assert queue.list(FAILED) == [item.id]
+    assert queue.is_drained()
+
+    assert queue.requeue_failed() == [item.id]
+    assert queue.read(PENDING, item.id).attempts == 0
+    assert not queue.is_drained()
+
+
+def test_merge_raises_on_failed(tmp_path):
+    queue = make_queue(tmp_path, num_items=1)
+    for _ in range(workqueue.MAX_ATTEMPTS):
+        queue.finish(queue.claim('worker'), None)
+    engine = SimpleNamespace(under_tests=[])
+    with pytest.raises(RuntimeError):
+        workqueue.merge(engine, queue)
+    # requeued for the workers to run again.
+    assert queue.list(PENDING) == ['model-dataset-metric.000000']
+    assert not queue.list(FAILED)
@@ -34,8 +34,6 @@ setup(
         'nltk',
         'embeddingbased',
         'lsdscc',
-        'rouge',
-        'distinct_n',
 
         # corr:
         'seaborn',
@@ -43,5 +41,14 @@ setup(
         'pandas',
         'scikit-learn',
         'scipy',
-    ]
+    ],
+    extras_require={
+        # the reference implementations that the tests under script/ compare with.
+        'test': [
+            'pytest',
+            # the rouge module of neural-dialogue-metrics.
+            'easy-rouge',
+            'distinct_n',
+        ],
+    },
 )